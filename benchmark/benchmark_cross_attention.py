@@ -0,0 +1,87 @@
+"""
+PCT_encoder中六个cross_transformer在nn.MultiheadAttention与F.scaled_dot_product_attention两种实现下的耗时与一致性，
+两种实现加载相同的权重，输入形状与2048个点、latent_size=512的IBSNet一致
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from models.models_cross_attention import cross_transformer, PCT_encoder
+
+CHANNEL = 64
+POINTS_NUM = 2048
+# 名称: (输入维度, 输出维度, query点数, key点数)，与PCT_encoder.forward中的调用一致
+BLOCKS = {
+    "sa1": (CHANNEL, CHANNEL, POINTS_NUM // 4, POINTS_NUM),
+    "sa1_1": (CHANNEL * 2, CHANNEL * 2, POINTS_NUM // 4, POINTS_NUM // 4),
+    "sa2": (CHANNEL * 2, CHANNEL * 2, POINTS_NUM // 8, POINTS_NUM // 4),
+    "sa2_1": (CHANNEL * 4, CHANNEL * 4, POINTS_NUM // 8, POINTS_NUM // 8),
+    "sa3": (CHANNEL * 4, CHANNEL * 4, POINTS_NUM // 16, POINTS_NUM // 8),
+    "sa3_1": (CHANNEL * 8, CHANNEL * 8, POINTS_NUM // 16, POINTS_NUM // 16),
+}
+
+
+def get_module_pair(module_fn):
+    torch.manual_seed(0)
+    module = module_fn(False).eval()
+    module_fast = module_fn(True).eval()
+    module_fast.load_state_dict(module.state_dict())
+    return module, module_fast
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def time_module(module, inputs, repeat):
+    module(*inputs)
+    synchronize(inputs[0].device)
+    time_begin = time.perf_counter()
+    for _ in range(repeat):
+        module(*inputs)
+    synchronize(inputs[0].device)
+    return (time.perf_counter() - time_begin) / repeat
+
+
+def compare(name, module_fn, inputs, batch_size, repeat):
+    module, module_fast = get_module_pair(module_fn)
+    max_diff = (module(*inputs) - module_fast(*inputs)).abs().max().item()
+    seconds = time_module(module, inputs, repeat)
+    seconds_fast = time_module(module_fast, inputs, repeat)
+    print("{:<8} mha: {:>8.2f} ms {:>8.1f} samples/s | sdpa: {:>8.2f} ms {:>8.1f} samples/s | "
+          "speedup: {:.2f}x, max abs diff: {:.2e}".format(name, seconds * 1e3, batch_size / seconds,
+                                                         seconds_fast * 1e3, batch_size / seconds_fast,
+                                                         seconds / seconds_fast, max_diff))
+
+
+def benchmark(device, batch_size, repeat=10):
+    print("device: {}, batch size: {}".format(device, batch_size))
+    for name, (d_model, d_model_out, query_num, key_num) in BLOCKS.items():
+        torch.manual_seed(1)
+        src1 = torch.randn(batch_size, d_model, query_num, device=device)
+        src2 = torch.randn(batch_size, d_model, key_num, device=device)
+        compare(name, lambda fast: cross_transformer(d_model, d_model_out, fast_attention=fast).to(device),
+                (src1, src2), batch_size, repeat)
+
+    torch.manual_seed(1)
+    points = torch.rand(batch_size, 3, POINTS_NUM, device=device) - 0.5
+    fps_idx = torch.cat([torch.arange(n, device=device).int().expand(batch_size, -1)
+                         for n in (POINTS_NUM // 4, POINTS_NUM // 8, POINTS_NUM // 16)], dim=1)
+    # 使用固定的fps索引，只比较注意力部分的差异
+    compare("encoder", lambda fast: PCT_encoder(CHANNEL, fast_attention=fast).to(device),
+            (points, fps_idx), batch_size, repeat)
+
+
+if __name__ == '__main__':
+    torch.set_grad_enabled(False)
+    print("threads: {}".format(torch.get_num_threads()))
+    for batch_size in (1, 4):
+        benchmark(torch.device("cpu"), batch_size)
+    if torch.cuda.is_available():
+        for batch_size in (1, 16):
+            benchmark(torch.device("cuda"), batch_size)
@@ -0,0 +1,89 @@
+"""
+IM_Decoder逐查询点拼接latent与分解解码在CPU上的耗时和峰值内存对比，每个形状50000个查询点
+每种情况在单独的子进程中运行，峰值内存以子进程的最大常驻内存相对于运行前的增量计
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+DECODERS = {
+    # 名称: (模块, latent维度)
+    "cross_attention": ("models.models_cross_attention", 2 * 512),
+    "transformer": ("models.models_transformer", 2 * 256),
+    "IMNet": ("models.models_IMNet", 256),
+}
+
+
+def get_decoder(name):
+    module_name, latent_dim = DECODERS[name]
+    module = __import__(module_name, fromlist=["IM_Decoder"])
+    torch.manual_seed(0)
+    return module.IM_Decoder(latent_dim + 3).eval(), latent_dim
+
+
+def get_inputs(latent_dim, batch_size, query_points_num):
+    torch.manual_seed(1)
+    latent = torch.randn(batch_size, latent_dim)
+    query_points = torch.rand(batch_size * query_points_num, 3) - 0.5
+    return latent, query_points
+
+
+def run_decoder(decoder, latent, query_points, factorized):
+    if factorized:
+        return decoder.forward_factorized(latent, query_points)
+    query_points_num = query_points.shape[0] // latent.shape[0]
+    return decoder(torch.cat([latent.repeat_interleave(query_points_num, dim=0), query_points], 1))
+
+
+def measure(name, factorized, batch_size, query_points_num, repeat, queue):
+    torch.set_grad_enabled(False)
+    decoder, latent_dim = get_decoder(name)
+    latent, query_points = get_inputs(latent_dim, batch_size, query_points_num)
+    rss_begin = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    run_decoder(decoder, latent, query_points, factorized)
+    time_begin = time.perf_counter()
+    for _ in range(repeat):
+        run_decoder(decoder, latent, query_points, factorized)
+    seconds = (time.perf_counter() - time_begin) / repeat
+    rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((seconds, (rss_end - rss_begin) / 1024))
+
+
+def check_equivalence(name, batch_size=2, query_points_num=1000):
+    torch.set_grad_enabled(False)
+    decoder, latent_dim = get_decoder(name)
+    latent, query_points = get_inputs(latent_dim, batch_size, query_points_num)
+    outputs = run_decoder(decoder, latent, query_points, False)
+    outputs_factorized = run_decoder(decoder, latent, query_points, True)
+    if not isinstance(outputs, tuple):
+        outputs, outputs_factorized = (outputs,), (outputs_factorized,)
+    return max((a - b).abs().max().item() for a, b in zip(outputs, outputs_factorized))
+
+
+if __name__ == '__main__':
+    batch_size = 1
+    query_points_num = 50000
+    repeat = 5
+    context = multiprocessing.get_context("spawn")
+    print("batch size: {}, queries per shape: {}, threads: {}".format(batch_size, query_points_num,
+                                                                       torch.get_num_threads()))
+    for name in DECODERS:
+        results = []
+        for factorized in (False, True):
+            queue = context.Queue()
+            process = context.Process(target=measure,
+                                      args=(name, factorized, batch_size, query_points_num, repeat, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+        (seconds, memory), (seconds_factorized, memory_factorized) = results
+        print("{:<16} concat: {:>8.1f} ms {:>7.1f} MB | factorized: {:>8.1f} ms {:>7.1f} MB | "
+              "speedup: {:.2f}x, max abs diff: {:.2e}".format(name, seconds * 1e3, memory, seconds_factorized * 1e3,
+                                                             memory_factorized, seconds / seconds_factorized,
+                                                             check_equivalence(name)))
@@ -0,0 +1,65 @@
+"""
+PCT_encoder中三个GDP阶段（2048->512，512->256，256->128）furthest point sampling与gather的耗时
+CPU上使用models.pn2_ops的PyTorch实现；有GPU且安装了pointnet2_ops时同时给出CUDA实现的耗时，并检查两者选点是否一致
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from models import pn2_ops
+
+STAGES = [(2048, 512), (512, 256), (256, 128)]
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def time_stage(xyz, features, npoint, fps_fn, gather_fn, repeat):
+    fps_fn(xyz, npoint)
+    synchronize(xyz.device)
+    time_begin = time.perf_counter()
+    for _ in range(repeat):
+        idx = fps_fn(xyz, npoint)
+    synchronize(xyz.device)
+    fps_seconds = (time.perf_counter() - time_begin) / repeat
+
+    time_begin = time.perf_counter()
+    for _ in range(repeat):
+        gather_fn(features, idx)
+    synchronize(xyz.device)
+    gather_seconds = (time.perf_counter() - time_begin) / repeat
+    return idx, fps_seconds, gather_seconds
+
+
+def benchmark(device, batch_size, channel=64, repeat=10):
+    torch.manual_seed(0)
+    print("device: {}, batch size: {}".format(device, batch_size))
+    for points_num, npoint in STAGES:
+        xyz = torch.rand(batch_size, points_num, 3, device=device) - 0.5
+        features = torch.rand(batch_size, channel, points_num, device=device)
+        idx, fps_seconds, gather_seconds = time_stage(xyz, features, npoint, pn2_ops.furthest_point_sample_torch,
+                                                      pn2_ops.gather_operation_torch, repeat)
+        line = "{:>5} -> {:<4} torch fps: {:>8.2f} ms, gather: {:>6.3f} ms".format(points_num, npoint,
+                                                                                  fps_seconds * 1e3,
+                                                                                  gather_seconds * 1e3)
+        if device.type == "cuda" and pn2_ops.is_cuda_ops_available():
+            idx_cuda, fps_seconds, gather_seconds = time_stage(xyz, features, npoint, pn2_ops.furthest_point_sample,
+                                                               pn2_ops.gather_operation, repeat)
+            line += " | cuda fps: {:>8.2f} ms, gather: {:>6.3f} ms, same indices: {}".format(
+                fps_seconds * 1e3, gather_seconds * 1e3, torch.equal(idx.int(), idx_cuda.int()))
+        print(line)
+
+
+if __name__ == '__main__':
+    print("threads: {}, pointnet2_ops available: {}".format(torch.get_num_threads(), pn2_ops.is_cuda_ops_available()))
+    for batch_size in (1, 4):
+        benchmark(torch.device("cpu"), batch_size)
+    if torch.cuda.is_available():
+        for batch_size in (1, 4):
+            benchmark(torch.device("cuda"), batch_size)
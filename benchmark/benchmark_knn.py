@@ -0,0 +1,82 @@
+"""
+pn2_utils.query_knn在CPU上的耗时和峰值内存：原先的完整距离矩阵+argsort、完整距离矩阵+topk、按内存上限分块+topk
+每种情况在单独的子进程中运行，峰值内存以子进程的最大常驻内存相对于运行前的增量计
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from models import pn2_utils
+
+# (点数N, 查询点数S)，S=N时对应Transformer中的自身knn，S=N/4时对应采样后分组
+CASES = [(2048, 2048), (2048, 512), (16384, 4096), (16384, 16384)]
+NSAMPLE = 16
+# 完整距离矩阵+argsort的内存约为距离矩阵的4倍，超过该值时跳过
+ARGSORT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def query_knn_argsort(nsample, xyz, new_xyz):
+    sqrdists = pn2_utils.square_distance(new_xyz, xyz)
+    return torch.argsort(sqrdists, dim=-1, descending=False)[:, :, :nsample].int()
+
+
+METHODS = {
+    "argsort": query_knn_argsort,
+    "topk": lambda nsample, xyz, new_xyz: pn2_utils.query_knn(nsample, xyz, new_xyz, max_bytes=None),
+    "topk chunked": pn2_utils.query_knn,
+}
+
+
+def get_inputs(batch_size, points_num, query_num):
+    torch.manual_seed(0)
+    xyz = torch.rand(batch_size, points_num, 3) - 0.5
+    return xyz, xyz[:, :query_num].contiguous()
+
+
+def measure(method, batch_size, points_num, query_num, repeat, queue):
+    torch.set_grad_enabled(False)
+    xyz, new_xyz = get_inputs(batch_size, points_num, query_num)
+    rss_begin = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    METHODS[method](NSAMPLE, xyz, new_xyz)
+    time_begin = time.perf_counter()
+    for _ in range(repeat):
+        METHODS[method](NSAMPLE, xyz, new_xyz)
+    seconds = (time.perf_counter() - time_begin) / repeat
+    rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((seconds, (rss_end - rss_begin) / 1024))
+
+
+def check_same_neighbors(batch_size=2, points_num=2048, query_num=512):
+    """topk与argsort得到的邻域集合是否一致（邻域内的顺序在距离相等时可能不同）"""
+    xyz, new_xyz = get_inputs(batch_size, points_num, query_num)
+    idx = query_knn_argsort(NSAMPLE, xyz, new_xyz).sort(-1)[0]
+    idx_chunked = pn2_utils.query_knn(NSAMPLE, xyz, new_xyz, max_bytes=1024 * 1024).sort(-1)[0]
+    return torch.equal(idx, idx_chunked)
+
+
+if __name__ == '__main__':
+    batch_size = 1
+    repeat = 3
+    context = multiprocessing.get_context("spawn")
+    print("batch size: {}, k: {}, threads: {}, chunk max bytes: {}, same neighbors: {}".format(
+        batch_size, NSAMPLE, torch.get_num_threads(), pn2_utils.KNN_CHUNK_MAX_BYTES, check_same_neighbors()))
+    for points_num, query_num in CASES:
+        line = "N: {:>5}, S: {:>5} |".format(points_num, query_num)
+        for method in METHODS:
+            if method == "argsort" and batch_size * points_num * query_num * 4 * 4 > ARGSORT_MAX_BYTES:
+                line += " {}: skipped |".format(method)
+                continue
+            queue = context.Queue()
+            process = context.Process(target=measure,
+                                      args=(method, batch_size, points_num, query_num, repeat, queue))
+            process.start()
+            seconds, memory = queue.get()
+            process.join()
+            line += " {}: {:>8.1f} ms {:>7.1f} MB |".format(method, seconds * 1e3, memory)
+        print(line)
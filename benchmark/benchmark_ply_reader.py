@@ -0,0 +1,52 @@
+"""
+对比open3d与geometry_utils.read_ply_points读取2048点残缺点云的耗时
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import open3d as o3d
+import torch
+
+from utils import geometry_utils
+
+
+def read_by_open3d(path):
+    pcd = o3d.io.read_point_cloud(path)
+    return torch.from_numpy(np.asarray(pcd.points).astype(np.float32))
+
+
+def benchmark(read_fn, path, repeat):
+    read_fn(path)
+    time_begin = time.perf_counter()
+    for _ in range(repeat):
+        read_fn(path)
+    return (time.perf_counter() - time_begin) / repeat
+
+
+if __name__ == '__main__':
+    points_num = 2048
+    repeat = 1000
+    points = np.random.uniform(-0.5, 0.5, (points_num, 3))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pcd = geometry_utils.get_pcd_from_np(points)
+        files = {
+            "open3d binary(double)": os.path.join(tmp_dir, "o3d_binary.ply"),
+            "open3d ascii(double)": os.path.join(tmp_dir, "o3d_ascii.ply"),
+            "float binary": os.path.join(tmp_dir, "float_binary.ply"),
+        }
+        o3d.io.write_point_cloud(files["open3d binary(double)"], pcd)
+        o3d.io.write_point_cloud(files["open3d ascii(double)"], pcd, write_ascii=True)
+        geometry_utils.write_ply_points(files["float binary"], points)
+
+        for name, path in files.items():
+            assert np.allclose(read_by_open3d(path).numpy(), geometry_utils.read_ply_points(path), atol=1e-6)
+            time_o3d = benchmark(read_by_open3d, path, repeat)
+            time_np = benchmark(geometry_utils.read_ply_points_tensor, path, repeat)
+            print("{:<24} open3d: {:.1f} us, read_ply_points: {:.1f} us, speedup: {:.2f}x"
+                  .format(name, time_o3d * 1e6, time_np * 1e6, time_o3d / time_np))
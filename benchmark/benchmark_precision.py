@@ -0,0 +1,81 @@
+"""
+不同训练精度（TrainOptions.Precision）下训练step的吞吐量与损失曲线对比
+与utils.train_utils.Trainer相同：前向在autocast下进行，损失在float32下计算，fp16用GradScaler缩放梯度
+各精度使用相同的初始权重与相同的合成batch序列
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from utils.train_utils import PRECISION_TYPES, get_udf_losses, to_float32
+
+MODELS = {
+    # 名称: 模块
+    "cross_attention": "models.models_cross_attention",
+    "grasping_field": "models.models_grasping_field",
+}
+
+
+def get_batches(steps, batch_size, points_num, queries_per_item, device):
+    generator = torch.Generator().manual_seed(0)
+    batches = []
+    for _ in range(steps):
+        pcd1 = torch.rand(batch_size, points_num, 3, generator=generator) - 0.5
+        pcd2 = torch.rand(batch_size, points_num, 3, generator=generator) - 0.5
+        udf_data = torch.rand(batch_size * queries_per_item, 5, generator=generator) * 0.2
+        batches.append((pcd1.to(device), pcd2.to(device), udf_data.to(device)))
+    return batches
+
+
+def train(name, precision, batches, device):
+    """
+    Returns:
+        seconds_per_step: 除第一个step外的平均耗时
+        losses: 每个step的L2损失
+    """
+    module = __import__(MODELS[name], fromlist=["IBSNet"])
+    torch.manual_seed(0)
+    network = module.IBSNet().to(device).train()
+    optimizer = torch.optim.Adam(network.parameters(), lr=1e-4)
+    amp_dtype = torch.float16 if precision == "fp16" else torch.bfloat16
+    grad_scaler = torch.amp.GradScaler(device.type, enabled=precision == "fp16")
+
+    losses = []
+    time_begin = None
+    for step, (pcd1, pcd2, udf_data) in enumerate(batches):
+        if step == 1:
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            time_begin = time.perf_counter()
+        optimizer.zero_grad()
+        with torch.autocast(device.type, dtype=amp_dtype, enabled=precision != "fp32"):
+            udf_preds = network(pcd1, pcd2, udf_data[:, 0:3])
+        loss = get_udf_losses(to_float32(udf_preds), (udf_data[:, 3], udf_data[:, 4]))["loss_l2"]
+        grad_scaler.scale(loss).backward()
+        grad_scaler.step(optimizer)
+        grad_scaler.update()
+        losses.append(loss.item())
+    return (time.perf_counter() - time_begin) / (len(batches) - 1), losses
+
+
+def benchmark(device, batch_size=2, points_num=2048, queries_per_item=5000, steps=6):
+    print("device: {}, batch size: {}, queries per item: {}".format(device, batch_size, queries_per_item))
+    batches = get_batches(steps, batch_size, points_num, queries_per_item, device)
+    for name in MODELS:
+        results = {precision: train(name, precision, batches, device) for precision in PRECISION_TYPES}
+        fp32_seconds = results["fp32"][0]
+        for precision, (seconds, losses) in results.items():
+            print("{:<16} {:<5} {:>8.2f} ms/step | {:>9.0f} queries/s | speedup: {:.2f}x | loss_l2: {}".format(
+                name, precision, seconds * 1e3, batch_size * queries_per_item / seconds, fp32_seconds / seconds,
+                " ".join("{:.5f}".format(loss) for loss in losses)))
+
+
+if __name__ == '__main__':
+    print("threads: {}".format(torch.get_num_threads()))
+    benchmark(torch.device("cpu"))
+    if torch.cuda.is_available():
+        benchmark(torch.device("cuda"))
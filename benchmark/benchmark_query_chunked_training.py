@@ -0,0 +1,154 @@
+"""
+按查询点分块训练（TrainOptions.QueryChunkSize）与不分块训练的对比：
+    梯度的最大误差（两种方式加载相同的权重、使用相同的batch），
+    grasping_field的DeepSDF解码器训练时使用dropout，分块后各块的mask不同，两种方式只在期望上相等，检查梯度时关闭dropout
+    一次训练step的耗时与峰值内存，CPU上每种方式在单独的子进程中运行并读取常驻内存的峰值（Linux），CUDA上读取max_memory_allocated
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from utils.train_utils import Trainer
+
+MODELS = {
+    # 名称: 模块
+    "cross_attention": "models.models_cross_attention",
+    "grasping_field": "models.models_grasping_field",
+}
+
+
+def get_trainer(name, device, query_chunk_size, save_dir, dropout=True):
+    module = __import__(MODELS[name], fromlist=["IBSNet"])
+    torch.manual_seed(0)
+    network = module.IBSNet().to(device).train()
+    if not dropout:
+        for submodule in network.modules():
+            if hasattr(submodule, "dropout_prob"):
+                submodule.dropout_prob = 0.0
+    optimizer = torch.optim.Adam(network.parameters(), lr=1e-4)
+    specs = {
+        "TAG": "benchmark",
+        "Device": str(device),
+        "ParaSaveDir": save_dir,
+        "TrainOptions": {"QueryChunkSize": query_chunk_size, "CheckpointOptions": {"Async": False}},
+        "LogOptions": {"TAG": "benchmark", "Type": "train", "LogDir": os.path.join(save_dir, "logs"),
+                       "GlobalLevel": "WARNING", "FileLevel": "WARNING", "StreamLevel": "WARNING", "Mode": "w"}
+    }
+    return Trainer(specs, network, optimizer, None, None, None,
+                   encode=lambda network, inputs: (network.encode(*inputs[:2]), inputs[2]))
+
+
+def reset_peak_rss():
+    """将常驻内存的峰值（VmHWM）重置为当前值，子进程的峰值从fork时继承了父进程的峰值"""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def get_peak_rss():
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_batch(batch_size, points_num, queries_per_item, device):
+    generator = torch.Generator().manual_seed(1)
+    pcd1 = torch.rand(batch_size, points_num, 3, generator=generator) - 0.5
+    pcd2 = torch.rand(batch_size, points_num, 3, generator=generator) - 0.5
+    udf_data = torch.rand(batch_size * queries_per_item, 5, generator=generator) * 0.2
+    udf_data = udf_data.to(device)
+    return (pcd1.to(device), pcd2.to(device), udf_data[:, 0:3]), (udf_data[:, 3], udf_data[:, 4])
+
+
+def get_gradients(trainer, inputs, udf_gts):
+    trainer.optimizer.zero_grad()
+    if trainer.query_chunk_size is None:
+        losses = trainer.backward(inputs, udf_gts)
+    else:
+        losses = trainer.backward_query_chunked(inputs, udf_gts)
+    return losses, {name: param.grad.clone() for name, param in trainer.network.named_parameters()
+                    if param.grad is not None}
+
+
+def check_gradients(name, device, query_chunk_size, batch_size, points_num, queries_per_item):
+    inputs, udf_gts = get_batch(batch_size, points_num, queries_per_item, device)
+    with tempfile.TemporaryDirectory() as save_dir:
+        losses, grads = get_gradients(get_trainer(name, device, None, save_dir, dropout=False), inputs, udf_gts)
+        losses_chunked, grads_chunked = get_gradients(get_trainer(name, device, query_chunk_size, save_dir,
+                                                                  dropout=False), inputs, udf_gts)
+    max_grad_diff = max((grads[key] - grads_chunked[key]).abs().max().item() for key in grads)
+    max_grad = max(grad.abs().max().item() for grad in grads.values())
+    loss_diff = abs(losses["loss_l2"].item() - losses_chunked["loss_l2"].item())
+    return max_grad_diff, max_grad, loss_diff, set(grads) == set(grads_chunked)
+
+
+def measure_step(name, device, query_chunk_size, batch_size, points_num, queries_per_item):
+    """
+    Returns:
+        seconds: 一次前向与反向的耗时
+        peak_bytes: 峰值内存
+    """
+    inputs, udf_gts = get_batch(batch_size, points_num, queries_per_item, device)
+    with tempfile.TemporaryDirectory() as save_dir:
+        trainer = get_trainer(name, device, query_chunk_size, save_dir)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+        else:
+            reset_peak_rss()
+        time_begin = time.perf_counter()
+        get_gradients(trainer, inputs, udf_gts)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            return time.perf_counter() - time_begin, torch.cuda.max_memory_allocated(device)
+        return time.perf_counter() - time_begin, get_peak_rss()
+
+
+def measure_step_subprocess(name, query_chunk_size, batch_size, points_num, queries_per_item):
+    """CPU上的常驻内存峰值只能按进程统计，每种方式在新的子进程中运行"""
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "measure", name, str(query_chunk_size),
+                             str(batch_size), str(points_num), str(queries_per_item)],
+                            check=True, capture_output=True, text=True).stdout
+    seconds, peak_bytes = output.strip().split("\n")[-1].split()
+    return float(seconds), int(peak_bytes)
+
+
+def benchmark(device, batch_size=2, points_num=2048, queries_per_item=10000, query_chunk_size=2500):
+    print("device: {}, batch size: {}, queries per item: {}, query chunk size: {}".format(
+        device, batch_size, queries_per_item, query_chunk_size))
+    for name in MODELS:
+        results = dict()
+        for chunk_size in [None, query_chunk_size]:
+            if device.type == "cuda":
+                results[chunk_size] = measure_step(name, device, chunk_size, batch_size, points_num, queries_per_item)
+            else:
+                results[chunk_size] = measure_step_subprocess(name, chunk_size, batch_size, points_num,
+                                                              queries_per_item)
+        max_grad_diff, max_grad, loss_diff, same_params = check_gradients(name, device, query_chunk_size, batch_size,
+                                                                          points_num, queries_per_item)
+        (seconds, peak_bytes), (seconds_chunked, peak_bytes_chunked) = results[None], results[query_chunk_size]
+        print("{:<16} unchunked: {:>8.2f} s, {:>7.0f} MB | chunked: {:>8.2f} s, {:>7.0f} MB | "
+              "max grad diff: {:.2e} (max grad {:.2e}), loss diff: {:.2e}, same params: {}".format(
+                  name, seconds, peak_bytes / 2 ** 20, seconds_chunked, peak_bytes_chunked / 2 ** 20,
+                  max_grad_diff, max_grad, loss_diff, same_params))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "measure":
+        name, chunk_size, batch_size, points_num, queries_per_item = sys.argv[2:]
+        seconds, peak_bytes = measure_step(name, torch.device("cpu"), None if chunk_size == "None" else int(chunk_size),
+                                           int(batch_size), int(points_num), int(queries_per_item))
+        print(seconds, peak_bytes)
+    else:
+        print("threads: {}".format(torch.get_num_threads()))
+        benchmark(torch.device("cpu"))
+        if torch.cuda.is_available():
+            benchmark(torch.device("cuda"))
@@ -0,0 +1,57 @@
+"""
+random_utils批量采样的吞吐量，每种采样方式采集10^6个点
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from utils import random_utils
+
+
+def legacy_points_in_sphere(num_points, center=(0, 0, 0), radius=0.5):
+    """重写前逐点生成的实现，仅用于对比"""
+    points = []
+    for _ in range(num_points):
+        u = np.random.uniform(0, 1)
+        v = np.random.uniform(0, 1)
+        w = np.random.uniform(0, 1)
+        r = radius * (u ** (1 / 3))
+        theta = 2 * np.pi * v
+        phi = np.arccos(2 * w - 1)
+        points.append([center[0] + r * np.sin(phi) * np.cos(theta),
+                       center[1] + r * np.sin(phi) * np.sin(theta),
+                       center[2] + r * np.cos(phi)])
+    return points
+
+
+def benchmark(name, fn, points_num):
+    time_begin = time.perf_counter()
+    points = fn()
+    seconds = time.perf_counter() - time_begin
+    assert points.shape == (points_num, 3) and points.dtype == np.float32
+    print("{:<20} {:>8.1f} ms, {:>8.2f} Mpoints/s".format(name, seconds * 1e3, points_num / seconds / 1e6))
+
+
+if __name__ == '__main__':
+    points_num = 1000000
+    rng = np.random.default_rng(0)
+    seeds = random_utils.sample_in_sphere(points_num // 5, rng=rng)
+
+    benchmark("sphere", lambda: random_utils.sample_in_sphere(points_num, rng=rng), points_num)
+    benchmark("aabb", lambda: random_utils.sample_in_aabb((-0.5, -0.5, -0.5), (0.5, 0.5, 0.5), points_num, rng=rng),
+              points_num)
+    benchmark("aabb & sphere", lambda: random_utils.sample_in_aabb_sphere((-0.2, -0.6, -0.6), (0.6, 0.6, 0.6),
+                                                                         points_num, rng=rng), points_num)
+    benchmark("seed ball", lambda: random_utils.sample_from_seeds(seeds, 5, 0.03, rng=rng), points_num)
+
+    # 逐点实现太慢，只采集10^4个点后按比例换算
+    legacy_num = 10000
+    time_begin = time.perf_counter()
+    legacy_points_in_sphere(legacy_num)
+    seconds = (time.perf_counter() - time_begin) * points_num / legacy_num
+    print("{:<20} {:>8.1f} ms, {:>8.2f} Mpoints/s (extrapolated)".format("legacy sphere", seconds * 1e3,
+                                                                        points_num / seconds / 1e6))
@@ -0,0 +1,80 @@
+"""
+虚拟扫描器单视角耗时，分辨率等参数取自preprocess/configs/get_scan_pcd.json
+默认以两个相邻的球作为场景，也可以通过命令行传入两个mesh的路径
+用法: python benchmark/benchmark_scan_pcd.py [mesh1 mesh2]
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "preprocess"))
+
+import open3d as o3d
+
+from get_scan_pcd import ScanPcdGenerator
+from utils import path_utils
+
+
+def get_meshes():
+    if len(sys.argv) == 3:
+        return o3d.io.read_triangle_mesh(sys.argv[1]), o3d.io.read_triangle_mesh(sys.argv[2])
+    mesh1 = o3d.geometry.TriangleMesh.create_sphere(radius=0.2, resolution=60).translate((-0.21, 0, 0))
+    mesh2 = o3d.geometry.TriangleMesh.create_sphere(radius=0.2, resolution=60).translate((0.21, 0, 0))
+    return mesh1, mesh2
+
+
+def benchmark_stages(generator: ScanPcdGenerator, theta, phi, repeat=5):
+    """依次计时光线生成、扩充、求交和交点重建"""
+    scan_options = generator.specs["scan_options"]
+    stage_seconds = {"projection": 0., "expand": 0., "rays": 0., "cast": 0., "hit points": 0.}
+    for _ in range(repeat):
+        time_begin = time.perf_counter()
+        eye = generator.get_view_point(theta, phi, scan_options["camera_ridius"])
+        plane = generator.get_projection_plane(eye=eye, fov_deg=scan_options["fov_deg"])
+        pixel_width, pixel_height, points = generator.get_projection_points(plane, generator.resolution_width,
+                                                                            generator.resolution_height)
+        time_projection = time.perf_counter()
+        points = generator.expand_points_in_rectangle(scan_options["expand_points_num"], pixel_width, pixel_height,
+                                                      plane, points)
+        time_expand = time.perf_counter()
+        rays = generator.get_rays_from_projection_points(eye, points)
+        time_rays = time.perf_counter()
+        cast_result = generator.get_ray_cast_result(generator.scene, rays)
+        time_cast = time.perf_counter()
+        generator.get_cur_view_pcd(cast_result)
+        time_hit = time.perf_counter()
+
+        stage_seconds["projection"] += time_projection - time_begin
+        stage_seconds["expand"] += time_expand - time_projection
+        stage_seconds["rays"] += time_rays - time_expand
+        stage_seconds["cast"] += time_cast - time_rays
+        stage_seconds["hit points"] += time_hit - time_cast
+    print("rays per view: {}".format(rays.shape[0]))
+    for name, seconds in stage_seconds.items():
+        print("{:<12} {:>8.2f} ms".format(name, seconds / repeat * 1e3))
+
+
+if __name__ == '__main__':
+    specs = path_utils.read_config(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                "preprocess", "configs", "get_scan_pcd.json"))
+    logger = logging.getLogger("benchmark_scan_pcd")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    mesh1, mesh2 = get_meshes()
+    generator = ScanPcdGenerator(specs, False, mesh1, mesh2, logger)
+    print("resolution: {} x {}, expand_points_num: {}".format(generator.resolution_width,
+                                                             generator.resolution_height,
+                                                             specs["scan_options"]["expand_points_num"]))
+    benchmark_stages(generator, 90, 90)
+
+    view_list = generator.get_view_list()
+    for multi_view in (False, True):
+        specs["scan_options"]["multi_view"] = multi_view
+        time_begin = time.perf_counter()
+        pcd1_partial_list, _, _ = generator.generate_scan_pcd()
+        seconds = time.perf_counter() - time_begin
+        print("full scan, multi_view={}: {:.3f} s/view, {} of {} views succeeded"
+              .format(multi_view, seconds / len(view_list), len(pcd1_partial_list), len(view_list)))
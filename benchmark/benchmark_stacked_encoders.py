@@ -0,0 +1,66 @@
+"""
+双物体IBSNet中两个编码器逐个前向与堆叠为一次vmap前向的encode耗时对比，batch size为1，对应重建脚本中的推理
+两种方式加载相同的权重，同时给出latent的最大误差
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+MODELS = {
+    # 名称: (模块, 构造参数)
+    "cross_attention": ("models.models_cross_attention", {}),
+    "cross_attention_sdpa": ("models.models_cross_attention", {"fast_attention": True}),
+    "transformer": ("models.models_transformer", {}),
+    "grasping_field": ("models.models_grasping_field", {}),
+}
+
+
+def get_model_pair(name, device):
+    module_name, kwargs = MODELS[name]
+    module = __import__(module_name, fromlist=["IBSNet"])
+    torch.manual_seed(0)
+    model = module.IBSNet(**kwargs).to(device).eval()
+    model_stacked = module.IBSNet(stacked_encoders=True, **kwargs).to(device).eval()
+    model_stacked.load_state_dict(model.state_dict())
+    return model, model_stacked
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def time_encode(model, pcd1, pcd2, repeat):
+    model.encode(pcd1, pcd2)
+    synchronize(pcd1.device)
+    time_begin = time.perf_counter()
+    for _ in range(repeat):
+        model.encode(pcd1, pcd2)
+    synchronize(pcd1.device)
+    return (time.perf_counter() - time_begin) / repeat
+
+
+def benchmark(device, batch_size=1, points_num=2048, repeat=10):
+    print("device: {}, batch size: {}".format(device, batch_size))
+    torch.manual_seed(1)
+    pcd1 = torch.rand(batch_size, points_num, 3, device=device) - 0.5
+    pcd2 = torch.rand(batch_size, points_num, 3, device=device) - 0.5
+    for name in MODELS:
+        model, model_stacked = get_model_pair(name, device)
+        max_diff = (model.encode(pcd1, pcd2) - model_stacked.encode(pcd1, pcd2)).abs().max().item()
+        seconds = time_encode(model, pcd1, pcd2, repeat)
+        seconds_stacked = time_encode(model_stacked, pcd1, pcd2, repeat)
+        print("{:<22} sequential: {:>8.2f} ms | stacked: {:>8.2f} ms | speedup: {:.2f}x, max abs diff: {:.2e}".format(
+            name, seconds * 1e3, seconds_stacked * 1e3, seconds / seconds_stacked, max_diff))
+
+
+if __name__ == '__main__':
+    torch.set_grad_enabled(False)
+    print("threads: {}".format(torch.get_num_threads()))
+    benchmark(torch.device("cpu"))
+    if torch.cuda.is_available():
+        benchmark(torch.device("cuda"))
@@ -0,0 +1,126 @@
+"""
+训练step耗时对比：
+    逐项阻塞拷贝pcd1、pcd2、xyz与两列udf并在每个step调用item()读取损失
+    packed_collate打包为一次（锁页内存上不阻塞的）拷贝，损失在device上累加，每个epoch只读取一次
+使用合成数据，两种方式的网络初始权重与batch顺序相同，同时给出两种方式最终的平均损失
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import torch.utils.data as data_utils
+
+from utils.train_utils import packed_collate, to_device, get_udf_losses
+
+MODELS = {
+    # 名称: 模块
+    "IMNet": "models.models_IMNet",
+    "grasping_field": "models.models_grasping_field",
+    "cross_attention": "models.models_cross_attention",
+}
+
+
+class SyntheticUDFSamples(data_utils.Dataset):
+    """与dataset_udfSamples.UDFSamples返回相同格式的随机数据"""
+
+    def __init__(self, length, points_num, queries_per_item):
+        generator = torch.Generator().manual_seed(0)
+        self.pcd1 = torch.rand(length, points_num, 3, generator=generator) - 0.5
+        self.pcd2 = torch.rand(length, points_num, 3, generator=generator) - 0.5
+        self.udf_data = torch.rand(length, queries_per_item, 5, generator=generator) - 0.5
+
+    def __len__(self):
+        return self.pcd1.shape[0]
+
+    def __getitem__(self, idx):
+        return self.pcd1[idx], self.pcd2[idx], self.udf_data[idx], idx
+
+
+def get_inputs(name, pcd1, pcd2, xyz):
+    return (pcd1, xyz) if name == "IMNet" else (pcd1, pcd2, xyz)
+
+
+def get_udf_gts(name, udf_gt1, udf_gt2):
+    return (udf_gt1,) if name == "IMNet" else (udf_gt1, udf_gt2)
+
+
+def step_legacy(name, network, optimizer, data, device, total_losses):
+    """重构前训练脚本中的写法"""
+    pcd1, pcd2, udf_data, indices = data
+    udf_data = udf_data.reshape(-1, 5)
+    xyz = udf_data[:, 0:3].to(device)
+    udf_gt1 = udf_data[:, 3].to(device)
+    udf_gt2 = udf_data[:, 4].to(device)
+    pcd1 = pcd1.to(device)
+    pcd2 = pcd2.to(device)
+
+    optimizer.zero_grad()
+    losses = get_udf_losses(network(*get_inputs(name, pcd1, pcd2, xyz)), get_udf_gts(name, udf_gt1, udf_gt2))
+    for loss_name, loss in losses.items():
+        total_losses[loss_name] = total_losses.get(loss_name, 0) + loss.item()
+    losses["loss_l2"].backward()
+    optimizer.step()
+
+
+def step_packed(name, network, optimizer, data, device, total_losses):
+    """utils.train_utils.Trainer中的写法"""
+    pcd1, pcd2, udf_data, indices = to_device(data, str(device))
+    udf_data = udf_data.reshape(-1, 5)
+
+    optimizer.zero_grad()
+    losses = get_udf_losses(network(*get_inputs(name, pcd1, pcd2, udf_data[:, 0:3])),
+                            get_udf_gts(name, udf_data[:, 3], udf_data[:, 4]))
+    for loss_name, loss in losses.items():
+        total_losses[loss_name] = total_losses.get(loss_name, 0) + loss.detach()
+    losses["loss_l2"].backward()
+    optimizer.step()
+
+
+def run_epoch(name, step_fn, collate_fn, dataset, device, batch_size):
+    """
+    Returns:
+        seconds_per_step: 平均每个step的耗时（含最后读取损失）
+        loss_l2: 平均L2损失
+    """
+    module = __import__(MODELS[name], fromlist=["IBSNet"])
+    torch.manual_seed(0)
+    network = module.IBSNet().to(device).train()
+    optimizer = torch.optim.Adam(network.parameters(), lr=1e-4)
+    kwargs = {"collate_fn": collate_fn} if collate_fn is not None else {}
+    dataloader = data_utils.DataLoader(dataset, batch_size=batch_size, shuffle=False,
+                                       pin_memory=device.type == "cuda", **kwargs)
+
+    # 第一个step作为预热，不计时
+    data_iter = iter(dataloader)
+    step_fn(name, network, optimizer, next(data_iter), device, dict())
+    total_losses = dict()
+    steps = 0
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    time_begin = time.perf_counter()
+    for data in data_iter:
+        step_fn(name, network, optimizer, data, device, total_losses)
+        steps += 1
+    loss_l2 = float(total_losses["loss_l2"]) / steps
+    return (time.perf_counter() - time_begin) / steps, loss_l2
+
+
+def benchmark(device, batch_size=4, points_num=2048, queries_per_item=5000, steps=6):
+    print("device: {}, batch size: {}, queries per item: {}".format(device, batch_size, queries_per_item))
+    dataset = SyntheticUDFSamples(batch_size * (steps + 1), points_num, queries_per_item)
+    for name in MODELS:
+        seconds, loss = run_epoch(name, step_legacy, None, dataset, device, batch_size)
+        seconds_packed, loss_packed = run_epoch(name, step_packed, packed_collate, dataset, device, batch_size)
+        print("{:<16} legacy: {:>8.2f} ms/step | packed, sync-free: {:>8.2f} ms/step | speedup: {:.2f}x, "
+              "loss_l2: {:.6f} / {:.6f}".format(name, seconds * 1e3, seconds_packed * 1e3, seconds / seconds_packed,
+                                                loss, loss_packed))
+
+
+if __name__ == '__main__':
+    print("threads: {}".format(torch.get_num_threads()))
+    benchmark(torch.device("cpu"))
+    if torch.cuda.is_available():
+        benchmark(torch.device("cuda"))
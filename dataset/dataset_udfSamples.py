@@ -1,16 +1,17 @@
 """
 数据集，能够同时加载一对残缺点云及对应的查询点数据
 """
+import json
 import logging
 import os
 import re
 
 import numpy as np
-import open3d as o3d
 import torch
 import torch.utils.data
 
 import workspace as ws
+from utils import geometry_utils
 
 
 def get_instance_filenames(data_source, split):
@@ -34,20 +35,50 @@ def get_instance_filenames(data_source, split):
     return npzfiles, pcd1files, pcd2files
 
 
-def unpack_udf_samples(filename):
-    data = np.load(filename)['data']
-    return torch.from_numpy(np.asarray(data, dtype=np.float32))
+def load_udf_samples(filename):
+    return np.asarray(np.load(filename)['data'], dtype=np.float32)
+
+
+def subsample_udf_samples(data, queries_per_item):
+    """随机选取queries_per_item行，data为内存映射时只读取被选中的行"""
+    if queries_per_item is None or queries_per_item >= data.shape[0]:
+        return data
+    # 使用torch的随机数，DataLoader每个epoch、每个worker的种子都不同；排序后按顺序读取，减少随机访问
+    rows = np.sort(torch.randperm(data.shape[0])[:queries_per_item].numpy())
+    return data[rows]
+
+
+def unpack_udf_samples(filename, udf_cache=None, scene_key=None, queries_per_item=None):
+    if udf_cache is None:
+        data = load_udf_samples(filename)
+    else:
+        data = udf_cache.get(scene_key, lambda: load_udf_samples(filename))
+    return torch.from_numpy(subsample_udf_samples(data, queries_per_item))
 
 
 def get_pcd_data(pcd_filename):
-    pcd = o3d.io.read_point_cloud(pcd_filename)
-    xyz_load = torch.from_numpy(np.asarray(pcd.points).astype(np.float32))
-    return xyz_load
+    return geometry_utils.read_ply_points_tensor(pcd_filename)
+
+
+def get_fps_index_filename(pcd_filename):
+    """残缺点云对应的fps索引文件，由preprocess/get_fps_index.py生成"""
+    return os.path.splitext(pcd_filename)[0] + ".npy"
+
+
+def get_fps_index_data(data_source, pcd_filename):
+    fps_index_filename = os.path.join(data_source, ws.fps_index_subdir, get_fps_index_filename(pcd_filename))
+    return torch.from_numpy(np.load(fps_index_filename).astype(np.int32, copy=False))
 
 
 class UDFSamples(torch.utils.data.Dataset):
-    def __init__(self, data_source, split):
+    """
+    load_fps_index为True时额外返回两个点云预先计算的fps索引，见preprocess/get_fps_index.py
+    """
+    def __init__(self, data_source, split, udf_cache=None, queries_per_item=None, load_fps_index=False):
         self.data_source = data_source
+        self.udf_cache = udf_cache
+        self.queries_per_item = queries_per_item
+        self.load_fps_index = load_fps_index
         self.npyfiles, self.pcd1files, self.pcd2files = get_instance_filenames(data_source, split)
 
     def __len__(self):
@@ -60,6 +91,84 @@ class UDFSamples(torch.utils.data.Dataset):
 
         pcd1 = get_pcd_data(pcd1_filename)
         pcd2 = get_pcd_data(pcd2_filename)
-        sdf_data = unpack_udf_samples(udf_filename)
+        sdf_data = unpack_udf_samples(udf_filename, self.udf_cache, self.npyfiles[idx], self.queries_per_item)
+
+        if self.load_fps_index:
+            fps_idx1 = get_fps_index_data(self.data_source, self.pcd1files[idx])
+            fps_idx2 = get_fps_index_data(self.data_source, self.pcd2files[idx])
+            return pcd1, pcd2, sdf_data, idx, fps_idx1, fps_idx2
+        return pcd1, pcd2, sdf_data, idx
+
+
+def get_packed_instances(split, index):
+    """返回各实例的key与偏移索引"""
+    instance_keys = []
+    instances = []
+    for dataset in split:
+        for class_name in split[dataset]:
+            for instance_name in split[dataset][class_name]:
+                instance_key = "/".join([dataset, class_name, instance_name])
+                if instance_key not in index["instances"]:
+                    logging.warning("Requested non-existent packed instance '{}'".format(instance_key))
+                    continue
+                instance_keys.append(instance_key)
+                instances.append(index["instances"][instance_key])
+
+    return instance_keys, instances
+
+
+class PackedUDFSamples(torch.utils.data.Dataset):
+    """
+    从preprocess/pack_udf_samples.py生成的分片中读取数据，分片以内存映射方式打开，返回的tensor不发生拷贝
+    """
+    def __init__(self, data_source, split, udf_cache=None, queries_per_item=None, load_fps_index=False):
+        if udf_cache is not None:
+            logging.warning("packed samples are memory-mapped already, udf cache is ignored")
+        self.data_source = data_source
+        self.pack_dir = os.path.join(data_source, ws.packed_samples_subdir)
+        with open(os.path.join(self.pack_dir, ws.packed_index_filename), "r") as f:
+            index = json.load(f)
+        self.pcd_shard_files = index["pcd_shards"]
+        self.udf_shard_files = index["udf_shards"]
+        self.instance_keys, self.instances = get_packed_instances(split, index)
+        self.queries_per_item = queries_per_item
+        self.load_fps_index = load_fps_index
+        # 在DataLoader的各个worker中首次读取时才打开
+        self.pcd_shards = None
+        self.udf_shards = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pcd_shards"] = None
+        state["udf_shards"] = None
+        return state
+
+    def open_shards(self):
+        # copy-on-write模式映射，torch.from_numpy得到的tensor可写且不拷贝底层数据
+        self.pcd_shards = [np.load(os.path.join(self.pack_dir, filename), mmap_mode="c")
+                           for filename in self.pcd_shard_files]
+        self.udf_shards = [np.load(os.path.join(self.pack_dir, filename), mmap_mode="c")
+                           for filename in self.udf_shard_files]
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __getitem__(self, idx):
+        if self.pcd_shards is None:
+            self.open_shards()
+        instance = self.instances[idx]
+
+        shard, offset, count = instance["pcd1"]
+        pcd1 = torch.from_numpy(self.pcd_shards[shard][offset: offset + count])
+        shard, offset, count = instance["pcd2"]
+        pcd2 = torch.from_numpy(self.pcd_shards[shard][offset: offset + count])
+        shard, offset, count = instance["udf"]
+        sdf_data = torch.from_numpy(subsample_udf_samples(self.udf_shards[shard][offset: offset + count],
+                                                          self.queries_per_item))
 
+        if self.load_fps_index:
+            instance_filename = os.path.join(*self.instance_keys[idx].split("/"))
+            fps_idx1 = get_fps_index_data(self.data_source, instance_filename + "_0.ply")
+            fps_idx2 = get_fps_index_data(self.data_source, instance_filename + "_1.ply")
+            return pcd1, pcd2, sdf_data, idx, fps_idx1, fps_idx2
         return pcd1, pcd2, sdf_data, idx
@@ -6,11 +6,11 @@ import os
 import re
 
 import numpy as np
-import open3d as o3d
 import torch
 import torch.utils.data
 
 import workspace as ws
+from utils import geometry_utils
 
 
 def get_instance_filenames(data_source, split, objIdx):
@@ -31,20 +31,36 @@ def get_instance_filenames(data_source, split, objIdx):
     return npzfiles, pcdfiles
 
 
-def unpack_udf_samples(filename):
-    data = np.load(filename)['data']
-    return torch.from_numpy(np.asarray(data, dtype=np.float32))
+def load_udf_samples(filename):
+    return np.asarray(np.load(filename)['data'], dtype=np.float32)
+
+
+def subsample_udf_samples(data, queries_per_item):
+    """随机选取queries_per_item行，data为内存映射时只读取被选中的行"""
+    if queries_per_item is None or queries_per_item >= data.shape[0]:
+        return data
+    # 使用torch的随机数，DataLoader每个epoch、每个worker的种子都不同；排序后按顺序读取，减少随机访问
+    rows = np.sort(torch.randperm(data.shape[0])[:queries_per_item].numpy())
+    return data[rows]
+
+
+def unpack_udf_samples(filename, udf_cache=None, scene_key=None, queries_per_item=None):
+    if udf_cache is None:
+        data = load_udf_samples(filename)
+    else:
+        data = udf_cache.get(scene_key, lambda: load_udf_samples(filename))
+    return torch.from_numpy(subsample_udf_samples(data, queries_per_item))
 
 
 def get_pcd_data(pcd_filename):
-    pcd = o3d.io.read_point_cloud(pcd_filename)
-    xyz_load = torch.from_numpy(np.asarray(pcd.points).astype(np.float32))
-    return xyz_load
+    return geometry_utils.read_ply_points_tensor(pcd_filename)
 
 
 class UDFSamples(torch.utils.data.Dataset):
-    def __init__(self, data_source, split, objIdx):
+    def __init__(self, data_source, split, objIdx, udf_cache=None, queries_per_item=None):
         self.data_source = data_source
+        self.udf_cache = udf_cache
+        self.queries_per_item = queries_per_item
         self.objIdx = objIdx
         self.npyfiles, self.pcdfiles = get_instance_filenames(data_source, split, objIdx)
 
@@ -56,6 +72,6 @@ class UDFSamples(torch.utils.data.Dataset):
         pcd_filename = os.path.join(self.data_source, ws.pcd_samples_subdir, self.pcdfiles[idx])
 
         pcd = get_pcd_data(pcd_filename)
-        sdf_data = unpack_udf_samples(udf_filename)
+        sdf_data = unpack_udf_samples(udf_filename, self.udf_cache, self.npyfiles[idx], self.queries_per_item)
 
         return pcd, sdf_data, idx
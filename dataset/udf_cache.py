@@ -0,0 +1,125 @@
+"""
+以场景为键的udf数据缓存，同一场景的所有视角、DataLoader的所有worker共享同一份解压后的数据
+缓存以未压缩的.npy文件存放在共享内存目录（默认/dev/shm）下，读取时内存映射，超出容量时按LRU淘汰
+"""
+import atexit
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+
+
+class SceneUDFCache:
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Args:
+            cache_dir: 缓存目录，应位于tmpfs上（如/dev/shm）才能起到共享内存的作用，由当前训练独占，
+                构造时清空，close或进程退出时删除
+            max_bytes: 缓存容量上限，单位字节
+        """
+        self.cache_dir = cache_dir
+        # 只有创建缓存的进程负责删除目录，DataLoader的worker继承该对象后不会删除
+        self.owner_pid = os.getpid()
+        self.max_bytes = int(max_bytes)
+        # 以下同步原语在创建DataLoader前构造，由各个worker继承，保证命中统计和淘汰在进程间一致
+        self.lock = multiprocessing.Lock()
+        self.hits = multiprocessing.Value("q", 0)
+        self.misses = multiprocessing.Value("q", 0)
+
+        # 清空上一次运行遗留的数据，避免udf数据重新生成后读到旧数据
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.makedirs(cache_dir)
+        # 训练异常退出时同样释放tmpfs占用的内存
+        atexit.register(self.close)
+
+    def close(self):
+        """删除缓存目录，可以重复调用"""
+        if os.getpid() == self.owner_pid and os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _get_cache_path(self, scene_key: str):
+        return os.path.join(self.cache_dir, scene_key.replace("/", "__").replace("\\", "__") + ".npy")
+
+    def _get_entries(self):
+        """返回[(修改时间, 大小, 路径)]，按最近使用时间从旧到新排列"""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".npy"):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def _evict(self, required_bytes: int):
+        entries = self._get_entries()
+        used_bytes = sum(entry[1] for entry in entries)
+        for _, size, path in entries:
+            if used_bytes + required_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            used_bytes -= size
+
+    def get(self, scene_key: str, load_fn):
+        """
+        获取场景的udf数据
+        Args:
+            scene_key: 场景的唯一标识，如udf文件的相对路径
+            load_fn: 未命中时调用，返回np.ndarray
+        Returns:
+            np.ndarray, 命中时为copy-on-write的内存映射
+        """
+        cache_path = self._get_cache_path(scene_key)
+        try:
+            data = np.load(cache_path, mmap_mode="c")
+            # 以修改时间记录最近一次使用，作为LRU的依据
+            os.utime(cache_path)
+            with self.hits.get_lock():
+                self.hits.value += 1
+            return data
+        except (FileNotFoundError, ValueError):
+            pass
+
+        with self.misses.get_lock():
+            self.misses.value += 1
+        data = np.asarray(load_fn(), dtype=np.float32)
+        if data.nbytes > self.max_bytes:
+            return data
+
+        with self.lock:
+            if not os.path.isfile(cache_path):
+                self._evict(data.nbytes)
+                # 先写临时文件再重命名，其他worker不会读到写了一半的文件
+                tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+                with open(tmp_path, "wb") as f:
+                    np.save(f, data)
+                os.replace(tmp_path, cache_path)
+        return data
+
+    def reset_stats(self):
+        """清零命中与未命中的计数，之后的get_stats只统计清零之后的访问"""
+        with self.hits.get_lock():
+            self.hits.value = 0
+        with self.misses.get_lock():
+            self.misses.value = 0
+
+    def get_stats(self):
+        used_bytes = sum(entry[1] for entry in self._get_entries())
+        hits = self.hits.value
+        misses = self.misses.value
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total > 0 else 0.0,
+            "used_bytes": used_bytes
+        }
@@ -1,4 +1,8 @@
 udf_samples_subdir = "udfData"
 pcd_samples_subdir = "pcdScan"
+packed_samples_subdir = "packedData"
+fps_index_subdir = "fpsIndex"
+
+packed_index_filename = "index.json"
 
 scene_patten = "scene\\d+\\.\\d+"
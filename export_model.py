@@ -0,0 +1,187 @@
+"""
+将utils/train_utils.save_model保存的checkpoint导出为TorchScript模型或ONNX模型，供重建脚本在不导入模型源码的情况下加载，
+并记录导出前后encode、decode的首次调用与稳定后的耗时
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import torch
+
+from utils import path_utils
+from utils.export_utils import get_model_class, get_pcd_num, trace_model, save_torchscript_model, \
+    load_torchscript_model, export_onnx, load_onnx_model, measure_latency
+from utils.device_utils import get_map_location
+
+
+def get_model(specs: dict, checkpoint, device):
+    model_name = specs.get("ModelOptions").get("Model")
+    factorized_decoder = specs.get("ModelOptions").get("FactorizedDecoder", False)
+    kwargs = {"factorized_decoder": factorized_decoder} if model_name != "grasping_field" else {}
+    model = get_model_class(model_name)(**kwargs)
+    model.load_state_dict(checkpoint["model"])
+    return model.to(device).eval()
+
+
+def get_inputs(pcd_num: int, pcd_points_num: int, query_points_num: int, device, seed: int):
+    torch.manual_seed(seed)
+    pcds = tuple(torch.rand(1, pcd_points_num, 3, device=device) - 0.5 for _ in range(pcd_num))
+    query_points = torch.rand(query_points_num, 3, device=device) - 0.5
+    return pcds, query_points
+
+
+def get_latency(model, pcd_num: int, pcd_points_num: int, query_points_num: int, repeat: int, device):
+    """
+    Returns:
+        {"encode": [首次调用耗时, 稳定后耗时], "decode": [首次调用耗时, 稳定后耗时]}
+    """
+    pcds, query_points = get_inputs(pcd_num, pcd_points_num, query_points_num, device, seed=0)
+    encode_latency = measure_latency(model.encode, pcds, repeat, device)
+    with torch.no_grad():
+        latent = model.encode(*pcds)
+    decode_latency = measure_latency(model.decode, (latent, query_points), repeat, device)
+    return {"encode": list(encode_latency), "decode": list(decode_latency)}
+
+
+def check_outputs(model, exported_model, pcd_num: int, pcd_points_num: int, query_points_num: int, device):
+    """导出前后对另一组随机输入的输出的最大误差，查询点数与导出时不同，同时检查可变的查询点数"""
+    pcds, query_points = get_inputs(pcd_num, pcd_points_num, query_points_num + 1, device, seed=1)
+    with torch.no_grad():
+        latent = model.encode(*pcds)
+        latent_exported = exported_model.encode(*pcds)
+        udf_pred = model.decode(latent, query_points)
+        udf_pred_exported = exported_model.decode(latent_exported, query_points)
+    if not isinstance(udf_pred, tuple):
+        udf_pred, udf_pred_exported = (udf_pred,), (udf_pred_exported,)
+    return max([(latent - latent_exported).abs().max().item()] +
+               [(a - b).abs().max().item() for a, b in zip(udf_pred, udf_pred_exported)])
+
+
+def export_torchscript(specs: dict, model, export_name: str, metadata: dict, device, logger):
+    """
+    Returns:
+        exported_model: 重新加载的TorchScriptIBSNet
+        load_seconds: 加载耗时
+    """
+    export_dir = specs.get("path_options").get("export_dir")
+    pcd_points_num = specs.get("ExportOptions").get("PcdPointsNum")
+    query_points_num = specs.get("ExportOptions").get("QueryPointsNum")
+    pcd_num = get_pcd_num(metadata["model"])
+
+    time_begin = time.time()
+    scripted_model = trace_model(model, pcd_points_num, query_points_num, device, pcd_num)
+    logger.info("use {} to trace model".format(time.time() - time_begin))
+
+    export_path = os.path.join(export_dir, export_name + ".pt")
+    save_torchscript_model(scripted_model, export_path, metadata)
+    logger.info("export torchscript model to {}".format(export_path))
+
+    # 重新加载导出的模型，与重建脚本的使用方式相同
+    time_begin = time.time()
+    exported_model, _ = load_torchscript_model(export_path, device)
+    return exported_model, time.time() - time_begin
+
+
+def export_onnxruntime(specs: dict, checkpoint, export_name: str, metadata: dict, logger):
+    """
+    Returns:
+        exported_model: 重新加载的OnnxIBSNet
+        load_seconds: 加载耗时
+    """
+    export_dir = os.path.join(specs.get("path_options").get("export_dir"), export_name + "_onnx")
+    pcd_points_num = specs.get("ExportOptions").get("PcdPointsNum")
+    query_points_num = specs.get("ExportOptions").get("QueryPointsNum")
+    num_threads = specs.get("ExportOptions").get("OnnxThreads")
+    path_utils.generate_path(export_dir)
+
+    time_begin = time.time()
+    # onnxruntime只在CPU上运行，从checkpoint重新构造CPU上的模型再导出，
+    # 不复制已有的模型：使用weight_norm的模型在前向之前其权重不是叶子节点，无法deepcopy
+    export_onnx(get_model(specs, checkpoint, "cpu"), metadata["model"], export_dir, pcd_points_num, query_points_num, metadata)
+    logger.info("use {} to export onnx model".format(time.time() - time_begin))
+    logger.info("export onnx model to {}".format(export_dir))
+
+    time_begin = time.time()
+    exported_model, _ = load_onnx_model(export_dir, num_threads)
+    return exported_model, time.time() - time_begin
+
+
+def export_model(specs: dict, logger):
+    device = specs.get("Device")
+    model_path = specs.get("path_options").get("model_path")
+    export_dir = specs.get("path_options").get("export_dir")
+    formats = specs.get("ExportOptions").get("Formats", ["torchscript"])
+    pcd_points_num = specs.get("ExportOptions").get("PcdPointsNum")
+    query_points_num = specs.get("ExportOptions").get("QueryPointsNum")
+    repeat = specs.get("ExportOptions").get("BenchmarkRepeat")
+    pcd_num = get_pcd_num(specs.get("ModelOptions").get("Model"))
+    path_utils.generate_path(export_dir)
+
+    map_location = get_map_location(device)
+    time_begin = time.time()
+    checkpoint = torch.load(model_path, map_location=map_location)
+    model = get_model(specs, checkpoint, map_location)
+    eager_load_seconds = time.time() - time_begin
+    logger.info("load model parameter from epoch {}".format(checkpoint["epoch"]))
+
+    export_name = "{}_epoch_{}".format(specs.get("TAG"), checkpoint["epoch"])
+    metadata = {
+        "model": specs.get("ModelOptions").get("Model"),
+        "epoch": checkpoint["epoch"],
+        "pcd_points_num": pcd_points_num
+    }
+    exported_models = dict()
+    for export_format in formats:
+        if export_format == "torchscript":
+            exported_models["torchscript"] = export_torchscript(specs, model, export_name, metadata, map_location,
+                                                                logger)
+        elif export_format == "onnx":
+            exported_models["onnxruntime"] = export_onnxruntime(specs, checkpoint, export_name, metadata, logger)
+        else:
+            raise ValueError("unsupported export format: {}, expected 'torchscript' or 'onnx'".format(export_format))
+
+    latency = {
+        "eager": get_latency(model, pcd_num, pcd_points_num, query_points_num, repeat, map_location),
+        "eager_load": eager_load_seconds
+    }
+    for backend, (exported_model, load_seconds) in exported_models.items():
+        logger.info("max abs diff between eager and {} model: {:.2e}".format(
+            backend, check_outputs(model, exported_model, pcd_num, pcd_points_num, query_points_num, map_location)))
+        latency[backend] = get_latency(exported_model, pcd_num, pcd_points_num, query_points_num, repeat,
+                                       map_location)
+        latency[backend + "_load"] = load_seconds
+
+    for backend in ["eager"] + list(exported_models):
+        for method in ["encode", "decode"]:
+            warmup_seconds, steady_seconds = latency[backend][method]
+            logger.info("{:<11} {}: warm-up {:.4f}s, steady-state {:.4f}s".format(backend, method, warmup_seconds,
+                                                                                 steady_seconds))
+    logger.info(", ".join("{} load: {:.4f}s".format(backend, latency[backend + "_load"])
+                          for backend in ["eager"] + list(exported_models)))
+    with open(os.path.join(export_dir, export_name + "_latency.json"), "w") as f:
+        json.dump(latency, f, indent=4)
+    return latency
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Export IBSNet")
+    arg_parser.add_argument(
+        "--experiment",
+        "-e",
+        dest="experiment_config_file",
+        default="configs/export_model.json",
+        required=False,
+        help="The export config file."
+    )
+    args = arg_parser.parse_args()
+    specs = path_utils.read_config(args.experiment_config_file)
+
+    logger = logging.getLogger("export_model")
+    logger.setLevel("INFO")
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(level=logging.INFO)
+    logger.addHandler(stream_handler)
+
+    export_model(specs, logger)
@@ -150,30 +150,64 @@ class IM_Decoder(nn.Module):
         l5 = self.linear_5(l4)
         return l5[:, 0]
 
+    def forward_factorized(self, latent, query_points):
+        """
+        与forward等价，latent部分的投影每个形状只计算一次，不再逐查询点拼接latent
+        Args:
+            latent: tensor, (batch_size, latent_dim)
+            query_points: tensor, (batch_size*query_points_num, 3)
+        """
+        l4 = skip_mlp_factorized([self.linear_0, self.linear_1, self.linear_2, self.linear_3, self.linear_4],
+                                 latent, query_points, negative_slope=0.02)
+        l5 = self.linear_5(l4)
+        return l5[:, 0]
+
 
 class IBSNet(nn.Module):
-    def __init__(self, latent_size=256):
+    def __init__(self, latent_size=256, factorized_decoder=False):
         super().__init__()
 
         self.encoder = ResnetPointnet()
         self.decoder = IM_Decoder(latent_size + 3)
+        # 分解解码只改变计算方式，参数不变，可以直接加载已有的checkpoint
+        self.factorized_decoder = factorized_decoder
 
         num_params = sum(p.data.nelement() for p in self.parameters())
 
-    def forward(self, pcd, query_points, sample_points_num):
+    def encode(self, pcd):
         """
         Args:
             pcd: tensor, (batch_size, pcd_points_num, 3)
-            query_points: tensor, (batch_size, query_points_num, 3)
         Returns:
-            ufd1_pred: tensor, (batch_size, query_points_num)
-            ufd2_pred: tensor, (batch_size, query_points_num)
+            latent: tensor, (batch_size, latent_size)
         """
-        latentcode = self.encoder(pcd)
-        latentcode = latentcode.repeat_interleave(sample_points_num, dim=0)
+        return self.encoder(pcd)
 
-        latentcode = torch.cat([latentcode, query_points], 1)
+    def _decode(self, latent, query_points):
+        if self.factorized_decoder:
+            return self.decoder.forward_factorized(latent, query_points)
+        query_points_num = query_points.shape[0] // latent.shape[0]
+        latentcode = torch.cat([latent.repeat_interleave(query_points_num, dim=0), query_points], 1)
+        return self.decoder(latentcode)
 
-        ufd_pred = self.decoder(latentcode)
+    def decode(self, latent, query_points, chunk_size=None):
+        """
+        Args:
+            latent: tensor, (batch_size, latent_size)，encode的结果
+            query_points: tensor, (batch_size*query_points_num, 3)
+            chunk_size: 每个形状每次解码的查询点数，为None时一次解码全部查询点
+        Returns:
+            udf_pred: tensor, (batch_size*query_points_num)
+        """
+        return decode_in_chunks(self._decode, latent, query_points, chunk_size)
 
-        return ufd_pred
+    def forward(self, pcd, query_points, sample_points_num=None):
+        """
+        Args:
+            pcd: tensor, (batch_size, pcd_points_num, 3)
+            query_points: tensor, (batch_size*query_points_num, 3)
+            sample_points_num: 兼容旧的调用方式，每个形状的查询点数由query_points推断
+        Returns:
+            ufd_pred: tensor, (batch_size*query_points_num)
+        """
+        return self._decode(self.encode(pcd), query_points)
@@ -6,13 +6,19 @@ import torch.nn.parallel
 import torch.utils.data
 import torch.nn.functional as F
 
-from pointnet2_ops.pointnet2_utils import furthest_point_sample, gather_operation
+from models.pn2_ops import furthest_point_sample, gather_operation
+from models.models_utils import skip_mlp_factorized, decode_in_chunks, EncoderStack, stack_inputs
 
 
 class cross_transformer(nn.Module):
+    """
+    fast_attention为True时以batch-first布局调用F.scaled_dot_product_attention，
+    复用multihead_attn1的参数，与原始实现加载相同的权重，结果在数值上等价
+    """
 
-    def __init__(self, d_model=256, d_model_out=256, nhead=4, dim_feedforward=1024, dropout=0.0):
+    def __init__(self, d_model=256, d_model_out=256, nhead=4, dim_feedforward=1024, dropout=0.0, fast_attention=False):
         super().__init__()
+        self.fast_attention = fast_attention
         self.multihead_attn1 = nn.MultiheadAttention(d_model_out, nhead, dropout=dropout)
         # Implementation of Feedforward model
         self.linear11 = nn.Linear(d_model_out, dim_feedforward)
@@ -32,8 +38,54 @@ class cross_transformer(nn.Module):
     def with_pos_embed(self, tensor, pos):
         return tensor if pos is None else tensor + pos
 
+    def scaled_dot_product_attention(self, query, key, value):
+        """
+        与multihead_attn1等价的多头注意力
+        Args:
+            query: tensor, (B, n, c)
+            key: tensor, (B, m, c)
+            value: tensor, (B, m, c)
+        Returns:
+            tensor, (B, n, c)
+        """
+        attn = self.multihead_attn1
+        b, n, c = query.shape
+        w_q, w_k, w_v = attn.in_proj_weight.chunk(3)
+        b_q, b_k, b_v = attn.in_proj_bias.chunk(3)
+
+        def split_heads(x):
+            # (B, l, c) -> (B, nhead, l, head_dim)
+            return x.view(b, -1, attn.num_heads, attn.head_dim).transpose(1, 2)
+
+        q = split_heads(F.linear(query, w_q, b_q))
+        k = split_heads(F.linear(key, w_k, b_k))
+        v = split_heads(F.linear(value, w_v, b_v))
+        out = F.scaled_dot_product_attention(q, k, v, dropout_p=attn.dropout if self.training else 0.0)
+        out = out.transpose(1, 2).reshape(b, n, c)
+        return attn.out_proj(out)
+
+    def forward_fast(self, src1, src2):
+        src1 = self.input_proj(src1).transpose(1, 2)  # B, N, C
+        src2 = self.input_proj(src2).transpose(1, 2)
+
+        src1 = self.norm13(src1)
+        src2 = self.norm13(src2)
+
+        src12 = self.scaled_dot_product_attention(src1, src2, src2)
+
+        src1 = src1 + self.dropout12(src12)
+        src1 = self.norm12(src1)
+
+        src12 = self.linear12(self.dropout1(self.activation1(self.linear11(src1))))
+        src1 = src1 + self.dropout13(src12)
+
+        return src1.transpose(1, 2)
+
     # 原始的transformer
     def forward(self, src1, src2, if_act=False):
+        if self.fast_attention:
+            return self.forward_fast(src1, src2)
+
         src1 = self.input_proj(src1)
         src2 = self.input_proj(src2)
 
@@ -60,19 +112,46 @@ class cross_transformer(nn.Module):
         return src1
 
 
+def get_gdp_sample_nums(points_num):
+    """PCT_encoder中三次GDP的采样点数"""
+    return points_num // 4, points_num // 8, points_num // 16
+
+
+def get_gdp_fps_index(points):
+    """
+    离线计算PCT_encoder中三次GDP的fps索引，每一级的索引都相对于上一级采样后的点
+    Args:
+        points: tensor, (B, N, 3)
+    Returns:
+        fps_idx: tensor, (B, N//4 + N//8 + N//16), int32
+    """
+    idx_list = []
+    points = points.transpose(1, 2).contiguous()
+    for sample_num in get_gdp_sample_nums(points.shape[2]):
+        idx = furthest_point_sample(points.transpose(1, 2).contiguous(), sample_num)
+        points = gather_operation(points, idx)
+        idx_list.append(idx.int())
+    return torch.cat(idx_list, dim=1)
+
+
+def split_gdp_fps_index(fps_idx, points_num):
+    """将get_gdp_fps_index的结果拆分为三次GDP各自的索引"""
+    return torch.split(fps_idx.int(), get_gdp_sample_nums(points_num), dim=1)
+
+
 class PCT_encoder(nn.Module):
-    def __init__(self, channel=64):
+    def __init__(self, channel=64, fast_attention=False):
         super(PCT_encoder, self).__init__()
         self.channel = channel
         self.conv1 = nn.Conv1d(3, 64, kernel_size=1)
         self.conv2 = nn.Conv1d(64, channel, kernel_size=1)
 
-        self.sa1 = cross_transformer(channel, channel)
-        self.sa1_1 = cross_transformer(channel * 2, channel * 2)
-        self.sa2 = cross_transformer((channel) * 2, channel * 2)
-        self.sa2_1 = cross_transformer((channel) * 4, channel * 4)
-        self.sa3 = cross_transformer((channel) * 4, channel * 4)
-        self.sa3_1 = cross_transformer((channel) * 8, channel * 8)
+        self.sa1 = cross_transformer(channel, channel, fast_attention=fast_attention)
+        self.sa1_1 = cross_transformer(channel * 2, channel * 2, fast_attention=fast_attention)
+        self.sa2 = cross_transformer((channel) * 2, channel * 2, fast_attention=fast_attention)
+        self.sa2_1 = cross_transformer((channel) * 4, channel * 4, fast_attention=fast_attention)
+        self.sa3 = cross_transformer((channel) * 4, channel * 4, fast_attention=fast_attention)
+        self.sa3_1 = cross_transformer((channel) * 8, channel * 8, fast_attention=fast_attention)
 
         self.relu = nn.GELU()
 
@@ -86,14 +165,22 @@ class PCT_encoder(nn.Module):
         # self.ps_refuse = nn.Conv1d(channel, channel * 8, kernel_size=1)
         # self.ps_adj = nn.Conv1d(channel * 8, channel * 8, kernel_size=1)
 
-    def forward(self, points):
+    def forward(self, points, fps_idx=None):
+        """
+        Args:
+            points: tensor, (B, 3, N)
+            fps_idx: tensor, (B, N//4 + N//8 + N//16)，get_gdp_fps_index预先计算的fps索引，为None时在线计算
+        """
         batch_size, _, N = points.size()
+        if fps_idx is not None:
+            idx_0, idx_1, idx_2 = split_gdp_fps_index(fps_idx, N)
 
         x = self.relu(self.conv1(points))  # B, D, N
         x0 = self.conv2(x)
 
         # GDP
-        idx_0 = furthest_point_sample(points.transpose(1, 2).contiguous(), N // 4)
+        if fps_idx is None:
+            idx_0 = furthest_point_sample(points.transpose(1, 2).contiguous(), N // 4)
         x_g0 = gather_operation(x0, idx_0)
         points = gather_operation(points, idx_0)
         x1 = self.sa1(x_g0, x0).contiguous()
@@ -101,7 +188,8 @@ class PCT_encoder(nn.Module):
         # SFA
         x1 = self.sa1_1(x1, x1).contiguous()
         # GDP
-        idx_1 = furthest_point_sample(points.transpose(1, 2).contiguous(), N // 8)
+        if fps_idx is None:
+            idx_1 = furthest_point_sample(points.transpose(1, 2).contiguous(), N // 8)
         x_g1 = gather_operation(x1, idx_1)
         points = gather_operation(points, idx_1)
         x2 = self.sa2(x_g1, x1).contiguous()  # C*2, N
@@ -109,7 +197,8 @@ class PCT_encoder(nn.Module):
         # SFA
         x2 = self.sa2_1(x2, x2).contiguous()
         # GDP
-        idx_2 = furthest_point_sample(points.transpose(1, 2).contiguous(), N // 16)
+        if fps_idx is None:
+            idx_2 = furthest_point_sample(points.transpose(1, 2).contiguous(), N // 16)
         x_g2 = gather_operation(x2, idx_2)
         # points = gather_points(points, idx_2)
         x3 = self.sa3(x_g2, x2).contiguous()  # C*4, N/4
@@ -159,36 +248,83 @@ class IM_Decoder(nn.Module):
         l5 = self.linear_5(l4)
         return l5[:, 0], l5[:, 1]
 
+    def forward_factorized(self, latent, query_points):
+        """
+        与forward等价，latent部分的投影每个形状只计算一次，不再逐查询点拼接latent
+        Args:
+            latent: tensor, (batch_size, latent_dim)
+            query_points: tensor, (batch_size*query_points_num, 3)
+        """
+        l4 = skip_mlp_factorized([self.linear_0, self.linear_1, self.linear_2, self.linear_3, self.linear_4],
+                                 latent, query_points, negative_slope=0.02)
+        l5 = self.linear_5(l4)
+        return l5[:, 0], l5[:, 1]
+
 
 class IBSNet(nn.Module):
-    def __init__(self, latent_size=512):
+    def __init__(self, latent_size=512, factorized_decoder=False, fast_attention=False, stacked_encoders=False):
         super().__init__()
         
         channel = int(latent_size/8)
-        self.encoder1 = PCT_encoder(channel=channel)
-        self.encoder2 = PCT_encoder(channel=channel)
+        # fast_attention同样只改变计算方式，参数不变
+        self.encoder1 = PCT_encoder(channel=channel, fast_attention=fast_attention)
+        self.encoder2 = PCT_encoder(channel=channel, fast_attention=fast_attention)
 
         self.decoder = IM_Decoder(2 * latent_size + 3)
+        # 分解解码只改变计算方式，参数不变，可以直接加载已有的checkpoint
+        self.factorized_decoder = factorized_decoder
+        # 推理时两个编码器堆叠为一次vmap前向，同样不改变参数
+        self.encoder_stack = EncoderStack([self.encoder1, self.encoder2]) if stacked_encoders else None
 
-    def forward(self, pcd1, pcd2, query_points):
+    def encode(self, pcd1, pcd2, fps_idx1=None, fps_idx2=None):
         """
         Args:
             pcd1: tensor, (batch_size, pcd_points_num, 3)
             pcd2: tensor, (batch_size, pcd_points_num, 3)
-            query_points: tensor, (batch_size*query_points_num, 3)
+            fps_idx1: tensor, (batch_size, n)，pcd1预先计算的fps索引，见get_gdp_fps_index
+            fps_idx2: tensor, (batch_size, n)，pcd2预先计算的fps索引
         Returns:
-            udf1_pred: tensor, (batch_size, query_points_num)
-            udf2_pred: tensor, (batch_size, query_points_num)
+            latent: tensor, (batch_size, 2*latent_size)
         """
         pcd1 = pcd1.transpose(1, 2).contiguous()
         pcd2 = pcd2.transpose(1, 2).contiguous()
-        latentcode1 = self.encoder1(pcd1).squeeze(-1)
-        latentcode1 = latentcode1.repeat_interleave(50000, dim=0)
-        latentcode2 = self.encoder2(pcd2).squeeze(-1)
-        latentcode2 = latentcode2.repeat_interleave(50000, dim=0)
-
-        latentcode = torch.cat([latentcode1, latentcode2, query_points], 1)
-
-        udf1_pred, udf2_pred = self.decoder(latentcode)
+        if self.encoder_stack is not None and not self.training:
+            latentcode1, latentcode2 = self.encoder_stack(torch.stack([pcd1, pcd2]),
+                                                          stack_inputs(fps_idx1, fps_idx2)).squeeze(-1)
+            return torch.cat([latentcode1, latentcode2], 1)
+        latentcode1 = self.encoder1(pcd1, fps_idx1).squeeze(-1)
+        latentcode2 = self.encoder2(pcd2, fps_idx2).squeeze(-1)
+        return torch.cat([latentcode1, latentcode2], 1)
+
+    def _decode(self, latent, query_points):
+        if self.factorized_decoder:
+            return self.decoder.forward_factorized(latent, query_points)
+        query_points_num = query_points.shape[0] // latent.shape[0]
+        latentcode = torch.cat([latent.repeat_interleave(query_points_num, dim=0), query_points], 1)
+        return self.decoder(latentcode)
+
+    def decode(self, latent, query_points, chunk_size=None):
+        """
+        Args:
+            latent: tensor, (batch_size, latent_dim)，encode的结果
+            query_points: tensor, (batch_size*query_points_num, 3)
+            chunk_size: 每个形状每次解码的查询点数，为None时一次解码全部查询点
+        Returns:
+            udf1_pred: tensor, (batch_size*query_points_num)
+            udf2_pred: tensor, (batch_size*query_points_num)
+        """
+        return decode_in_chunks(self._decode, latent, query_points, chunk_size)
 
-        return udf1_pred, udf2_pred
+    def forward(self, pcd1, pcd2, query_points, fps_idx1=None, fps_idx2=None):
+        """
+        Args:
+            pcd1: tensor, (batch_size, pcd_points_num, 3)
+            pcd2: tensor, (batch_size, pcd_points_num, 3)
+            query_points: tensor, (batch_size*query_points_num, 3)
+            fps_idx1: tensor，pcd1预先计算的fps索引，为None时在线计算
+            fps_idx2: tensor，pcd2预先计算的fps索引，为None时在线计算
+        Returns:
+            udf1_pred: tensor, (batch_size, query_points_num)
+            udf2_pred: tensor, (batch_size, query_points_num)
+        """
+        return self._decode(self.encode(pcd1, pcd2, fps_idx1, fps_idx2), query_points)
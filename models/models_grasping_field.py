@@ -238,30 +238,56 @@ class DeepSDF_Decoder(nn.Module):
 
 
 class IBSNet(nn.Module):
-    def __init__(self):
+    def __init__(self, stacked_encoders=False):
         super().__init__()
         self.encoder1 = ResnetPointnet()
         self.encoder2 = ResnetPointnet()
         self.decoder = DeepSDF_Decoder()
         self.num_samp_per_scene = 50000
+        # 推理时两个编码器堆叠为一次vmap前向，不改变参数，可以直接加载已有的checkpoint
+        self.encoder_stack = EncoderStack([self.encoder1, self.encoder2]) if stacked_encoders else None
 
-    def forward(self, pcd1, pcd2, query_points, sample_points_num):
+    def encode(self, pcd1, pcd2):
         """
         Args:
             pcd1: tensor, (batch_size, pcd_points_num, 3)
             pcd2: tensor, (batch_size, pcd_points_num, 3)
-            query_points: tensor, (batch_size*query_points_num, 3)
         Returns:
-            udf1_pred: tensor, (batch_size, query_points_num)
-            udf2_pred: tensor, (batch_size, query_points_num)
+            latent: tensor, (batch_size, 2*c_dim)
         """
+        if self.encoder_stack is not None and not self.training:
+            latentcode1, latentcode2 = self.encoder_stack(torch.stack([pcd1, pcd2])).squeeze(-1)
+            return torch.cat([latentcode1, latentcode2], 1)
         latentcode1 = self.encoder1(pcd1).squeeze(-1)
         latentcode2 = self.encoder2(pcd2).squeeze(-1)
-        latentcode1 = latentcode1.repeat_interleave(sample_points_num, dim=0)
-        latentcode2 = latentcode2.repeat_interleave(sample_points_num, dim=0)
+        return torch.cat([latentcode1, latentcode2], 1)
 
-        latentcode = torch.cat([latentcode1, latentcode2, query_points], 1)
+    def _decode(self, latent, query_points):
+        query_points_num = query_points.shape[0] // latent.shape[0]
+        latentcode = torch.cat([latent.repeat_interleave(query_points_num, dim=0), query_points], 1)
+        return self.decoder(latentcode)
 
-        udf1_pred, udf2_pred = self.decoder(latentcode)
+    def decode(self, latent, query_points, chunk_size=None):
+        """
+        Args:
+            latent: tensor, (batch_size, 2*c_dim)，encode的结果
+            query_points: tensor, (batch_size*query_points_num, 3)
+            chunk_size: 每个形状每次解码的查询点数，为None时一次解码全部查询点
+        Returns:
+            udf1_pred: tensor, (batch_size*query_points_num)
+            udf2_pred: tensor, (batch_size*query_points_num)
+        """
+        return decode_in_chunks(self._decode, latent, query_points, chunk_size)
 
-        return udf1_pred, udf2_pred
+    def forward(self, pcd1, pcd2, query_points, sample_points_num=None):
+        """
+        Args:
+            pcd1: tensor, (batch_size, pcd_points_num, 3)
+            pcd2: tensor, (batch_size, pcd_points_num, 3)
+            query_points: tensor, (batch_size*query_points_num, 3)
+            sample_points_num: 兼容旧的调用方式，每个形状的查询点数由query_points推断
+        Returns:
+            udf1_pred: tensor, (batch_size*query_points_num)
+            udf2_pred: tensor, (batch_size*query_points_num)
+        """
+        return self._decode(self.encode(pcd1, pcd2), query_points)
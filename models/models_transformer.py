@@ -1,5 +1,6 @@
 from torch import nn
 from models.pn2_utils import *
+from models.models_utils import skip_mlp_factorized, decode_in_chunks, EncoderStack
 from datetime import datetime
 import torch.nn.functional as F
 
@@ -42,15 +43,19 @@ class Feature_Extractor_new(nn.Module):
         """
         feature = self.mlp_in(point_cloud).permute(0, 2, 1).contiguous()
         point_cloud = point_cloud.permute(0, 2, 1).contiguous()
-        feature = self.transformer_in(feature, point_cloud)
+        # 每个Transformer中的knn索引同时供下一层采样点分组使用
+        idx_knn = self.transformer_in.get_knn_index(point_cloud)
+        feature = self.transformer_in(feature, point_cloud, idx_knn)
 
-        point_cloud, feature = self.sa1(point_cloud, feature)
-        feature = self.transformer1(feature, point_cloud)
+        point_cloud, feature = self.sa1(point_cloud, feature, xyz_knn_idx=idx_knn)
+        idx_knn = self.transformer1.get_knn_index(point_cloud)
+        feature = self.transformer1(feature, point_cloud, idx_knn)
 
-        point_cloud, feature = self.sa2(point_cloud, feature)
-        feature = self.transformer2(feature, point_cloud)
+        point_cloud, feature = self.sa2(point_cloud, feature, xyz_knn_idx=idx_knn)
+        idx_knn = self.transformer2.get_knn_index(point_cloud)
+        feature = self.transformer2(feature, point_cloud, idx_knn)
 
-        point_cloud, feature = self.sa3(point_cloud, feature)
+        point_cloud, feature = self.sa3(point_cloud, feature, xyz_knn_idx=idx_knn)
         feature = self.transformer3(feature, point_cloud)
 
         feature = torch.mean(feature, dim=-1)
@@ -91,8 +96,10 @@ class Feature_Extractor(nn.Module):
         l0_points = point_cloud
 
         l1_xyz, l1_points, idx1 = self.sa1(l0_xyz, l0_points)  # (B, 3, 256), (B, 64, 256)
-        l1_points = self.transformer1(l1_points, l1_xyz)  # (B, 64, 256)
-        l2_xyz, l2_points, idx2 = self.sa2(l1_xyz, l1_points)  # (B, 3, 128), (B, 128, 128)
+        # transformer1中l1_xyz的knn索引同时供sa2分组使用
+        idx_knn1 = self.transformer1.get_knn_index(l1_xyz)
+        l1_points = self.transformer1(l1_points, l1_xyz, idx_knn1)  # (B, 64, 256)
+        l2_xyz, l2_points, idx2 = self.sa2(l1_xyz, l1_points, xyz_knn_idx=idx_knn1)  # (B, 3, 128), (B, 128, 128)
         l2_points = self.transformer2(l2_points, l2_xyz)
         l3_xyz, l3_points = self.sa3(l2_xyz, l2_points)  # (B, 3, 1), (B, out_dim, 1)
 
@@ -124,56 +131,98 @@ class IM_Decoder(nn.Module):
 
     def forward(self, batch_input):
         l0 = self.linear_0(batch_input)
-        l0 = F.prelu(l0, negative_slope=0.02, inplace=True)
+        l0 = F.leaky_relu(l0, negative_slope=0.02, inplace=True)
         l0 = torch.cat([l0, batch_input], dim=-1)
 
         l1 = self.linear_1(l0)
-        l1 = F.prelu(l1, negative_slope=0.02, inplace=True)
+        l1 = F.leaky_relu(l1, negative_slope=0.02, inplace=True)
         l1 = torch.cat([l1, batch_input], dim=-1)
 
         l2 = self.linear_2(l1)
-        l2 = F.prelu(l2, negative_slope=0.02, inplace=True)
+        l2 = F.leaky_relu(l2, negative_slope=0.02, inplace=True)
         l2 = torch.cat([l2, batch_input], dim=-1)
 
         l3 = self.linear_3(l2)
-        l3 = F.prelu(l3, negative_slope=0.02, inplace=True)
+        l3 = F.leaky_relu(l3, negative_slope=0.02, inplace=True)
         l3 = torch.cat([l3, batch_input], dim=-1)
 
         l4 = self.linear_4(l3)
-        l4 = F.prelu(l4, negative_slope=0.02, inplace=True)
+        l4 = F.leaky_relu(l4, negative_slope=0.02, inplace=True)
 
         l5 = self.linear_5(l4)
         return l5[:, 0], l5[:, 1]
 
+    def forward_factorized(self, latent, query_points):
+        """
+        与forward等价，latent部分的投影每个形状只计算一次，不再逐查询点拼接latent
+        Args:
+            latent: tensor, (batch_size, latent_dim)
+            query_points: tensor, (batch_size*query_points_num, 3)
+        """
+        l4 = skip_mlp_factorized([self.linear_0, self.linear_1, self.linear_2, self.linear_3, self.linear_4],
+                                 latent, query_points, negative_slope=0.02)
+        l5 = self.linear_5(l4)
+        return l5[:, 0], l5[:, 1]
+
 
 class IBSNet(nn.Module):
-    def __init__(self, points_num=2048, latent_size=256):
+    def __init__(self, points_num=2048, latent_size=256, factorized_decoder=False, stacked_encoders=False):
         super().__init__()
 
         self.encoder1 = Feature_Extractor(points_num=points_num, latent_size=latent_size)
         self.encoder2 = Feature_Extractor(points_num=points_num, latent_size=latent_size)
 
         self.decoder = IM_Decoder(2 * latent_size + 3)
+        # 分解解码只改变计算方式，参数不变，可以直接加载已有的checkpoint
+        self.factorized_decoder = factorized_decoder
+        # 推理时两个编码器堆叠为一次vmap前向，同样不改变参数
+        self.encoder_stack = EncoderStack([self.encoder1, self.encoder2]) if stacked_encoders else None
 
         num_params = sum(p.data.nelement() for p in self.parameters())
 
-    def forward(self, pcd1, pcd2, query_points, sample_points_num):
+    def encode(self, pcd1, pcd2):
         """
         Args:
             pcd1: tensor, (batch_size, pcd_points_num, 3)
             pcd2: tensor, (batch_size, pcd_points_num, 3)
-            query_points: tensor, (batch_size, query_points_num, 3)
         Returns:
-            ufd1_pred: tensor, (batch_size, query_points_num)
-            ufd2_pred: tensor, (batch_size, query_points_num)
+            latent: tensor, (batch_size, 2*latent_size)
         """
+        if self.encoder_stack is not None and not self.training:
+            latentcode1, latentcode2 = self.encoder_stack(torch.stack([pcd1, pcd2]))
+            return torch.cat([latentcode1, latentcode2], 1)
         latentcode1 = self.encoder1(pcd1)
         latentcode2 = self.encoder2(pcd2)
-        latentcode2 = latentcode2.repeat_interleave(sample_points_num, dim=0)
-        latentcode1 = latentcode1.repeat_interleave(sample_points_num, dim=0)
+        return torch.cat([latentcode1, latentcode2], 1)
 
-        latentcode = torch.cat([latentcode1, latentcode2, query_points], 1)
+    def _decode(self, latent, query_points):
+        if self.factorized_decoder:
+            return self.decoder.forward_factorized(latent, query_points)
+        query_points_num = query_points.shape[0] // latent.shape[0]
+        latentcode = torch.cat([latent.repeat_interleave(query_points_num, dim=0), query_points], 1)
+        return self.decoder(latentcode)
 
-        ufd1_pred, udf2_pred = self.decoder(latentcode)
+    def decode(self, latent, query_points, chunk_size=None):
+        """
+        Args:
+            latent: tensor, (batch_size, latent_dim)，encode的结果
+            query_points: tensor, (batch_size*query_points_num, 3)
+            chunk_size: 每个形状每次解码的查询点数，为None时一次解码全部查询点
+        Returns:
+            udf1_pred: tensor, (batch_size*query_points_num)
+            udf2_pred: tensor, (batch_size*query_points_num)
+        """
+        return decode_in_chunks(self._decode, latent, query_points, chunk_size)
 
-        return ufd1_pred, udf2_pred
+    def forward(self, pcd1, pcd2, query_points, sample_points_num=None):
+        """
+        Args:
+            pcd1: tensor, (batch_size, pcd_points_num, 3)
+            pcd2: tensor, (batch_size, pcd_points_num, 3)
+            query_points: tensor, (batch_size*query_points_num, 3)
+            sample_points_num: 兼容旧的调用方式，每个形状的查询点数由query_points推断
+        Returns:
+            ufd1_pred: tensor, (batch_size*query_points_num)
+            ufd2_pred: tensor, (batch_size*query_points_num)
+        """
+        return self._decode(self.encode(pcd1, pcd2), query_points)
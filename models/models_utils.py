@@ -1,3 +1,153 @@
+import copy
+import itertools
+
+import torch
+import torch.nn.functional as F
+from torch.func import functional_call, vmap
+
+
 def maxpool(x, dim=-1, keepdim=False):
     out, _ = x.max(dim=dim, keepdim=keepdim)
     return out
+
+
+def skip_linear_factorized(linear, latent_proj, query_points, hidden=None):
+    """
+    输入为cat([hidden, latent, xyz])的全连接层按列拆分后的前向，latent部分的投影latent_proj已按形状算好
+    Args:
+        linear: nn.Linear，权重按列依次对应hidden、latent、xyz
+        latent_proj: tensor, (batch_size, out_features)，latent部分的投影（含偏置）
+        query_points: tensor, (batch_size*query_points_num, 3)
+        hidden: tensor, (batch_size*query_points_num, hidden_dim)，第一层为None
+    Returns:
+        tensor, (batch_size*query_points_num, out_features)
+    """
+    xyz_dim = query_points.shape[-1]
+    out = F.linear(query_points, linear.weight[:, -xyz_dim:])
+    if hidden is not None:
+        out = out + F.linear(hidden, linear.weight[:, :hidden.shape[-1]])
+    # 查询点按形状连续排列，与repeat_interleave的顺序一致，广播相加即可
+    out = out.view(latent_proj.shape[0], -1, out.shape[-1]) + latent_proj.unsqueeze(1)
+    return out.view(-1, out.shape[-1])
+
+
+def latent_projection(linear, latent, hidden_dim=0):
+    """
+    输入为cat([hidden, latent, xyz])的全连接层中latent部分的投影，每个形状只计算一次
+    Args:
+        linear: nn.Linear
+        latent: tensor, (batch_size, latent_dim)
+        hidden_dim: 该层输入中hidden部分的维度
+    Returns:
+        tensor, (batch_size, out_features)
+    """
+    return F.linear(latent, linear.weight[:, hidden_dim: hidden_dim + latent.shape[-1]], linear.bias)
+
+
+def skip_mlp_factorized(linears, latent, query_points, negative_slope=0.02):
+    """
+    IM_Decoder中带跳跃连接的若干全连接层的分解前向，与逐查询点拼接latent的结果在数值上等价
+    Args:
+        linears: [linear_0, ..., linear_k]，第i层的输入为cat([第i-1层的输出, latent, xyz])，第0层没有前一层的输出
+        latent: tensor, (batch_size, latent_dim)
+        query_points: tensor, (batch_size*query_points_num, 3)
+        negative_slope: leaky_relu的斜率
+    Returns:
+        tensor, (batch_size*query_points_num, linears[-1].out_features)
+    """
+    hidden = None
+    for linear in linears:
+        hidden_dim = 0 if hidden is None else hidden.shape[-1]
+        latent_proj = latent_projection(linear, latent, hidden_dim)
+        hidden = skip_linear_factorized(linear, latent_proj, query_points, hidden)
+        hidden = F.leaky_relu(hidden, negative_slope=negative_slope, inplace=True)
+    return hidden
+
+
+def decode_in_chunks(decode_fn, latent, query_points, chunk_size=None):
+    """
+    将每个形状的查询点按chunk_size分块依次解码，限制单次解码的显存占用，查询点数量不受显存限制
+    Args:
+        decode_fn: decode_fn(latent, query_points)，返回tensor或tensor的tuple，每个tensor为(batch_size*n,)
+        latent: tensor, (batch_size, latent_dim)
+        query_points: tensor, (batch_size*query_points_num, 3)
+        chunk_size: 每个形状每块的查询点数，为None时不分块
+    Returns:
+        与decode_fn相同，每个tensor为(batch_size*query_points_num,)
+    """
+    batch_size = latent.shape[0]
+    query_points_num = query_points.shape[0] // batch_size
+    if chunk_size is None or chunk_size >= query_points_num:
+        return decode_fn(latent, query_points)
+
+    query_points = query_points.view(batch_size, query_points_num, -1)
+    outputs = []
+    for begin in range(0, query_points_num, chunk_size):
+        chunk = query_points[:, begin: begin + chunk_size].reshape(-1, query_points.shape[-1])
+        outputs.append(decode_fn(latent, chunk))
+
+    def merge(chunk_outputs):
+        return torch.cat([output.reshape(batch_size, -1) for output in chunk_outputs], dim=1).view(-1)
+
+    if isinstance(outputs[0], tuple):
+        return tuple(merge([output[i] for output in outputs]) for i in range(len(outputs[0])))
+    return merge(outputs)
+
+
+class EncoderStack:
+    """
+    将结构相同的若干编码器的参数与buffer沿新的第0维堆叠，用torch.func.vmap一次完成所有编码器的前向，
+    代替逐个编码器依次前向，减少小批量推理时的kernel launch次数
+    不注册为子模块，模型的state_dict与checkpoint不变
+    """
+
+    def __init__(self, encoders):
+        self.encoders = list(encoders)
+        # 只提供模块结构，参数与buffer在前向时替换为堆叠后的tensor
+        self.base = copy.deepcopy(self.encoders[0]).to("meta")
+        self.cache_key = None
+        self.cache_state = None
+
+    def _state_key(self):
+        return tuple((tensor.data_ptr(), tensor._version) for encoder in self.encoders
+                     for tensor in itertools.chain(encoder.parameters(), encoder.buffers()))
+
+    def _stack_state(self):
+        params = {name: torch.stack([dict(encoder.named_parameters())[name] for encoder in self.encoders])
+                  for name, _ in self.encoders[0].named_parameters()}
+        buffers = {name: torch.stack([dict(encoder.named_buffers())[name] for encoder in self.encoders])
+                   for name, _ in self.encoders[0].named_buffers()}
+        return params, buffers
+
+    def stacked_state(self):
+        """需要梯度时每次重新堆叠以保留计算图，否则缓存堆叠结果，参数被修改或替换后重新堆叠"""
+        if torch.is_grad_enabled():
+            return self._stack_state()
+        key = self._state_key()
+        if key != self.cache_key:
+            self.cache_state = self._stack_state()
+            self.cache_key = key
+        return self.cache_state
+
+    def __call__(self, *inputs):
+        """
+        Args:
+            inputs: 每个输入为各编码器输入沿第0维的堆叠，(encoders_num, ...)，或为None
+        Returns:
+            tensor, (encoders_num, ...)，各编码器输出的堆叠
+        """
+        self.base.train(self.encoders[0].training)
+        params, buffers = self.stacked_state()
+
+        def encode(params, buffers, *inputs):
+            return functional_call(self.base, (params, buffers), inputs)
+
+        in_dims = (0, 0) + tuple(None if x is None else 0 for x in inputs)
+        return vmap(encode, in_dims=in_dims)(params, buffers, *inputs)
+
+
+def stack_inputs(*inputs):
+    """将各编码器的输入沿新的第0维堆叠，任意一个为None时返回None"""
+    if any(x is None for x in inputs):
+        return None
+    return torch.stack(inputs)
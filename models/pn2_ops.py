@@ -0,0 +1,274 @@
+"""
+pointnet2_ops中各算子的统一入口
+安装了pointnet2_ops且输入在GPU上时调用CUDA实现，否则使用等价的PyTorch向量化实现，
+使依赖这些算子的模型可以在没有CUDA扩展的CPU环境中推理，PyTorch实现的输出与CUDA实现一致
+"""
+import types
+
+import torch
+
+try:
+    from pointnet2_ops import pointnet2_utils as _cuda_ops
+except (ImportError, OSError):
+    _cuda_ops = None
+
+
+def is_cuda_ops_available():
+    return _cuda_ops is not None
+
+
+def _is_batched(tensor: torch.Tensor):
+    """是否处于torch.func.vmap中"""
+    try:
+        return torch._C._functorch.is_batchedtensor(tensor)
+    except AttributeError:
+        return False
+
+
+def _vmap_rule(op):
+    """将vmap维与batch维合并后调用一次op，再拆分回vmap维，未被vmap的tensor参数沿vmap维扩展"""
+    def rule(info, in_dims, *args):
+        flat_args = []
+        for arg, in_dim in zip(args, in_dims):
+            if isinstance(arg, torch.Tensor):
+                arg = arg.movedim(in_dim, 0) if in_dim is not None else arg.expand(info.batch_size, *arg.shape)
+                arg = arg.reshape(-1, *arg.shape[2:]).contiguous()
+            flat_args.append(arg)
+        outputs = op(*flat_args)
+        if isinstance(outputs, tuple):
+            return tuple(x.view(info.batch_size, -1, *x.shape[1:]) for x in outputs), (0,) * len(outputs)
+        return outputs.view(info.batch_size, -1, *outputs.shape[1:]), 0
+    return rule
+
+
+_batched_cuda_ops = None
+
+
+def _get_batched_cuda_ops():
+    """
+    CUDA扩展没有实现vmap的批处理规则，将其算子注册为torch.library的自定义算子并以_vmap_rule批处理，
+    使EncoderStack在vmap中堆叠编码器时仍调用CUDA实现。自定义算子没有实现反向，只在不需要梯度时使用
+    """
+    global _batched_cuda_ops
+    if _batched_cuda_ops is not None:
+        return _batched_cuda_ops
+
+    try:
+        @torch.library.custom_op("ibsnet_pn2::furthest_point_sample", mutates_args=())
+        def furthest_point_sample_op(xyz: torch.Tensor, npoint: int) -> torch.Tensor:
+            return _cuda_ops.furthest_point_sample(xyz, npoint)
+
+        @torch.library.custom_op("ibsnet_pn2::gather_operation", mutates_args=())
+        def gather_operation_op(features: torch.Tensor, idx: torch.Tensor) -> torch.Tensor:
+            return _cuda_ops.gather_operation(features, idx)
+
+        @torch.library.custom_op("ibsnet_pn2::grouping_operation", mutates_args=())
+        def grouping_operation_op(features: torch.Tensor, idx: torch.Tensor) -> torch.Tensor:
+            return _cuda_ops.grouping_operation(features, idx)
+
+        @torch.library.custom_op("ibsnet_pn2::ball_query", mutates_args=())
+        def ball_query_op(radius: float, nsample: int, xyz: torch.Tensor, new_xyz: torch.Tensor) -> torch.Tensor:
+            return _cuda_ops.ball_query(radius, nsample, xyz, new_xyz)
+
+        @torch.library.custom_op("ibsnet_pn2::three_nn", mutates_args=())
+        def three_nn_op(unknown: torch.Tensor, known: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+            return _cuda_ops.three_nn(unknown, known)
+
+        @torch.library.custom_op("ibsnet_pn2::three_interpolate", mutates_args=())
+        def three_interpolate_op(features: torch.Tensor, idx: torch.Tensor, weight: torch.Tensor) -> torch.Tensor:
+            return _cuda_ops.three_interpolate(features, idx, weight)
+
+        ops = {"furthest_point_sample": furthest_point_sample_op, "gather_operation": gather_operation_op,
+               "grouping_operation": grouping_operation_op, "ball_query": ball_query_op, "three_nn": three_nn_op,
+               "three_interpolate": three_interpolate_op}
+        for op in ops.values():
+            op.register_vmap(_vmap_rule(op))
+    except RuntimeError:
+        # 以其他模块名重复导入本文件时算子已经注册过，直接使用已注册的算子
+        ops = {name: getattr(torch.ops.ibsnet_pn2, name) for name in (
+            "furthest_point_sample", "gather_operation", "grouping_operation", "ball_query", "three_nn",
+            "three_interpolate")}
+    _batched_cuda_ops = types.SimpleNamespace(**ops)
+    return _batched_cuda_ops
+
+
+def _get_cuda_ops(*tensors: torch.Tensor):
+    """
+    Returns:
+        应调用的CUDA实现，应使用PyTorch实现时返回None
+    """
+    # CUDA扩展的算子无法被torch.jit.trace记录到可保存的计算图中，导出时使用PyTorch实现
+    if _cuda_ops is None or not tensors[0].is_cuda or torch.jit.is_tracing():
+        return None
+    if not any(_is_batched(tensor) for tensor in tensors):
+        return _cuda_ops
+    # vmap中需要梯度时使用PyTorch实现
+    if torch.is_grad_enabled():
+        return None
+    return _get_batched_cuda_ops()
+
+
+def _call_cuda_ops_float32(op, features: torch.Tensor, *args):
+    """CUDA扩展的特征算子只支持float32，混合精度训练时先转换为float32计算，再转回输入的类型"""
+    if features.dtype == torch.float32:
+        return op(features, *args)
+    return op(features.float(), *args).to(features.dtype)
+
+
+def furthest_point_sample_torch(xyz: torch.Tensor, npoint: int):
+    """
+    与CUDA实现的规则相同：从第0个点开始，每次选取到已选点集距离最远的点（距离完全相等时取序号最小的点），
+    模长不超过1e-3的点（如补零的点）永远不会被选中
+    Args:
+        xyz: tensor, (B, N, 3)
+        npoint: 采样点数
+    Returns:
+        idx: tensor, (B, npoint), int32
+    """
+    batch_size, points_num, _ = xyz.shape
+    xyz = xyz.detach().float()
+    valid = (xyz ** 2).sum(-1) > 1e-3
+    batch_idx = torch.arange(batch_size, device=xyz.device)
+
+    # 无效点的距离固定为-1，取min后保持不变，因此不会被选中
+    min_dists = torch.where(valid, torch.full_like(valid, 1e10, dtype=xyz.dtype),
+                            torch.full_like(valid, -1., dtype=xyz.dtype))
+    farthest = torch.zeros(batch_size, dtype=torch.long, device=xyz.device)
+    # 不对预先分配的idx原地赋值，使该函数可以在torch.func.vmap中调用
+    idx = [farthest]
+    for i in range(1, npoint):
+        # 与CUDA实现保持相同的计算顺序，避免浮点误差导致选点不同
+        diff = xyz - xyz[batch_idx, farthest].unsqueeze(1)
+        diff = diff * diff
+        min_dists = torch.minimum(min_dists, diff[..., 0] + diff[..., 1] + diff[..., 2])
+        farthest = torch.argmax(min_dists, dim=-1)
+        idx.append(farthest)
+    return torch.stack(idx, dim=1).int()
+
+
+def gather_operation_torch(features: torch.Tensor, idx: torch.Tensor):
+    """
+    Args:
+        features: tensor, (B, C, N)
+        idx: tensor, (B, npoint)
+    Returns:
+        tensor, (B, C, npoint)
+    """
+    idx = idx.long().unsqueeze(1).expand(-1, features.shape[1], -1)
+    return torch.gather(features, 2, idx)
+
+
+def grouping_operation_torch(features: torch.Tensor, idx: torch.Tensor):
+    """
+    Args:
+        features: tensor, (B, C, N)
+        idx: tensor, (B, npoint, nsample)
+    Returns:
+        tensor, (B, C, npoint, nsample)
+    """
+    batch_size, npoint, nsample = idx.shape
+    grouped = gather_operation_torch(features, idx.reshape(batch_size, npoint * nsample))
+    return grouped.view(batch_size, features.shape[1], npoint, nsample)
+
+
+def ball_query_torch(radius: float, nsample: int, xyz: torch.Tensor, new_xyz: torch.Tensor):
+    """
+    与CUDA实现相同：按序号顺序取球内的前nsample个点，不足时以第一个点补齐，球内没有点时为0
+    Args:
+        xyz: tensor, (B, N, 3)
+        new_xyz: tensor, (B, npoint, 3)
+    Returns:
+        idx: tensor, (B, npoint, nsample), int32
+    """
+    points_num = xyz.shape[1]
+    diff = new_xyz.detach().unsqueeze(2) - xyz.detach().unsqueeze(1)
+    in_ball = (diff ** 2).sum(-1) < radius ** 2  # (B, npoint, N)
+    idx = torch.arange(points_num, device=xyz.device).expand_as(in_ball)
+    idx = torch.where(in_ball, idx, torch.full_like(idx, points_num))
+    idx = idx.sort(dim=-1)[0][..., :nsample]
+    first = idx[..., :1]
+    first = torch.where(first == points_num, torch.zeros_like(first), first)
+    idx = torch.where(idx == points_num, first.expand_as(idx), idx)
+    return idx.int()
+
+
+def three_nn_torch(unknown: torch.Tensor, known: torch.Tensor):
+    """
+    Args:
+        unknown: tensor, (B, n, 3)
+        known: tensor, (B, m, 3)
+    Returns:
+        dist: tensor, (B, n, 3)，到最近的三个点的欧氏距离
+        idx: tensor, (B, n, 3), int32
+    """
+    dists = ((unknown.detach().unsqueeze(2) - known.detach().unsqueeze(1)) ** 2).sum(-1)  # (B, n, m)
+    dist2, idx = torch.topk(dists, 3, dim=-1, largest=False, sorted=True)
+    return torch.sqrt(dist2), idx.int()
+
+
+def three_interpolate_torch(features: torch.Tensor, idx: torch.Tensor, weight: torch.Tensor):
+    """
+    Args:
+        features: tensor, (B, c, m)
+        idx: tensor, (B, n, 3)
+        weight: tensor, (B, n, 3)
+    Returns:
+        tensor, (B, c, n)
+    """
+    grouped = grouping_operation_torch(features, idx)  # (B, c, n, 3)
+    return (grouped * weight.unsqueeze(1)).sum(-1)
+
+
+_furthest_point_sample_scripted = None
+
+
+def _get_furthest_point_sample_scripted():
+    """torch.jit.trace会将采样的循环完全展开，导出时改为调用script后的版本，保留循环"""
+    global _furthest_point_sample_scripted
+    if _furthest_point_sample_scripted is None:
+        _furthest_point_sample_scripted = torch.jit.script(furthest_point_sample_torch)
+    return _furthest_point_sample_scripted
+
+
+def furthest_point_sample(xyz: torch.Tensor, npoint: int):
+    if torch.jit.is_tracing():
+        return _get_furthest_point_sample_scripted()(xyz, npoint)
+    ops = _get_cuda_ops(xyz)
+    if ops is not None:
+        return ops.furthest_point_sample(xyz.float(), npoint)
+    return furthest_point_sample_torch(xyz, npoint)
+
+
+def gather_operation(features: torch.Tensor, idx: torch.Tensor):
+    ops = _get_cuda_ops(features, idx)
+    if ops is not None:
+        return _call_cuda_ops_float32(ops.gather_operation, features, idx)
+    return gather_operation_torch(features, idx)
+
+
+def grouping_operation(features: torch.Tensor, idx: torch.Tensor):
+    ops = _get_cuda_ops(features, idx)
+    if ops is not None:
+        return _call_cuda_ops_float32(ops.grouping_operation, features, idx)
+    return grouping_operation_torch(features, idx)
+
+
+def ball_query(radius: float, nsample: int, xyz: torch.Tensor, new_xyz: torch.Tensor):
+    ops = _get_cuda_ops(xyz, new_xyz)
+    if ops is not None:
+        return ops.ball_query(radius, nsample, xyz.float(), new_xyz.float())
+    return ball_query_torch(radius, nsample, xyz, new_xyz)
+
+
+def three_nn(unknown: torch.Tensor, known: torch.Tensor):
+    ops = _get_cuda_ops(unknown, known)
+    if ops is not None:
+        return ops.three_nn(unknown.float(), known.float())
+    return three_nn_torch(unknown, known)
+
+
+def three_interpolate(features: torch.Tensor, idx: torch.Tensor, weight: torch.Tensor):
+    ops = _get_cuda_ops(features, idx, weight)
+    if ops is not None:
+        return _call_cuda_ops_float32(ops.three_interpolate, features, idx, weight.float())
+    return three_interpolate_torch(features, idx, weight)
@@ -1,8 +1,11 @@
 import torch
 from torch import nn, einsum
-from pointnet2_ops.pointnet2_utils import furthest_point_sample, \
+from models.pn2_ops import furthest_point_sample, \
     gather_operation, ball_query, three_nn, three_interpolate, grouping_operation
 
+# query_knn单次计算的距离矩阵的内存上限，查询点按此分块
+KNN_CHUNK_MAX_BYTES = 64 * 1024 * 1024
+
 
 class Conv1d(nn.Module):
     def __init__(self, in_channel, out_channel, kernel_size=1, stride=1,  if_bn=True, activation_fn=torch.relu):
@@ -136,15 +139,16 @@ def sample_and_group(xyz, points, npoint, nsample, radius, use_xyz=True):
     return new_xyz, new_points, idx, grouped_xyz
 
 
-def sample_and_group_knn(xyz, points, npoint, k, use_xyz=True, idx=None):
+def sample_and_group_knn(xyz, points, npoint, k, use_xyz=True, idx=None, xyz_knn_idx=None):
     """
     Args:
         xyz: Tensor, (B, 3, N)
         points: Tensor, (B, f, N)
         npoint: int
-        nsample: int
-        radius: float
+        k: int
         use_xyz: boolean
+        idx: Tensor, (B, npoint, k)，采样点的邻域索引，给定时不再查询
+        xyz_knn_idx: Tensor, (B, N, k')，xyz自身的knn索引（k' >= k），给定时从中取出采样点的邻域索引，不再查询
 
     Returns:
         new_xyz: Tensor, (B, 3, npoint)
@@ -154,7 +158,12 @@ def sample_and_group_knn(xyz, points, npoint, k, use_xyz=True, idx=None):
 
     """
     xyz_flipped = xyz.permute(0, 2, 1).contiguous() # (B, N, 3)
-    new_xyz = gather_operation(xyz.contiguous(), furthest_point_sample(xyz_flipped, npoint)) # (B, 3, npoint)
+    fps_idx = furthest_point_sample(xyz_flipped, npoint)
+    new_xyz = gather_operation(xyz.contiguous(), fps_idx) # (B, 3, npoint)
+    if idx is None and xyz_knn_idx is not None and xyz_knn_idx.shape[-1] >= k:
+        # 采样点是xyz的子集，其在xyz中的knn就是xyz自身knn索引中对应的行
+        idx = torch.gather(xyz_knn_idx[:, :, :k], 1,
+                           fps_idx.long().unsqueeze(-1).expand(-1, -1, k)).contiguous()
     if idx is None:
         idx = query_knn(k, xyz_flipped, new_xyz.permute(0, 2, 1).contiguous())
     grouped_xyz = grouping_operation(xyz.contiguous(), idx) # (B, 3, npoint, nsample)
@@ -218,6 +227,10 @@ def square_distance(src, dst):
     Output:
         dist: per-point square distance, [B, N, M]
     """
+    if torch.is_autocast_enabled(src.device.type):
+        # 混合精度训练时距离仍在float32下计算，低精度的距离会改变kNN选出的近邻
+        with torch.autocast(src.device.type, enabled=False):
+            return square_distance(src.float(), dst.float())
     B, N, _ = src.shape
     _, M, _ = dst.shape
     dist = -2 * torch.matmul(src, dst.permute(0, 2, 1))  # B, N, M
@@ -226,12 +239,33 @@ def square_distance(src, dst):
     return dist
 
 
-def query_knn(nsample, xyz, new_xyz, include_self=True):
-    """Find k-NN of new_xyz in xyz"""
+def query_knn(nsample, xyz, new_xyz, include_self=True, max_bytes=KNN_CHUNK_MAX_BYTES):
+    """
+    Find k-NN of new_xyz in xyz
+    查询点按块计算距离矩阵并用topk取最近的点，单块距离矩阵的大小不超过max_bytes
+    Args:
+        nsample: int
+        xyz: Tensor, (B, N, 3)
+        new_xyz: Tensor, (B, S, 3)
+        include_self: 为False时去掉距离最近的点（即查询点自身）
+        max_bytes: 单块距离矩阵的内存上限，为None时不分块
+    Returns:
+        idx: Tensor, (B, S, nsample), int32
+    """
     pad = 0 if include_self else 1
-    sqrdists = square_distance(new_xyz, xyz)  # B, S, N
-    idx = torch.argsort(sqrdists, dim=-1, descending=False)[:, :, pad: nsample+pad]
-    return idx.int()
+    batch_size, points_num, _ = xyz.shape
+    query_num = new_xyz.shape[1]
+    k = min(nsample + pad, points_num)
+    if max_bytes is None:
+        chunk_size = query_num
+    else:
+        chunk_size = max(1, max_bytes // (batch_size * points_num * xyz.element_size()))
+
+    idx_list = []
+    for begin in range(0, query_num, chunk_size):
+        sqrdists = square_distance(new_xyz[:, begin: begin + chunk_size], xyz)  # B, s, N
+        idx_list.append(torch.topk(sqrdists, k, dim=-1, largest=False, sorted=True)[1][:, :, pad:])
+    return torch.cat(idx_list, dim=1).int()
 
 
 def fps_subsample(pcd, n_points=2048):
@@ -374,11 +408,13 @@ class PointNet_SA_Module_KNN(nn.Module):
         self.mlp_conv.append(Conv2d(last_channel, mlp[-1], if_bn=False, activation_fn=None))
         self.mlp_conv = nn.Sequential(*self.mlp_conv)
 
-    def forward(self, xyz, points, idx=None):
+    def forward(self, xyz, points, idx=None, xyz_knn_idx=None):
         """
         Args:
             xyz: Tensor, (B, 3, N)
             points: Tensor, (B, f, N)
+            idx: Tensor, (B, npoint, nsample)，采样点的邻域索引
+            xyz_knn_idx: Tensor, (B, N, k)，xyz自身的knn索引，如前一个Transformer的get_knn_index的结果
 
         Returns:
             new_xyz: Tensor, (B, 3, npoint)
@@ -387,7 +423,8 @@ class PointNet_SA_Module_KNN(nn.Module):
         if self.group_all:
             new_xyz, new_points, idx, grouped_xyz = sample_and_group_all(xyz, points, self.use_xyz)
         else:
-            new_xyz, new_points, idx, grouped_xyz = sample_and_group_knn(xyz, points, self.npoint, self.nsample, self.use_xyz, idx=idx)
+            new_xyz, new_points, idx, grouped_xyz = sample_and_group_knn(xyz, points, self.npoint, self.nsample, self.use_xyz,
+                                                                         idx=idx, xyz_knn_idx=xyz_knn_idx)
 
         new_points = self.mlp_conv(new_points)
         new_points = torch.max(new_points, 3)[0]
@@ -423,11 +460,23 @@ class Transformer(nn.Module):
         self.linear_start = nn.Conv1d(in_channel, dim, 1)
         self.linear_end = nn.Conv1d(dim, in_channel, 1)
 
-    def forward(self, x, pos):
+    def get_knn_index(self, pos):
+        """
+        Args:
+            pos: Tensor of positions, (B, 3, n)
+
+        Returns:
+            idx_knn: Tensor, (B, n, n_knn)
+        """
+        pos_flipped = pos.permute(0, 2, 1).contiguous()
+        return query_knn(self.n_knn, pos_flipped, pos_flipped)
+
+    def forward(self, x, pos, idx_knn=None):
         """feed forward of transformer
         Args:
             x: Tensor of features, (B, in_channel, n)
             pos: Tensor of positions, (B, 3, n)
+            idx_knn: Tensor, (B, n, n_knn)，pos的knn索引，为None时在此计算
 
         Returns:
             y: Tensor of features with attention, (B, in_channel, n)
@@ -438,8 +487,8 @@ class Transformer(nn.Module):
         x = self.linear_start(x)
         b, dim, n = x.shape
 
-        pos_flipped = pos.permute(0, 2, 1).contiguous()
-        idx_knn = query_knn(self.n_knn, pos_flipped, pos_flipped)
+        if idx_knn is None:
+            idx_knn = self.get_knn_index(pos)
         key = self.conv_key(x)
         value = self.conv_value(x)
         query = self.conv_query(x)
@@ -0,0 +1,155 @@
+"""
+导出IBSNet解码器的int8动态量化与bfloat16版本，并在测试集上评估量化前后的速度与精度
+精度以|udf1-udf2| < IBSThreshold的ibs判定与float32模型一致的查询点比例计，导出的checkpoint可以直接用于重建脚本
+"""
+import copy
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+
+from dataset import workspace as ws
+from utils import path_utils, geometry_utils
+from utils.export_utils import get_model_class, get_pcd_num
+from utils.quantize_utils import quantize_decoder, get_quantized_checkpoint
+from utils.device_utils import get_map_location
+
+
+def get_model(specs: dict, checkpoint):
+    model_name = specs.get("ModelOptions").get("Model")
+    factorized_decoder = specs.get("ModelOptions").get("FactorizedDecoder", False)
+    kwargs = {"factorized_decoder": factorized_decoder} if model_name != "grasping_field" else {}
+    model = get_model_class(model_name)(**kwargs)
+    model.load_state_dict(checkpoint["model"])
+    return model.eval()
+
+
+def get_test_instances(specs: dict):
+    """
+    Returns:
+        [(instance_name, pcd1路径, pcd2路径, udf路径)]
+    """
+    data_source = specs.get("DataSource")
+    max_instances = specs.get("ExportOptions").get("MaxTestInstances")
+    with open(specs.get("TestSplit"), "r") as f:
+        split = json.load(f)
+
+    instances = []
+    for dataset in split:
+        for class_name in split[dataset]:
+            for instance_name in split[dataset][class_name]:
+                scene_name = re.match(ws.scene_patten, instance_name).group()
+                pcd_dir = os.path.join(data_source, ws.pcd_samples_subdir, dataset, class_name)
+                udf_path = os.path.join(data_source, ws.udf_samples_subdir, dataset, class_name, scene_name + ".npz")
+                instances.append((instance_name,
+                                  os.path.join(pcd_dir, instance_name + "_0.ply"),
+                                  os.path.join(pcd_dir, instance_name + "_1.ply"),
+                                  udf_path))
+    if max_instances is not None:
+        instances = instances[:max_instances]
+    return instances
+
+
+def evaluate(specs: dict, models: dict, logger):
+    """
+    在测试集上比较各个模型与float32模型的ibs判定，所有模型共享float32编码器得到的latent
+    Args:
+        models: {名称: 模型}，必须包含"fp32"
+    Returns:
+        {名称: {"seconds": 解码总耗时, "queries": 查询点数, "agreement": ibs判定一致的比例,
+               "iou": ibs点集的交并比, "max_diff": udf的最大误差}}
+    """
+    threshold = specs.get("ExportOptions").get("IBSThreshold")
+    chunk_size = specs.get("ExportOptions").get("QueryChunkSize")
+    stats = {name: {"seconds": 0., "queries": 0, "agree": 0, "intersection": 0, "union": 0, "max_diff": 0.}
+             for name in models}
+
+    for instance_name, pcd1_path, pcd2_path, udf_path in get_test_instances(specs):
+        if not (os.path.isfile(pcd1_path) and os.path.isfile(pcd2_path) and os.path.isfile(udf_path)):
+            logger.warning("missing data of instance '{}', skipped".format(instance_name))
+            continue
+        pcd1 = geometry_utils.read_ply_points_tensor(pcd1_path).unsqueeze(0)
+        pcd2 = geometry_utils.read_ply_points_tensor(pcd2_path).unsqueeze(0)
+        query_points = torch.from_numpy(np.asarray(np.load(udf_path)["data"], dtype=np.float32)[:, :3])
+        latent = models["fp32"].encode(pcd1, pcd2)
+
+        outputs = dict()
+        for name, model in models.items():
+            time_begin = time.perf_counter()
+            outputs[name] = model.decode(latent, query_points, chunk_size)
+            stats[name]["seconds"] += time.perf_counter() - time_begin
+            stats[name]["queries"] += query_points.shape[0]
+
+        udf1_fp32, udf2_fp32 = outputs["fp32"]
+        ibs_fp32 = torch.abs(udf1_fp32 - udf2_fp32) < threshold
+        for name, (udf1, udf2) in outputs.items():
+            ibs = torch.abs(udf1 - udf2) < threshold
+            stats[name]["agree"] += (ibs == ibs_fp32).sum().item()
+            stats[name]["intersection"] += (ibs & ibs_fp32).sum().item()
+            stats[name]["union"] += (ibs | ibs_fp32).sum().item()
+            max_diff = max((udf1 - udf1_fp32).abs().max().item(), (udf2 - udf2_fp32).abs().max().item())
+            stats[name]["max_diff"] = max(stats[name]["max_diff"], max_diff)
+        logger.info("instance {} evaluated, queries: {}".format(instance_name, query_points.shape[0]))
+
+    results = dict()
+    for name, stat in stats.items():
+        results[name] = {
+            "seconds": stat["seconds"],
+            "queries": stat["queries"],
+            "agreement": stat["agree"] / max(stat["queries"], 1),
+            "iou": stat["intersection"] / stat["union"] if stat["union"] > 0 else 1.,
+            "max_diff": stat["max_diff"]
+        }
+    return results
+
+
+def export_quantized_decoder(specs: dict, logger):
+    model_name = specs.get("ModelOptions").get("Model")
+    # 评估时以两个物体的udf之差判定ibs，单物体模型（IMNet）没有可比较的ibs
+    if get_pcd_num(model_name) != 2:
+        raise ValueError("quantized decoder export evaluates the ibs of two objects, "
+                         "single object model '{}' is not supported".format(model_name))
+    model_path = specs.get("path_options").get("model_path")
+    export_dir = specs.get("path_options").get("export_dir")
+    quantizations = specs.get("ExportOptions").get("Quantizations")
+    path_utils.generate_path(export_dir)
+
+    checkpoint = torch.load(model_path, map_location=get_map_location("cpu"))
+    models = {"fp32": get_model(specs, checkpoint)}
+    model_stem = os.path.splitext(os.path.basename(model_path))[0]
+    for quantization in quantizations:
+        model = quantize_decoder(copy.deepcopy(models["fp32"]), quantization).eval()
+        models[quantization] = model
+        export_path = os.path.join(export_dir, "{}_{}.pth".format(model_stem, quantization))
+        torch.save(get_quantized_checkpoint(model, quantization, checkpoint["epoch"]), export_path)
+        logger.info("export {} model to {}".format(quantization, export_path))
+
+    results = evaluate(specs, models, logger)
+    fp32_seconds = results["fp32"]["seconds"]
+    for name, result in results.items():
+        logger.info("{:<5} queries/s: {:>10.0f}, speedup: {:.2f}x, ibs agreement: {:.5f}, ibs iou: {:.5f}, "
+                    "max udf diff: {:.2e}".format(name, result["queries"] / max(result["seconds"], 1e-9),
+                                                  fp32_seconds / max(result["seconds"], 1e-9), result["agreement"],
+                                                  result["iou"], result["max_diff"]))
+    return results
+
+
+if __name__ == '__main__':
+    config_filepath = 'postprocess/configs/export_quantized_decoder.json'
+    specs = path_utils.read_config(config_filepath)
+
+    logger = logging.getLogger("export_quantized_decoder")
+    logger.setLevel("INFO")
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(level=logging.INFO)
+    logger.addHandler(stream_handler)
+
+    with torch.no_grad():
+        export_quantized_decoder(specs, logger)
@@ -12,7 +12,6 @@ import time
 import torch
 import logging
 
-from models.models_grasping_field import IBSNet
 from utils.reconstruct_utils import *
 from utils import log_utils, path_utils, geometry_utils, random_utils
 
@@ -37,28 +36,26 @@ def is_point_on_ibs(point: np.ndarray, min_bound, max_bound):
     return True
 
 
-def get_points_on_ibs(model: torch.nn.Module, pcd1: torch.Tensor, pcd2: torch.Tensor, query_points: torch.Tensor, threshold: float):
+def get_points_on_ibs(model: torch.nn.Module, latent: torch.Tensor, query_points: torch.Tensor, threshold: float, chunk_size: int = None):
     """
     :param model: pretrained model
-    :param pcd1: point cloud 1, (2048, 3)
-    :param pcd2: point cloud 2, (2048, 3)
+    :param latent: latent code of the scene, model.encode(pcd1, pcd2), (1, latent_dim)
     :param query_points: query points, (n, 3)
     :param threshold: when |udf1-udf2| < threhold, it is on ibs
+    :param chunk_size: number of query points decoded at a time, None to decode all at once
     :return: points: np.ndarray, points in query_points which is on ibs
     """
-    assert pcd1.device == pcd2.device == query_points.device
-    sample_points_num = query_points.shape[0]
-    udf1, udf2 = model(pcd1, pcd2, query_points, sample_points_num)
-    udf1_np = udf1.detach().cpu().numpy()
-    udf2_np = udf2.detach().cpu().numpy()
-    points = [query_point.detach().cpu().numpy() for i, query_point in enumerate(query_points) if abs(udf1_np[i] - udf2_np[i]) < threshold]
+    assert latent.device == query_points.device
+    udf1, udf2 = model.decode(latent, query_points, chunk_size)
+    mask = torch.abs(udf1 - udf2) < threshold
 
-    return np.array(points, dtype=np.float32).reshape(-1, 3)
+    return query_points[mask].detach().cpu().numpy().astype(np.float32).reshape(-1, 3)
 
 
-def get_seed_points(specs: dict, filename: str, model: torch.nn.Module, pcd1: torch.Tensor, pcd2: torch.Tensor, threshold: float):
+def get_seed_points(specs: dict, filename: str, model: torch.nn.Module, latent: torch.Tensor, threshold: float):
     device = specs.get("Device")
     seed_num = specs.get("ReconstructOptions").get("SeedPointNum")
+    chunk_size = specs.get("ReconstructOptions").get("QueryChunkSize")
 
     aabb = get_aabb(specs, filename)
     seed_points = np.zeros((0, 3))
@@ -69,7 +66,7 @@ def get_seed_points(specs: dict, filename: str, model: torch.nn.Module, pcd1: to
         logger.debug("iterate {} when generate seeds, seed number: {}".format(iterate_time, seed_points.shape[0]))
         query_points = random_utils.get_random_points_in_aabb(aabb, seed_num)
         query_points = torch.from_numpy(np.array(query_points, dtype=np.float32)).to(device)
-        points_on_ibs = get_points_on_ibs(model, pcd1, pcd2, query_points, threshold)
+        points_on_ibs = get_points_on_ibs(model, latent, query_points, threshold, chunk_size)
         seed_points = np.concatenate((seed_points, points_on_ibs), axis=0)
         iterate_time += 1
 
@@ -93,15 +90,13 @@ def get_pcd_torch(specs: dict, filename: str):
     pcd1_path = os.path.join(pcd_path, pcd1_filename)
     pcd2_path = os.path.join(pcd_path, pcd2_filename)
 
-    pcd1 = geometry_utils.read_point_cloud(pcd1_path)
-    pcd2 = geometry_utils.read_point_cloud(pcd2_path)
-
-    pcd1_torch = torch.from_numpy(np.array(pcd1.points, dtype=np.float32)).to(device)
-    pcd2_torch = torch.from_numpy(np.array(pcd2.points, dtype=np.float32)).to(device)
+    pcd1_torch = geometry_utils.read_ply_points_tensor(pcd1_path).to(device)
+    pcd2_torch = geometry_utils.read_ply_points_tensor(pcd2_path).to(device)
 
     return pcd1_torch, pcd2_torch
 
 
+@torch.no_grad()
 def reconstruct_ibs(specs: dict, filename: str, model: torch.nn.Module):
     """
     :param specs: specification
@@ -114,13 +109,16 @@ def reconstruct_ibs(specs: dict, filename: str, model: torch.nn.Module):
     pcd1, pcd2 = get_pcd_torch(specs, filename)
     pcd1 = pcd1.unsqueeze(0)
     pcd2 = pcd2.unsqueeze(0)
+    # 每个场景只编码一次，之后的查询只运行解码器
+    latent = model.encode(pcd1, pcd2)
 
     point_num = specs.get("ReconstructOptions").get("ReconstructPointNum")
     diffuse_num = specs.get("ReconstructOptions").get("DiffuseNum")
     diffuse_radius = specs.get("ReconstructOptions").get("DiffuseRadius")
+    chunk_size = specs.get("ReconstructOptions").get("QueryChunkSize")
 
     # generate seed points
-    seed_points = get_seed_points(specs, filename, model, pcd1, pcd2, threshold)
+    seed_points = get_seed_points(specs, filename, model, latent, threshold)
     if seed_points is None:
         logger.warning("generate seed points failed")
         return
@@ -133,7 +131,7 @@ def reconstruct_ibs(specs: dict, filename: str, model: torch.nn.Module):
         query_points = random_utils.get_random_points_from_seeds(points, diffuse_num, diffuse_radius)
         query_points = np.array(query_points, dtype=np.float32)
         query_points = torch.from_numpy(query_points).to(device)
-        points_ = get_points_on_ibs(model, pcd1, pcd2, query_points, threshold)
+        points_ = get_points_on_ibs(model, latent, query_points, threshold, chunk_size)
         points = np.concatenate((points, points_), axis=0)
 
     ibs_pcd = o3d.geometry.PointCloud()
@@ -179,8 +177,18 @@ if __name__ == '__main__':
     # get pretrained model
     device = specs.get("Device")
     model_path = specs.get("path_options").get("model_path")
-    checkpoint = torch.load(model_path, map_location="cuda:{}".format(device))
-    model = get_network(specs, IBSNet, checkpoint)
+    inference_backend = specs.get("ModelOptions", {}).get("InferenceBackend", "eager")
+    if inference_backend == "torchscript":
+        # model_path为export_model.py导出的模型
+        model = get_torchscript_network(specs, model_path)
+    elif inference_backend == "onnxruntime":
+        # model_path为export_model.py导出的ONNX模型目录
+        model = get_onnx_network(specs, model_path)
+    else:
+        from models.models_grasping_field import IBSNet
+        checkpoint = torch.load(model_path, map_location=get_map_location(device))
+        stacked_encoders = specs.get("ModelOptions", {}).get("StackedEncoders", False)
+        model = get_network(specs, IBSNet, checkpoint, stacked_encoders=stacked_encoders)
 
     # get instance name
     filename_list = get_filename_list(specs)
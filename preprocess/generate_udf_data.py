@@ -4,7 +4,6 @@
 import copy
 import multiprocessing
 import os
-import random
 import re
 import logging
 
@@ -53,20 +52,81 @@ def save_sdf(specs, sdf_dir, SDF_data, scene):
     np.savez(sdf_path, data=SDF_data)
 
 
-class IndirectSdfSampleGenerator:
-    """生成间接法的sdf数据"""
+class MeshDistanceQuery:
+    """
+    点到两个mesh的距离查询，每个mesh的BVH在构造时只建立一次，同一场景的所有查询共享
+    """
 
-    def __init__(self, specs):
-        self.specs = specs
+    def __init__(self, mesh1, mesh2):
+        self.scene1 = self.build_scene(mesh1)
+        self.scene2 = self.build_scene(mesh2)
 
-    def query_dist(self, mesh, points):
-        points = o3d.core.Tensor(np.array(points), dtype=o3d.core.Dtype.Float32)
+    @staticmethod
+    def build_scene(mesh):
         scene = o3d.t.geometry.RaycastingScene()
-        mesh_t = o3d.t.geometry.TriangleMesh.from_legacy(mesh)
-        scene.add_triangles(mesh_t)
-        return scene.compute_distance(points)
+        scene.add_triangles(o3d.t.geometry.TriangleMesh.from_legacy(mesh))
+        return scene
+
+    @staticmethod
+    def to_tensor(points):
+        return o3d.core.Tensor(np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 3))
+
+    def query_mesh1(self, points):
+        """Returns: np.ndarray, (n,)"""
+        return self.scene1.compute_distance(self.to_tensor(points)).numpy()
+
+    def query_mesh2(self, points):
+        """Returns: np.ndarray, (n,)"""
+        return self.scene2.compute_distance(self.to_tensor(points)).numpy()
+
+    def query(self, points):
+        """
+        一次调用同时查询到mesh1和mesh2的距离
+        Returns:
+            np.ndarray, (n, 2), 第0列为到mesh1的距离，第1列为到mesh2的距离
+        """
+        points = self.to_tensor(points)
+        return np.stack([self.scene1.compute_distance(points).numpy(),
+                         self.scene2.compute_distance(points).numpy()], axis=1)
+
+
+class IndirectSdfSampleGenerator:
+    """生成间接法的sdf数据"""
 
-    def get_sdf_samples_surface(self, mesh1, mesh2):
+    def __init__(self, specs, dist_query: MeshDistanceQuery, rng=None):
+        self.specs = specs
+        self.dist_query = dist_query
+        self.rng = random_utils.get_rng(rng)
+
+    def sample_near_mesh(self, query_fn, num: int, dist: float, init_num: int = 200000):
+        """
+        拒绝采样：保留到mesh距离不超过dist且位于半径为0.5的球内的点，直到采满num个
+        第一批在球内均匀采样，之后以已接受的点为种子在其附近采样
+        Args:
+            query_fn: 输入(n, 3)的点，返回(n,)的距离
+            num: 需要的点数
+            dist: 距离阈值
+            init_num: 第一批的候选点数
+        Returns:
+            np.ndarray, (num, 3)
+        """
+        points = np.empty((num, 3), dtype=np.float32)
+        filled = 0
+        while filled < num:
+            if filled == 0:
+                candidates = random_utils.get_random_points_in_sphere(init_num, rng=self.rng)
+            else:
+                candidates = random_utils.get_random_points_from_seeds(points[:filled], 3, dist * 3, rng=self.rng)
+            mask = (query_fn(candidates) <= dist) & (np.linalg.norm(candidates, axis=1) <= 0.5)
+            accepted = candidates[mask]
+            # 候选点按种子顺序排列，打乱后再截取，避免偏向靠前的种子
+            self.rng.shuffle(accepted)
+            take = min(accepted.shape[0], num - filled)
+            points[filled: filled + take] = accepted[:take]
+            filled += take
+        return points
+
+    def get_sdf_samples_surface(self):
         """在mesh1和mesh2表面附近、半径为0.5的球形区域内进行采样"""
         points_num = self.specs["sdf_sample_options_indirect"]["points_num"]
         sample_option = self.specs["sdf_sample_options_indirect"]["surface_sample_option"]
@@ -76,31 +136,9 @@ class IndirectSdfSampleGenerator:
         mesh2_num = int(points_num * sample_option["proportion2"])
         sphere_num = int(points_num * sample_option["proportion_sphere"])
 
-        mesh1_points = []
-        mesh2_points = []
-        sphere_points = []
-
-        while len(mesh1_points) < mesh1_num:
-            if len(mesh1_points) == 0:
-                random_points = random_utils.get_random_points_in_sphere(200000)
-            else:
-                random_points = random_utils.get_random_points_from_seeds(mesh1_points, 3, dist * 3)
-            dists = self.query_dist(mesh1, random_points)
-            mesh1_points += [random_points[i] for i in range(len(random_points)) if
-                           dists[i] <= dist and np.linalg.norm(random_points[i]) <= 0.5]
-        mesh1_points = np.array(random.sample(mesh1_points, mesh1_num))
-
-        while len(mesh2_points) < mesh2_num:
-            if len(mesh2_points) == 0:
-                random_points = random_utils.get_random_points_in_sphere(200000)
-            else:
-                random_points = random_utils.get_random_points_from_seeds(mesh2_points, 3, dist * 3)
-            dists = self.query_dist(mesh2, random_points)
-            mesh2_points += [random_points[i] for i in range(len(random_points)) if
-                           dists[i] <= dist and np.linalg.norm(random_points[i]) <= 0.5]
-        mesh2_points = np.array(random.sample(mesh2_points, mesh2_num))
-
-        sphere_points = np.array(random_utils.get_random_points_in_sphere(sphere_num))
+        mesh1_points = self.sample_near_mesh(self.dist_query.query_mesh1, mesh1_num, dist)
+        mesh2_points = self.sample_near_mesh(self.dist_query.query_mesh2, mesh2_num, dist)
+        sphere_points = random_utils.get_random_points_in_sphere(sphere_num, rng=self.rng)
 
         return np.concatenate([mesh1_points, mesh2_points, sphere_points], axis=0)
 
@@ -113,26 +151,18 @@ class IndirectSdfSampleGenerator:
         proportion_IOU = sample_options["proportion_IOU"]
         proportion_other = sample_options["proportion_other"]
 
-        random_points_aabb1 = random_utils.get_random_points_with_limit(aabb1, int(points_num * proportion_aabb1))
-        random_points_aabb2 = random_utils.get_random_points_with_limit(aabb2, int(points_num * proportion_aabb2))
-        random_points_IOU = random_utils.get_random_points_with_limit(aabb_IOU, int(points_num * proportion_IOU))
-        random_points_other = random_utils.get_random_points_in_sphere(int(points_num * proportion_other))
+        random_points_aabb1 = random_utils.get_random_points_with_limit(aabb1, int(points_num * proportion_aabb1), rng=self.rng)
+        random_points_aabb2 = random_utils.get_random_points_with_limit(aabb2, int(points_num * proportion_aabb2), rng=self.rng)
+        random_points_IOU = random_utils.get_random_points_with_limit(aabb_IOU, int(points_num * proportion_IOU), rng=self.rng)
+        random_points_other = random_utils.get_random_points_in_sphere(int(points_num * proportion_other), rng=self.rng)
         return np.concatenate([random_points_aabb1, random_points_aabb2, random_points_IOU, random_points_other], axis=0)
 
-    def get_sdf_values(self, mesh1, mesh2, sdf_samples):
+    def get_sdf_values(self, sdf_samples):
         """获取sdf_samples在mesh1，mesh2场内的sdf值，拼接成(x, y, z, sdf1, sdf2)的形式"""
-        dists_1 = self.query_dist(mesh1, sdf_samples).numpy().reshape(-1, 1)
-        dists_2 = self.query_dist(mesh2, sdf_samples).numpy().reshape(-1, 1)
-        SDF_data = np.concatenate([sdf_samples, dists_1, dists_2], axis=1)
+        dists = self.dist_query.query(sdf_samples)
+        SDF_data = np.concatenate([sdf_samples, dists], axis=1)
         return SDF_data
 
-    def get_indirect_partial_sdf(self, pcd1_partial_list, pcd2_partial_list, sdf_samples):
-        """依次计算sdf_samples在pcd1_partial_list，pcd2_partial_list中各个点云对场内的sdf值，返回列表"""
-        SDF_partial_data = []
-        for i in range(len(pcd1_partial_list)):
-            SDF_partial_data.append(self.get_sdf_values(pcd1_partial_list[i], pcd2_partial_list[i], sdf_samples))
-        return SDF_partial_data
-
 
 class TrainDataGenerator:
     def __init__(self, specs, logger=None):
@@ -149,6 +179,7 @@ class TrainDataGenerator:
         self.aabb2_zoom = None
         self.aabb_IOU_zoom = None
         self.aabb_IOU_ibs = None
+        self.dist_query = None
         self.logger = logger
 
     def get_mesh(self):
@@ -217,18 +248,19 @@ class TrainDataGenerator:
         self.get_mesh()
         self.get_aabb()
         self.get_IOU()
+        self.dist_query = MeshDistanceQuery(self.mesh1, self.mesh2)
 
     def get_sdf_data(self):
         """获取间接法的数据，即完整点云下的sdf场(x, y, z, sdf1, sdf2)"""
         method = self.specs["sdf_sample_options_indirect"]["method"]
-        idSdfGenerator = IndirectSdfSampleGenerator(self.specs)
+        idSdfGenerator = IndirectSdfSampleGenerator(self.specs, self.dist_query)
         if method == "surface":
-            sdf_samples_indirect = idSdfGenerator.get_sdf_samples_surface(self.mesh1, self.mesh2)
+            sdf_samples_indirect = idSdfGenerator.get_sdf_samples_surface()
         elif method == "IOU":
             sdf_samples_indirect = idSdfGenerator.get_sdf_samples_IOU(self.aabb1_zoom, self.aabb2_zoom, self.aabb_IOU_zoom)
         else:
             raise SampleMethodException
-        sdf_data_indirect = idSdfGenerator.get_sdf_values(self.mesh1, self.mesh2, sdf_samples_indirect)
+        sdf_data_indirect = idSdfGenerator.get_sdf_values(sdf_samples_indirect)
         return sdf_data_indirect
 
     def visualize_result(self, sdf_data_indirect):
@@ -262,7 +294,7 @@ def my_process(scene, specs):
         trainDataGenerator.handle_scene(scene)
         _logger.info("scene: {} succeed".format(scene))
     except Exception as e:
-        _logger.error("scene: {} failed, exception message: {}".format(scene, e.message))
+        _logger.error("scene: {} failed, exception message: {}".format(scene, e))
     finally:
         _logger.removeHandler(file_handler)
         _logger.removeHandler(stream_handler)
@@ -288,7 +320,10 @@ if __name__ == '__main__':
                 view_list.append(filename)
 
     if specs.get("use_process_pool"):
-        pool = multiprocessing.Pool(processes=specs.get("process_num"))
+        # 每个进程各自为当前场景建立BVH，场景之间互不依赖，未配置进程数时使用全部核心
+        process_num = specs.get("process_num") or os.cpu_count()
+        logger.info("use process pool, process num: {}".format(process_num))
+        pool = multiprocessing.Pool(processes=process_num)
 
         for filename in view_list:
             logger.info("current scene: {}".format(filename))
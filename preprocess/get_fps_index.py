@@ -0,0 +1,72 @@
+"""
+离线计算残缺点云(pcdScan)在PCT_encoder三次GDP中的fps索引并保存到fpsIndex，
+训练时开启TrainOptions.UseFPSIndex后由dataset读取，编码器不再在线进行furthest point sampling
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import torch
+
+from dataset import workspace as ws
+from models.models_cross_attention import get_gdp_fps_index
+from utils import path_utils, geometry_utils
+
+
+def get_pcd_fps_index(pcd_path: str, device):
+    """
+    Args:
+        pcd_path: 残缺点云路径
+        device: 计算fps使用的设备
+    Returns:
+        fps_idx: np.ndarray, (N//4 + N//8 + N//16,), int32
+    """
+    points = torch.from_numpy(geometry_utils.read_ply_points(pcd_path)).float().unsqueeze(0).to(device)
+    return get_gdp_fps_index(points)[0].cpu().numpy().astype(np.int32)
+
+
+def get_fps_index(specs: dict, logger):
+    data_source = specs.get("path_options").get("data_source")
+    split_files = specs.get("path_options").get("split_files")
+    device = specs.get("fps_options").get("device")
+
+    pcd_dir = os.path.join(data_source, ws.pcd_samples_subdir)
+    save_dir = os.path.join(data_source, ws.fps_index_subdir)
+
+    finished = set()
+    for split_file in split_files:
+        with open(split_file, "r") as f:
+            split = json.load(f)
+        for dataset in split:
+            for class_name in split[dataset]:
+                path_utils.generate_path(os.path.join(save_dir, dataset, class_name))
+                for instance_name in split[dataset][class_name]:
+                    for pcd_filename in [instance_name + "_0.ply", instance_name + "_1.ply"]:
+                        pcd_key = "/".join([dataset, class_name, pcd_filename])
+                        if pcd_key in finished:
+                            continue
+                        pcd_path = os.path.join(pcd_dir, dataset, class_name, pcd_filename)
+                        if not os.path.isfile(pcd_path):
+                            logger.warning("missing point cloud '{}', skipped".format(pcd_key))
+                            continue
+                        fps_idx = get_pcd_fps_index(pcd_path, device)
+                        save_path = os.path.join(save_dir, dataset, class_name,
+                                                 os.path.splitext(pcd_filename)[0] + ".npy")
+                        np.save(save_path, fps_idx)
+                        finished.add(pcd_key)
+        logger.info("split {} finished, point clouds in total: {}".format(split_file, len(finished)))
+
+
+if __name__ == '__main__':
+    config_filepath = 'configs/get_fps_index.json'
+    specs = path_utils.read_config(config_filepath)
+
+    logger = logging.getLogger("get_fps_index")
+    logger.setLevel("INFO")
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(level=logging.INFO)
+    logger.addHandler(stream_handler)
+
+    with torch.no_grad():
+        get_fps_index(specs, logger)
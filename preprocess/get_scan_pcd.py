@@ -188,11 +188,8 @@ class ScanPcdGenerator:
         self.mesh2_vertices = np.asarray(mesh2.vertices)
         self.scene = o3d.t.geometry.RaycastingScene()
         self.get_ray_casting_scene()
-        self.scan_plane = None
         self.resolution_width = self.specs["scan_options"]["resolution_width"]
         self.resolution_height = self.specs["scan_options"]["resolution_height"]
-        self.pixel_width = 0
-        self.pixel_height = 0
         self.visualizer = Visualizer()
 
     def get_ray_casting_scene(self):
@@ -286,15 +283,11 @@ class ScanPcdGenerator:
             投影点，type: np.ndarray，shape: (n, 3)
         """
         pixel_width, pixel_height = self.get_pixel_size(projection_plane, resolution_width, resolution_height)
-        projection_points = []
-        for i in range(resolution_width):
-            for j in range(resolution_height):
-                point = projection_plane.get_left_up() + \
-                        i * pixel_width * projection_plane.get_dir_right() + \
-                        j * pixel_height * projection_plane.get_dir_down()
-                projection_points.append(point)
-
-        projection_points = np.array(projection_points).reshape(-1, 3)
+        # 宽方向为外层、高方向为内层，与逐像素遍历的顺序一致
+        i, j = np.meshgrid(np.arange(resolution_width), np.arange(resolution_height), indexing="ij")
+        projection_points = projection_plane.get_left_up().reshape(1, 3) + \
+                            (i.reshape(-1, 1) * pixel_width) * projection_plane.get_dir_right().reshape(1, 3) + \
+                            (j.reshape(-1, 1) * pixel_height) * projection_plane.get_dir_down().reshape(1, 3)
         return pixel_width, pixel_height, projection_points
 
     def get_rays_from_projection_points(self, eye, projection_points):
@@ -306,16 +299,16 @@ class ScanPcdGenerator:
         Returns:
             open3d rays, type: open3d.Tensor
         """
-        rays = []
         _eye = eye.reshape(1, 3)
-        for i in range(projection_points.shape[0]):
-            direction = (projection_points[i] - _eye) / np.linalg.norm((projection_points[i] - _eye))
-            rays.append(np.concatenate((_eye, direction), axis=1).reshape(6))
-        return o3d.core.Tensor(np.array(rays), dtype=o3d.core.Dtype.Float32)
+        direction = projection_points.reshape(-1, 3) - _eye
+        direction = direction / np.linalg.norm(direction, axis=1, keepdims=True)
+        rays = np.concatenate((np.repeat(_eye, direction.shape[0], axis=0), direction), axis=1)
+        return o3d.core.Tensor(rays.astype(np.float32), dtype=o3d.core.Dtype.Float32)
 
     def get_ray_cast_result(self, scene, rays):
-        """获取光线投射结果"""
-        return scene.cast_rays(rays)
+        """获取光线投射结果，转换为np.ndarray的字典，便于按视角切分"""
+        cast_result = scene.cast_rays(rays)
+        return {key: cast_result[key].numpy() for key in ("t_hit", "geometry_ids", "primitive_ids", "primitive_uvs")}
 
     def get_points_intersect(self, projection_points: np.ndarray, cast_result):
         """
@@ -328,16 +321,9 @@ class ScanPcdGenerator:
         """
         assert projection_points.shape[0] == cast_result["t_hit"].shape[0]
 
-        geometry_ids = cast_result["geometry_ids"].numpy()
-        points_intersect_with_obj1 = []
-        points_intersect_with_obj2 = []
-        for ray_id, intersect_id in enumerate(geometry_ids):
-            if intersect_id == 0:
-                points_intersect_with_obj1.append(projection_points[ray_id])
-            if intersect_id == 1:
-                points_intersect_with_obj2.append(projection_points[ray_id])
-        points_intersect_with_obj1 = np.array(points_intersect_with_obj1).reshape(-1, 3)
-        points_intersect_with_obj2 = np.array(points_intersect_with_obj2).reshape(-1, 3)
+        geometry_ids = cast_result["geometry_ids"]
+        points_intersect_with_obj1 = projection_points[geometry_ids == 0].reshape(-1, 3)
+        points_intersect_with_obj2 = projection_points[geometry_ids == 1].reshape(-1, 3)
         return points_intersect_with_obj1, points_intersect_with_obj2
 
     def is_view_legal(self, points_obj1, points_obj2):
@@ -363,47 +349,48 @@ class ScanPcdGenerator:
             plane: 随机点所处的平面
             points: 原始点
         Returns:
-            扩展后的点，type: np.ndarray，shape: (n, 3)
-        """
-        expanded_points = []
-        for i in range(points.shape[0]):
-            x_list = random_utils.randNormalFloat(-width, width, expand_points_num)
-            y_list = random_utils.randNormalFloat(-height, height, expand_points_num)
-            expanded_points.append(points[i])
-            for j in range(expand_points_num):
-                expanded_points.append(points[i]
-                                       + plane.get_dir_right() * x_list[j]
-                                       + plane.get_dir_up() * y_list[j])
-        return np.array(expanded_points).reshape(-1, 3)
+            扩展后的点，每个原始点后紧跟它的expand_points_num个扩展点，type: np.ndarray，shape: (n, 3)
+        """
+        points = points.reshape(-1, 3)
+        points_num = points.shape[0]
+        x_list = random_utils.randNormalFloat(-width, width, points_num * expand_points_num)
+        y_list = random_utils.randNormalFloat(-height, height, points_num * expand_points_num)
+        offsets = x_list.reshape(points_num, expand_points_num, 1) * plane.get_dir_right().reshape(1, 1, 3) + \
+                  y_list.reshape(points_num, expand_points_num, 1) * plane.get_dir_up().reshape(1, 1, 3)
+        expanded_points = np.concatenate((points.reshape(points_num, 1, 3),
+                                          points.reshape(points_num, 1, 3) + offsets), axis=1)
+        return expanded_points.reshape(-1, 3)
 
     def get_real_coordinate(self, vertices, triangles, uv_coordinate):
-        # 将三角形的重心坐标变换为真实坐标
-        point1 = vertices[triangles[0]]
-        point2 = vertices[triangles[1]]
-        point3 = vertices[triangles[2]]
-        return uv_coordinate[0] * point1 + uv_coordinate[1] * point2 + (
-                1 - uv_coordinate[0] - uv_coordinate[1]) * point3
+        """
+        将三角形的重心坐标变换为真实坐标，open3d(embree)的约定为p = (1-u-v)*p0 + u*p1 + v*p2
+        Args:
+            vertices: mesh的顶点，(v, 3)
+            triangles: 被击中的三角形，(n, 3)
+            uv_coordinate: 重心坐标，(n, 2)
+        Returns:
+            np.ndarray, (n, 3)
+        """
+        point1 = vertices[triangles[:, 0]]
+        point2 = vertices[triangles[:, 1]]
+        point3 = vertices[triangles[:, 2]]
+        u = uv_coordinate[:, 0:1]
+        v = uv_coordinate[:, 1:2]
+        return (1 - u - v) * point1 + u * point2 + v * point3
 
     def get_cur_view_pcd(self, cast_result):
-        hit = cast_result['t_hit'].numpy()
-        geometry_ids = cast_result["geometry_ids"].numpy()
-        primitive_ids = cast_result["primitive_ids"].numpy()
-        primitive_uvs = cast_result["primitive_uvs"].numpy()
-
-        points_pcd1 = []
-        points_pcd2 = []
+        hit = cast_result['t_hit']
+        geometry_ids = cast_result["geometry_ids"]
+        primitive_ids = cast_result["primitive_ids"]
+        primitive_uvs = cast_result["primitive_uvs"]
 
         # 获取光线击中的点
-        for i in range(hit.shape[0]):
-            if not math.isinf(hit[i]):
-                if geometry_ids[i] == 0:
-                    points_pcd1.append(
-                        self.get_real_coordinate(self.mesh1_vertices, self.mesh1_triangels[primitive_ids[i]],
-                                                 primitive_uvs[i]))
-                if geometry_ids[i] == 1:
-                    points_pcd2.append(
-                        self.get_real_coordinate(self.mesh2_vertices, self.mesh2_triangels[primitive_ids[i]],
-                                                 primitive_uvs[i]))
+        mask1 = np.isfinite(hit) & (geometry_ids == 0)
+        mask2 = np.isfinite(hit) & (geometry_ids == 1)
+        points_pcd1 = self.get_real_coordinate(self.mesh1_vertices, self.mesh1_triangels[primitive_ids[mask1]],
+                                               primitive_uvs[mask1])
+        points_pcd2 = self.get_real_coordinate(self.mesh2_vertices, self.mesh2_triangels[primitive_ids[mask2]],
+                                               primitive_uvs[mask2])
 
         pcd1_scan = o3d.geometry.PointCloud()
         pcd2_scan = o3d.geometry.PointCloud()
@@ -412,122 +399,188 @@ class ScanPcdGenerator:
 
         return pcd1_scan, pcd2_scan
 
-    def get_current_view_scan_pcd(self, theta, phi):
+    def get_view_list(self):
         """
-        获取某个角度观察的残缺点云数据
+        扫描的视角列表[(theta, phi)]，可由scan_options.view_list配置，
+        默认为俯视、仰视，以及天顶角45、90、135度下每隔45度的方位角
+        """
+        view_list = self.specs["scan_options"].get("view_list")
+        if view_list is not None:
+            return [tuple(view) for view in view_list]
+        view_list = [(0, 0), (180, 0)]
+        for theta in [45, 90, 135]:
+            for phi in range(0, 360, 45):
+                view_list.append((theta, phi))
+        return view_list
+
+    def init_view(self, theta, phi):
+        """
+        按照配置分辨率获取某个视角初始光线的相关信息
+        Returns:
+            dict，记录该视角的视点、投影平面、像素尺寸、待求交的投影点，以及已经求交得到的结果
+        """
+        scan_options = self.specs["scan_options"]
+        eye = self.get_view_point(theta, phi, scan_options["camera_ridius"])  # 视点，(3)
+        scan_plane = self.get_projection_plane(eye=eye, fov_deg=scan_options["fov_deg"])  # 投影平面
+        pixel_width, pixel_height, projection_points = \
+            self.get_projection_points(scan_plane, self.resolution_width, self.resolution_height)  # 投影点
+        projection_points = self.expand_points_in_rectangle(scan_options["expand_points_num"],
+                                                            pixel_width,
+                                                            pixel_height,
+                                                            scan_plane,
+                                                            projection_points)  # 扩充投影点，保证随机性
+        return {
+            "theta": theta,
+            "phi": phi,
+            "eye": eye,
+            "scan_plane": scan_plane,
+            "pixel_width": pixel_width,
+            "pixel_height": pixel_height,
+            "projection_points": projection_points,
+            # 已经与obj1、obj2相交的投影点，以及对应射线的求交结果
+            "points_obj1": np.zeros((0, 3)),
+            "points_obj2": np.zeros((0, 3)),
+            "hits": [],
+            "rays_cast": 0,
+            "success": True
+        }
+
+    def cast_views(self, views):
+        """
+        将多个视角待求交的投影点合并为一批射线，只调用一次cast_rays，再按视角切分求交结果，
+        新相交的投影点和求交结果追加到各视角已有的结果之后
+        Returns:
+            本次求交的射线总数
+        """
+        rays = np.concatenate([self.get_rays_from_projection_points(view["eye"], view["projection_points"]).numpy()
+                               for view in views], axis=0)
+        cast_result = self.get_ray_cast_result(self.scene, o3d.core.Tensor(rays, dtype=o3d.core.Dtype.Float32))
+        offset = 0
+        for view in views:
+            rays_num = view["projection_points"].shape[0]
+            view_cast_result = {key: value[offset: offset + rays_num] for key, value in cast_result.items()}
+            points_obj1, points_obj2 = self.get_points_intersect(view["projection_points"], view_cast_result)
+            view["points_obj1"] = np.concatenate((view["points_obj1"], points_obj1), axis=0)
+            view["points_obj2"] = np.concatenate((view["points_obj2"], points_obj2), axis=0)
+            hit_mask = (view_cast_result["geometry_ids"] == 0) | (view_cast_result["geometry_ids"] == 1)
+            view["hits"].append({key: value[hit_mask] for key, value in view_cast_result.items()})
+            view["rays_cast"] += rays_num
+            view["projection_points"] = None
+            offset += rays_num
+        return rays.shape[0]
+
+    def expand_view(self, view, pcd_sample_num):
+        """
+        与某个物体相交的光线数量不够，则将已相交的投影点在投影平面上进行扩充，
+        只有新扩充出的投影点作为下一轮待求交的投影点，已经求交过的射线不再重复投射
+        """
+        expand_points_num = self.specs["scan_options"]["expand_points_num"]
+        new_points = []
+        for obj_key, obj_name in (("points_obj1", "obj1"), ("points_obj2", "obj2")):
+            if view[obj_key].shape[0] < pcd_sample_num:
+                self.logger.info("theta: {}, phi: {}, intersect points with {} not enough, cur: {}, target: {}"
+                                 .format(view["theta"], view["phi"], obj_name, view[obj_key].shape[0], pcd_sample_num))
+                expanded_points = self.expand_points_in_rectangle(expand_points_num,
+                                                                  view["pixel_width"],
+                                                                  view["pixel_height"],
+                                                                  view["scan_plane"],
+                                                                  view[obj_key])
+                # 每个原始点后紧跟它的扩展点，去掉原始点
+                new_points.append(expanded_points.reshape(-1, expand_points_num + 1, 3)[:, 1:].reshape(-1, 3))
+        view["projection_points"] = np.concatenate(new_points, axis=0)
+
+    def scan_views(self, view_list):
+        """
+        获取多个视角观察的残缺点云数据，所有视角的初始光线一次求交，
+        之后每轮只对点数不足的视角扩充，且只投射新扩充的射线
         Args:
-            theta: 球坐标天顶角
-            phi: 球坐标方位角
+            view_list: [(theta, phi)]
         Returns:
-            残缺点云1，残缺点云2，是否采集成功
+            [(残缺点云1，残缺点云2，是否采集成功)]，与view_list一一对应
         """
         scan_options = self.specs["scan_options"]
-        camera_ridius = scan_options["camera_ridius"]
-        fov_deg = scan_options["fov_deg"]
         pcd_point_num = scan_options["points_num"]
-        expand_points_num = scan_options["expand_points_num"]
         pcd_sample_num = 1.5 * pcd_point_num
         assert pcd_sample_num > pcd_point_num
 
-        # 按照配置分辨率获取初始光线的相关信息
-        eye = self.get_view_point(theta, phi, camera_ridius)  # 视点，(3)
-        self.scan_plane = self.get_projection_plane(eye=eye, fov_deg=fov_deg)  # 投影平面
-        self.pixel_width, self.pixel_height, projection_points = \
-            self.get_projection_points(self.scan_plane,
-                                       self.resolution_width,
-                                       self.resolution_height)  # 投影点
-        projection_points = self.expand_points_in_rectangle(expand_points_num,
-                                                            self.pixel_width,
-                                                            self.pixel_height,
-                                                            self.scan_plane,
-                                                            projection_points)  # 扩充投影点，保证随机性
-        rays = self.get_rays_from_projection_points(eye, projection_points)  # 射线
-        # self.visualizer.visualize_rays(eye, rays, [self.mesh1, self.mesh2, geometry_utils.get_sphere_pcd(radius=0.5)])
-        cast_result = self.get_ray_cast_result(self.scene, rays)  # 射线求交结果
-        points_obj1, points_obj2 = self.get_points_intersect(projection_points, cast_result)  # 与obj1、obj2相交的射线投影点
-        self.logger.info("init rays num: {}, intersect with obj1: {}, intersect with obj2: {}"
-                         .format(rays.shape[0], points_obj1.shape[0], points_obj2.shape[0]))
+        views = [self.init_view(theta, phi) for theta, phi in view_list]
+        rays_num = self.cast_views(views)
+        self.logger.info("init rays num: {}, views num: {}".format(rays_num, len(views)))
+
         # 判断初始结果是否满足采集条件
-        if not self.is_view_legal(points_obj1, points_obj2):
-            self.logger.warning("not enough init points, theta: {}, phi: {}".format(theta, phi))
-            return None, None, False
-        rays_obj1 = self.get_rays_from_projection_points(eye, points_obj1)
-        rays_obj2 = self.get_rays_from_projection_points(eye, points_obj2)
-
-        # 迭代地在相交的局部增大分辨率，直到足够的射线与两模型相交
-        while points_obj1.shape[0] < pcd_sample_num or points_obj2.shape[0] < pcd_sample_num:
-            # 与某个物体相交的光线数量不够，则将原有光线在投影平面上进行扩充
-            if points_obj1.shape[0] < pcd_sample_num:
-                self.logger.info("intersect points with obj1 not enough, cur: {}, target: {}"
-                                 .format(points_obj1.shape[0], pcd_sample_num))
-                points_obj1 = self.expand_points_in_rectangle(expand_points_num,
-                                                              self.pixel_width,
-                                                              self.pixel_height,
-                                                              self.scan_plane,
-                                                              points_obj1)
-                rays_obj1 = self.get_rays_from_projection_points(eye, points_obj1)
-            if points_obj2.shape[0] < pcd_sample_num:
-                self.logger.info("intersect points with obj2 not enough, cur: {}, target: {}"
-                                 .format(points_obj2.shape[0], pcd_sample_num))
-                points_obj2 = self.expand_points_in_rectangle(expand_points_num,
-                                                              self.pixel_width,
-                                                              self.pixel_height,
-                                                              self.scan_plane,
-                                                              points_obj2)
-                rays_obj2 = self.get_rays_from_projection_points(eye, points_obj2)
-                # self.visualize_rays(eye, rays_obj2)
-            # 每轮都将来自obj1和来自obj2的射线拼接在一起，重新进行射线求交
-            rays = np.concatenate((rays_obj1.numpy(), rays_obj2.numpy()), axis=0)
-            rays = o3d.core.Tensor(np.array(rays), dtype=o3d.core.Dtype.Float32)
-            cast_result = self.get_ray_cast_result(self.scene, rays)
-            points_obj1, points_obj2 = self.get_points_intersect(np.concatenate((points_obj1, points_obj2), axis=0),
-                                                                 cast_result)
-            rays_obj1 = self.get_rays_from_projection_points(eye, points_obj1)
-            rays_obj2 = self.get_rays_from_projection_points(eye, points_obj2)
-
-        # 多采集一些点，然后用fps保证均匀性
-        pcd1, pcd2 = self.get_cur_view_pcd(cast_result)
-        pcd1 = pcd1.farthest_point_down_sample(pcd_point_num)
-        pcd2 = pcd2.farthest_point_down_sample(pcd_point_num)
-        pcd1.paint_uniform_color((0, 0, 1))
-        pcd2.paint_uniform_color((0, 1, 0))
-
-        return pcd1, pcd2, True
+        active_views = []
+        for view in views:
+            self.logger.info("theta: {}, phi: {}, intersect with obj1: {}, intersect with obj2: {}"
+                             .format(view["theta"], view["phi"], view["points_obj1"].shape[0],
+                                     view["points_obj2"].shape[0]))
+            if self.is_view_legal(view["points_obj1"], view["points_obj2"]):
+                active_views.append(view)
+            else:
+                self.logger.warning("not enough init points, theta: {}, phi: {}".format(view["theta"], view["phi"]))
+                view["success"] = False
+
+        # 迭代地在相交的局部增大分辨率，直到各视角都有足够的射线与两模型相交，已达到数量的物体不再扩充
+        while True:
+            pending_views = [view for view in active_views if view["points_obj1"].shape[0] < pcd_sample_num or
+                             view["points_obj2"].shape[0] < pcd_sample_num]
+            if len(pending_views) == 0:
+                break
+            for view in pending_views:
+                self.expand_view(view, pcd_sample_num)
+            self.cast_views(pending_views)
+
+        results = []
+        for view in views:
+            self.logger.info("theta: {}, phi: {}, rays cast: {}, intersect with obj1: {}, intersect with obj2: {}"
+                             .format(view["theta"], view["phi"], view["rays_cast"], view["points_obj1"].shape[0],
+                                     view["points_obj2"].shape[0]))
+            if not view["success"]:
+                results.append((None, None, False))
+                continue
+            cast_result = {key: np.concatenate([hits[key] for hits in view["hits"]], axis=0)
+                           for key in view["hits"][0]}
+            # 多采集一些点，然后用fps保证均匀性
+            pcd1, pcd2 = self.get_cur_view_pcd(cast_result)
+            pcd1 = pcd1.farthest_point_down_sample(pcd_point_num)
+            pcd2 = pcd2.farthest_point_down_sample(pcd_point_num)
+            pcd1.paint_uniform_color((0, 0, 1))
+            pcd2.paint_uniform_color((0, 1, 0))
+            results.append((pcd1, pcd2, True))
+        return results
+
+    def get_current_view_scan_pcd(self, theta, phi):
+        """
+        获取某个角度观察的残缺点云数据
+        Args:
+            theta: 球坐标天顶角
+            phi: 球坐标方位角
+        Returns:
+            残缺点云1，残缺点云2，是否采集成功
+        """
+        return self.scan_views([(theta, phi)])[0]
 
     def generate_scan_pcd(self):
         pcd1_partial_list = []
         pcd2_partial_list = []
         scan_view_list = []
         # 球坐标，theta为天顶角，phi为方位角
-        index = 0
-        # 俯视
-        self.logger.info("\n")
-        self.logger.info("begin generate theta: {}, phi: {}".format(0, 0))
-        pcd1_scan, pcd2_scan, success = self.get_current_view_scan_pcd(0, 0)
-        if success:
-            pcd1_partial_list.append(pcd1_scan)
-            pcd2_partial_list.append(pcd2_scan)
-            scan_view_list.append(index)
-            index += 1
-        # 仰视
-        self.logger.info("\n")
-        self.logger.info("begin generate theta: {}, phi: {}".format(180, 0))
-        pcd1_scan, pcd2_scan, success = self.get_current_view_scan_pcd(180, 0)
-        if success:
-            pcd1_partial_list.append(pcd1_scan)
-            pcd2_partial_list.append(pcd2_scan)
-            scan_view_list.append(index)
-            index += 1
-        for theta in [45, 90, 135]:
-            for phi in range(0, 360, 45):
+        view_list = self.get_view_list()
+        if self.specs["scan_options"].get("multi_view"):
+            results = self.scan_views(view_list)
+        else:
+            results = []
+            for theta, phi in view_list:
                 self.logger.info("\n")
                 self.logger.info("begin generate theta: {}, phi: {}".format(theta, phi))
-                pcd1_scan, pcd2_scan, success = self.get_current_view_scan_pcd(theta, phi)
-                if success:
-                    pcd1_partial_list.append(pcd1_scan)
-                    pcd2_partial_list.append(pcd2_scan)
-                    scan_view_list.append(index)
-                    index += 1
+                results.append(self.get_current_view_scan_pcd(theta, phi))
+
+        index = 0
+        for pcd1_scan, pcd2_scan, success in results:
+            if success:
+                pcd1_partial_list.append(pcd1_scan)
+                pcd2_partial_list.append(pcd2_scan)
+                scan_view_list.append(index)
+                index += 1
 
         return pcd1_partial_list, pcd2_partial_list, scan_view_list
 
@@ -0,0 +1,131 @@
+"""
+将一个或多个split中的残缺点云(pcdScan)与udf数据(udfData)打包为少量未压缩的分片文件，并生成偏移索引，
+训练时通过内存映射直接读取，避免每个样本都打开三个文件并解压npz
+"""
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+from dataset import workspace as ws
+from utils import path_utils, geometry_utils
+
+
+class ShardWriter:
+    """
+    将若干(n, dim)的float32数组顺序写入分片，单个分片超过shard_max_bytes后另起一个分片
+    """
+
+    def __init__(self, save_dir: str, prefix: str, dim: int, shard_max_bytes: int, logger=None):
+        self.save_dir = save_dir
+        self.prefix = prefix
+        self.dim = dim
+        self.shard_max_bytes = shard_max_bytes
+        self.logger = logger
+        self.shard_filenames = []
+        self.buffer = []
+        self.buffer_rows = 0
+
+    def _cur_shard_idx(self):
+        return len(self.shard_filenames)
+
+    def append(self, data: np.ndarray):
+        """
+        写入一段数据
+        Args:
+            data: np.ndarray, (n, dim)
+        Returns:
+            [分片序号, 分片内的行偏移, 行数]
+        """
+        data = np.asarray(data, dtype=np.float32).reshape(-1, self.dim)
+        if self.buffer_rows > 0 and (self.buffer_rows + data.shape[0]) * self.dim * 4 > self.shard_max_bytes:
+            self.flush()
+        entry = [self._cur_shard_idx(), self.buffer_rows, data.shape[0]]
+        self.buffer.append(data)
+        self.buffer_rows += data.shape[0]
+        return entry
+
+    def flush(self):
+        if self.buffer_rows == 0:
+            return
+        shard_filename = "{}_{}.npy".format(self.prefix, self._cur_shard_idx())
+        np.save(os.path.join(self.save_dir, shard_filename), np.concatenate(self.buffer, axis=0))
+        if self.logger is not None:
+            self.logger.info("write shard {}, rows: {}".format(shard_filename, self.buffer_rows))
+        self.shard_filenames.append(shard_filename)
+        self.buffer = []
+        self.buffer_rows = 0
+
+
+def read_udf(udf_path: str):
+    return np.asarray(np.load(udf_path)["data"], dtype=np.float32)
+
+
+def pack_splits(specs: dict, logger):
+    data_source = specs.get("path_options").get("data_source")
+    split_files = specs.get("path_options").get("split_files")
+    shard_max_bytes = int(specs.get("pack_options").get("shard_max_bytes"))
+
+    save_dir = os.path.join(data_source, ws.packed_samples_subdir)
+    path_utils.generate_path(save_dir)
+
+    pcd_writer = ShardWriter(save_dir, "pcd", 3, shard_max_bytes, logger)
+    udf_writer = ShardWriter(save_dir, "udf", 5, shard_max_bytes, logger)
+
+    # 同一场景的所有视角共享一份udf数据，只写入一次
+    scenes = dict()
+    instances = dict()
+    for split_file in split_files:
+        with open(split_file, "r") as f:
+            split = json.load(f)
+        for dataset in split:
+            for class_name in split[dataset]:
+                for instance_name in split[dataset][class_name]:
+                    instance_key = "/".join([dataset, class_name, instance_name])
+                    if instance_key in instances:
+                        continue
+                    scene_name = re.match(ws.scene_patten, instance_name).group()
+                    scene_key = "/".join([dataset, class_name, scene_name])
+
+                    udf_path = os.path.join(data_source, ws.udf_samples_subdir, dataset, class_name, scene_name + ".npz")
+                    pcd1_path = os.path.join(data_source, ws.pcd_samples_subdir, dataset, class_name, instance_name + "_0.ply")
+                    pcd2_path = os.path.join(data_source, ws.pcd_samples_subdir, dataset, class_name, instance_name + "_1.ply")
+                    if not (os.path.isfile(udf_path) and os.path.isfile(pcd1_path) and os.path.isfile(pcd2_path)):
+                        logger.warning("missing data of instance '{}', skipped".format(instance_key))
+                        continue
+
+                    if scene_key not in scenes:
+                        scenes[scene_key] = udf_writer.append(read_udf(udf_path))
+                    instances[instance_key] = {
+                        "pcd1": pcd_writer.append(geometry_utils.read_ply_points(pcd1_path)),
+                        "pcd2": pcd_writer.append(geometry_utils.read_ply_points(pcd2_path)),
+                        "udf": scenes[scene_key]
+                    }
+        logger.info("split {} packed, instances in total: {}".format(split_file, len(instances)))
+
+    pcd_writer.flush()
+    udf_writer.flush()
+
+    index = {
+        "pcd_shards": pcd_writer.shard_filenames,
+        "udf_shards": udf_writer.shard_filenames,
+        "instances": instances
+    }
+    with open(os.path.join(save_dir, ws.packed_index_filename), "w") as f:
+        json.dump(index, f)
+    logger.info("packed {} instances, {} scenes into {}".format(len(instances), len(scenes), save_dir))
+
+
+if __name__ == '__main__':
+    config_filepath = 'configs/pack_udf_samples.json'
+    specs = path_utils.read_config(config_filepath)
+
+    logger = logging.getLogger("pack_udf_samples")
+    logger.setLevel("INFO")
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(level=logging.INFO)
+    logger.addHandler(stream_handler)
+
+    pack_splits(specs, logger)
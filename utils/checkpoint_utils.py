@@ -0,0 +1,179 @@
+"""
+训练checkpoint的保存工具：在训练线程中将state dict复制到CPU，由后台线程写入磁盘，写完后原子地重命名，
+并按保留策略删除旧的checkpoint。保存目录下的checkpoints.json记录最新与最优的epoch，继续训练时可以直接使用"latest"或"best"
+"""
+import json
+import os
+import queue
+import threading
+
+import torch
+
+CHECKPOINT_INDEX_FILENAME = "checkpoints.json"
+
+
+def get_checkpoint_filename(save_dir: str, epoch: int):
+    return os.path.join(save_dir, "epoch_{}.pth".format(epoch))
+
+
+def snapshot_to_cpu(obj):
+    """递归地将state dict中的tensor复制到CPU，之后训练继续更新参数也不影响快照"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, snapshot_to_cpu(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_cpu(value) for value in obj)
+    return obj
+
+
+def atomic_save(obj, path: str):
+    """先写入临时文件再重命名，写入过程中中断不会留下不完整的checkpoint"""
+    tmp_path = path + ".tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def atomic_dump_json(obj, path: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint_index(save_dir: str):
+    """
+    Returns:
+        {"latest": 最新的epoch, "best": 测试损失最小的epoch, "best_loss": 最小的测试损失, "epochs": 磁盘上保留的epoch}，
+        不存在时返回None
+    """
+    index_path = os.path.join(save_dir, CHECKPOINT_INDEX_FILENAME)
+    if not os.path.isfile(index_path):
+        return None
+    with open(index_path, "r") as f:
+        return json.load(f)
+
+
+def resolve_checkpoint_epoch(save_dir: str, epoch):
+    """
+    Args:
+        epoch: epoch序号，或"latest"、"best"
+    Returns:
+        int，对应的epoch序号
+    """
+    if epoch not in ("latest", "best"):
+        return int(epoch)
+    index = read_checkpoint_index(save_dir)
+    if index is not None and index.get(epoch) is not None:
+        return index[epoch]
+    if epoch == "latest" and os.path.isdir(save_dir):
+        # 没有索引文件（如旧版本保存的checkpoint）时取目录下序号最大的checkpoint
+        epochs = [int(filename[len("epoch_"): -len(".pth")]) for filename in os.listdir(save_dir)
+                  if filename.startswith("epoch_") and filename.endswith(".pth")]
+        if len(epochs) > 0:
+            return max(epochs)
+    raise FileNotFoundError("can not find the {} checkpoint in {}".format(epoch, save_dir))
+
+
+class CheckpointWriter:
+    """
+    保存策略：保留最近keep_last（至少为1）个epoch、测试损失最小的epoch（keep_best）以及序号为every_n_epochs整数倍的epoch，
+    其余的checkpoint在新的checkpoint写完后删除。keep_last为None时保留全部checkpoint
+    async_write为True时由一个后台线程依次写入，save只复制state dict，等待中的checkpoint超过max_pending个时阻塞
+    """
+
+    def __init__(self, save_dir: str, keep_last: int = None, keep_best: bool = True, every_n_epochs: int = None,
+                 async_write: bool = True, max_pending: int = 1, resume: bool = False):
+        # keep_last为0时epochs[-0:]会保留全部checkpoint，与"不保留"的含义相反
+        if keep_last is not None and keep_last < 1:
+            raise ValueError("KeepLast must be at least 1 or null, got {}".format(keep_last))
+        if every_n_epochs is not None and every_n_epochs < 1:
+            raise ValueError("EveryNEpochs must be at least 1 or null, got {}".format(every_n_epochs))
+        self.save_dir = save_dir
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.every_n_epochs = every_n_epochs
+        if not os.path.isdir(save_dir):
+            os.makedirs(save_dir)
+
+        # 继续训练时沿用之前的索引，重新训练时旧的索引作废
+        index = read_checkpoint_index(save_dir) if resume else None
+        self.index = index if index is not None else {"latest": None, "best": None, "best_loss": None, "epochs": []}
+
+        self.error = None
+        self.queue = None
+        self.thread = None
+        if async_write:
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.thread = threading.Thread(target=self._run, name="checkpoint_writer", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    self._write(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("failed to write checkpoint") from error
+
+    def _is_retained(self, epoch: int):
+        if self.keep_last is None:
+            return True
+        if epoch in self.index["epochs"][-self.keep_last:]:
+            return True
+        if self.keep_best and epoch == self.index["best"]:
+            return True
+        return self.every_n_epochs is not None and epoch % self.every_n_epochs == 0
+
+    def _write(self, checkpoint: dict, epoch: int, test_loss):
+        atomic_save(checkpoint, get_checkpoint_filename(self.save_dir, epoch))
+
+        self.index["epochs"] = [x for x in self.index["epochs"] if x != epoch] + [epoch]
+        self.index["latest"] = epoch
+        if test_loss is not None and (self.index["best_loss"] is None or test_loss < self.index["best_loss"]):
+            self.index["best"] = epoch
+            self.index["best_loss"] = test_loss
+        removed_epochs = [x for x in self.index["epochs"] if not self._is_retained(x)]
+        self.index["epochs"] = [x for x in self.index["epochs"] if x not in removed_epochs]
+        # 先更新索引再删除文件，索引中的epoch总是存在
+        atomic_dump_json(self.index, os.path.join(self.save_dir, CHECKPOINT_INDEX_FILENAME))
+        for removed_epoch in removed_epochs:
+            filename = get_checkpoint_filename(self.save_dir, removed_epoch)
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    def save(self, checkpoint: dict, epoch: int, test_loss: float = None):
+        """
+        Args:
+            checkpoint: 与save_model相同格式的dict，其中的tensor可以在GPU上
+            epoch: 当前epoch
+            test_loss: 当前epoch的测试损失，未测试时为None，用于保留最优的checkpoint
+        """
+        self._check_error()
+        checkpoint = snapshot_to_cpu(checkpoint)
+        if self.queue is None:
+            self._write(checkpoint, epoch, test_loss)
+        else:
+            self.queue.put((checkpoint, epoch, test_loss))
+
+    def wait(self):
+        """等待所有checkpoint写完"""
+        if self.queue is not None:
+            self.queue.join()
+        self._check_error()
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._check_error()
@@ -0,0 +1,10 @@
+"""
+设备相关的工具函数
+"""
+
+
+def get_map_location(device):
+    """Device为"cpu"时将checkpoint加载到CPU，否则加载到对应序号的GPU"""
+    if isinstance(device, str) and not device.isdigit():
+        return device
+    return "cuda:{}".format(device)
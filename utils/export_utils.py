@@ -0,0 +1,250 @@
+"""
+导出IBSNet推理模型的工具，导出的TorchScript模型包含encode与decode两个方法，加载时不依赖模型的Python源码
+ONNX模型分为编码器与解码器两个文件，由onnxruntime在CPU上运行
+"""
+import json
+import os
+import time
+
+import torch
+from torch import nn
+
+from models.models_utils import decode_in_chunks
+
+MODELS = {
+    # 名称: 模型所在模块
+    "cross_attention": "models.models_cross_attention",
+    "transformer": "models.models_transformer",
+    "grasping_field": "models.models_grasping_field",
+    "IMNet": "models.models_IMNet",
+}
+# 只编码一个点云、只输出一个udf的模型
+SINGLE_OBJECT_MODELS = ("IMNet",)
+
+METADATA_FILENAME = "metadata.json"
+ONNX_ENCODER_FILENAME = "encoder.onnx"
+ONNX_DECODER_FILENAME = "decoder.onnx"
+ONNX_OPSET_VERSION = 17
+
+
+def get_model_class(model_name: str):
+    module = __import__(MODELS[model_name], fromlist=["IBSNet"])
+    return module.IBSNet
+
+
+def get_pcd_num(model_name: str):
+    """encode的输入点云个数"""
+    return 1 if model_name in SINGLE_OBJECT_MODELS else 2
+
+
+class IBSNetInference(nn.Module):
+    """将encode与不分块的decode暴露为可以被torch.jit.trace_module分别记录的方法"""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def encode(self, *pcds):
+        return self.model.encode(*pcds)
+
+    def decode(self, latent, query_points):
+        return self.model._decode(latent, query_points)
+
+    def forward(self, *inputs):
+        return self.decode(self.encode(*inputs[:-1]), inputs[-1])
+
+
+def trace_model(model: nn.Module, pcd_points_num: int, query_points_num: int, device, pcd_num: int = 2):
+    """
+    用随机输入记录encode与decode的计算图，点云的点数在导出后固定为pcd_points_num，查询点数可变
+    Args:
+        model: 加载好参数的IBSNet
+        pcd_points_num: 点云的点数
+        query_points_num: 记录decode时使用的查询点数
+        device: 记录时使用的设备
+        pcd_num: encode的输入点云个数
+    Returns:
+        torch.jit.ScriptModule
+    """
+    inference_model = IBSNetInference(model).eval().to(device)
+    pcds = tuple(torch.rand(1, pcd_points_num, 3, device=device) - 0.5 for _ in range(pcd_num))
+    query_points = torch.rand(query_points_num, 3, device=device) - 0.5
+    with torch.no_grad():
+        latent = inference_model.encode(*pcds)
+        return torch.jit.trace_module(inference_model, {"encode": pcds, "decode": (latent, query_points)},
+                                      check_trace=False)
+
+
+def save_torchscript_model(scripted_model, path: str, metadata: dict):
+    torch.jit.save(scripted_model, path, _extra_files={METADATA_FILENAME: json.dumps(metadata)})
+
+
+def load_torchscript_model(path: str, device):
+    """
+    Returns:
+        model: TorchScriptIBSNet
+        metadata: dict，导出时记录的信息
+    """
+    extra_files = {METADATA_FILENAME: ""}
+    scripted_model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    metadata = json.loads(extra_files[METADATA_FILENAME]) if extra_files[METADATA_FILENAME] else dict()
+    return TorchScriptIBSNet(scripted_model), metadata
+
+
+class TorchScriptIBSNet:
+    """导出的TorchScript模型，接口与IBSNet的encode、decode相同"""
+
+    def __init__(self, scripted_model):
+        self.scripted_model = scripted_model
+
+    def eval(self):
+        self.scripted_model.eval()
+        return self
+
+    def encode(self, *pcds):
+        return self.scripted_model.encode(*pcds)
+
+    def decode(self, latent, query_points, chunk_size=None):
+        return decode_in_chunks(self.scripted_model.decode, latent, query_points, chunk_size)
+
+
+class OnnxEncoder(nn.Module):
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, *pcds):
+        return self.model.encode(*pcds)
+
+
+class OnnxDecoder(nn.Module):
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, latent, query_points):
+        return self.model._decode(latent, query_points)
+
+
+def get_onnx_names(model_name: str):
+    """
+    Returns:
+        pcd_names: 编码器的输入名
+        udf_names: 解码器的输出名
+    """
+    if get_pcd_num(model_name) == 1:
+        return ["pcd"], ["udf"]
+    return ["pcd1", "pcd2"], ["udf1", "udf2"]
+
+
+def export_onnx(model: nn.Module, model_name: str, export_dir: str, pcd_points_num: int, query_points_num: int,
+                metadata: dict):
+    """
+    将encode与不分块的decode分别导出为export_dir下的encoder.onnx与decoder.onnx，并写入metadata.json
+    与trace_model相同，点云的点数在导出后固定为pcd_points_num，解码器的查询点数可变
+    Args:
+        model: 加载好参数的模型，需要在CPU上
+        model_name: MODELS中的名称
+        export_dir: 导出目录
+        pcd_points_num: 点云的点数
+        query_points_num: 导出decode时使用的查询点数
+        metadata: 额外记录的信息
+    """
+    pcd_names, udf_names = get_onnx_names(model_name)
+    # torch.onnx.export结束时会按导出前包装模块的状态恢复train/eval，包装模块本身也必须是eval
+    encoder = OnnxEncoder(model).eval()
+    decoder = OnnxDecoder(model).eval()
+    pcds = tuple(torch.rand(1, pcd_points_num, 3) - 0.5 for _ in pcd_names)
+    query_points = torch.rand(query_points_num, 3) - 0.5
+    dynamic_axes = {name: {0: "query_points_num"} for name in ["query_points"] + udf_names}
+    with torch.no_grad():
+        latent = encoder(*pcds)
+        torch.onnx.export(encoder, pcds, os.path.join(export_dir, ONNX_ENCODER_FILENAME), input_names=pcd_names,
+                          output_names=["latent"], opset_version=ONNX_OPSET_VERSION, dynamo=False)
+        torch.onnx.export(decoder, (latent, query_points), os.path.join(export_dir, ONNX_DECODER_FILENAME),
+                          input_names=["latent", "query_points"], output_names=udf_names, dynamic_axes=dynamic_axes,
+                          opset_version=ONNX_OPSET_VERSION, dynamo=False)
+    with open(os.path.join(export_dir, METADATA_FILENAME), "w") as f:
+        json.dump(dict(metadata, model=model_name), f, indent=4)
+
+
+def load_onnx_model(export_dir: str, num_threads: int = None):
+    """
+    Args:
+        export_dir: export_onnx的导出目录
+        num_threads: onnxruntime的intra-op线程数，为None时由onnxruntime决定
+    Returns:
+        model: OnnxIBSNet
+        metadata: dict，导出时记录的信息
+    """
+    import onnxruntime
+
+    session_options = onnxruntime.SessionOptions()
+    if num_threads is not None:
+        session_options.intra_op_num_threads = num_threads
+
+    def get_session(filename):
+        return onnxruntime.InferenceSession(os.path.join(export_dir, filename), session_options,
+                                            providers=["CPUExecutionProvider"])
+
+    with open(os.path.join(export_dir, METADATA_FILENAME), "r") as f:
+        metadata = json.load(f)
+    return OnnxIBSNet(get_session(ONNX_ENCODER_FILENAME), get_session(ONNX_DECODER_FILENAME)), metadata
+
+
+class OnnxIBSNet:
+    """
+    导出的ONNX模型，接口与IBSNet的encode、decode相同
+    onnxruntime只在CPU上运行，输入先转到CPU，输出放回输入所在的设备
+    """
+
+    def __init__(self, encoder_session, decoder_session):
+        self.encoder_session = encoder_session
+        self.decoder_session = decoder_session
+        self.pcd_names = [x.name for x in encoder_session.get_inputs()]
+
+    def eval(self):
+        return self
+
+    @staticmethod
+    def _run(session, inputs: dict, device):
+        outputs = session.run(None, {name: x.detach().cpu().numpy() for name, x in inputs.items()})
+        return [torch.from_numpy(output).to(device) for output in outputs]
+
+    def encode(self, *pcds):
+        return self._run(self.encoder_session, dict(zip(self.pcd_names, pcds)), pcds[0].device)[0]
+
+    def _decode(self, latent, query_points):
+        outputs = self._run(self.decoder_session, {"latent": latent, "query_points": query_points},
+                            query_points.device)
+        return tuple(outputs) if len(outputs) > 1 else outputs[0]
+
+    def decode(self, latent, query_points, chunk_size=None):
+        return decode_in_chunks(self._decode, latent, query_points, chunk_size)
+
+
+def measure_latency(fn, inputs, repeat: int, device):
+    """
+    Returns:
+        warmup_seconds: 第一次调用的耗时
+        steady_seconds: 之后调用的平均耗时，TorchScript在前两次调用时进行优化，因此先额外调用一次
+    """
+    def synchronize():
+        if torch.device(device).type == "cuda":
+            torch.cuda.synchronize(device)
+
+    with torch.no_grad():
+        synchronize()
+        time_begin = time.perf_counter()
+        fn(*inputs)
+        synchronize()
+        warmup_seconds = time.perf_counter() - time_begin
+
+        fn(*inputs)
+        synchronize()
+        time_begin = time.perf_counter()
+        for _ in range(repeat):
+            fn(*inputs)
+        synchronize()
+        steady_seconds = (time.perf_counter() - time_begin) / repeat
+    return warmup_seconds, steady_seconds
@@ -27,6 +27,116 @@ def read_point_cloud(path):
     return pcd
 
 
+# ply属性类型到numpy类型的映射
+_PLY_DTYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8"
+}
+
+
+def _read_ply_header(file):
+    """
+    解析ply文件头，要求vertex为第一个element且不包含list属性
+    Returns:
+        format, 顶点数, 顶点属性列表[(name, type)]
+    """
+    if file.readline().strip() != b"ply":
+        raise ValueError("not a ply file")
+    ply_format = None
+    vertex_num = None
+    properties = []
+    cur_element = None
+    while True:
+        line = file.readline()
+        if not line:
+            raise ValueError("unexpected end of ply header")
+        tokens = line.decode("ascii").split()
+        if len(tokens) == 0 or tokens[0] in ("comment", "obj_info"):
+            continue
+        if tokens[0] == "end_header":
+            break
+        if tokens[0] == "format":
+            ply_format = tokens[1]
+        elif tokens[0] == "element":
+            cur_element = tokens[1]
+            if cur_element == "vertex":
+                if vertex_num is not None or properties:
+                    raise ValueError("vertex should be the first element of ply")
+                vertex_num = int(tokens[2])
+            elif vertex_num is None:
+                raise ValueError("vertex should be the first element of ply")
+        elif tokens[0] == "property" and cur_element == "vertex":
+            if tokens[1] == "list":
+                raise ValueError("list property of vertex is not supported")
+            properties.append((tokens[2], tokens[1]))
+    if vertex_num is None:
+        raise ValueError("no vertex element in ply")
+    return ply_format, vertex_num, properties
+
+
+def read_ply_points(path):
+    """
+    不经过open3d，直接将ascii或二进制ply中顶点的xyz解析为float32数组
+    Args:
+        path: ply文件的路径
+    Returns:
+        np.ndarray, (n, 3), float32
+    """
+    with open(path, "rb") as file:
+        ply_format, vertex_num, properties = _read_ply_header(file)
+        names = [name for name, _ in properties]
+        points = np.empty((vertex_num, 3), dtype=np.float32)
+        if ply_format == "ascii":
+            # vertex为第一个element，其余element的数据位于顶点之后，只取前vertex_num行
+            tokens = file.read().split()[:vertex_num * len(properties)]
+            values = np.array(tokens, dtype=np.float64).reshape(vertex_num, len(properties))
+            for i, axis in enumerate(("x", "y", "z")):
+                points[:, i] = values[:, names.index(axis)]
+        elif ply_format in ("binary_little_endian", "binary_big_endian"):
+            byte_order = "<" if ply_format == "binary_little_endian" else ">"
+            dtype = np.dtype([(name, byte_order + _PLY_DTYPES[type_name]) for name, type_name in properties])
+            vertices = np.fromfile(file, dtype=dtype, count=vertex_num)
+            if vertices.shape[0] != vertex_num:
+                raise ValueError("unexpected end of ply data")
+            for i, axis in enumerate(("x", "y", "z")):
+                points[:, i] = vertices[axis]
+        else:
+            raise ValueError("unsupported ply format: {}".format(ply_format))
+    return points
+
+
+def read_ply_points_tensor(path):
+    """
+    读取ply中顶点的xyz，返回与numpy共享内存的torch.Tensor
+    Args:
+        path: ply文件的路径
+    Returns:
+        torch.Tensor, (n, 3), float32
+    """
+    return torch.from_numpy(read_ply_points(path))
+
+
+def write_ply_points(path, points, binary=True):
+    """
+    将点云的xyz以float32写入ply
+    Args:
+        path: ply文件的路径
+        points: np.ndarray, (n, 3)
+        binary: 是否以binary_little_endian格式写入，否则为ascii
+    """
+    points = np.ascontiguousarray(points, dtype="<f4").reshape(-1, 3)
+    header = "ply\nformat {} 1.0\nelement vertex {}\nproperty float x\nproperty float y\nproperty float z\nend_header\n" \
+        .format("binary_little_endian" if binary else "ascii", points.shape[0])
+    with open(path, "wb") as file:
+        file.write(header.encode("ascii"))
+        if binary:
+            file.write(points.tobytes())
+        else:
+            np.savetxt(file, points, fmt="%.8g")
+
+
 def read_mesh(path):
     """
     读取Mesh
@@ -0,0 +1,68 @@
+"""
+解码器的推理量化工具，导出见postprocess/export_quantized_decoder.py
+"""
+import torch
+from torch import nn
+
+QUANTIZATION_TYPES = ("int8", "bf16")
+
+
+def remove_weight_norms(module: nn.Module):
+    """去掉module中所有weight norm，将其折算回普通的权重，量化前需要先去掉"""
+    for submodule in module.modules():
+        if hasattr(submodule, "weight_g") and hasattr(submodule, "weight_v"):
+            nn.utils.remove_weight_norm(submodule)
+    return module
+
+
+def _cast_outputs(outputs, dtype):
+    if isinstance(outputs, tuple):
+        return tuple(output.to(dtype) for output in outputs)
+    return outputs.to(dtype)
+
+
+class BF16Decoder(nn.Module):
+    """将解码器的参数转为bfloat16，输入转为bfloat16计算，输出转回float32，对外接口与原解码器相同"""
+
+    def __init__(self, decoder: nn.Module):
+        super().__init__()
+        self.decoder = decoder.to(torch.bfloat16)
+
+    def forward(self, *inputs):
+        return _cast_outputs(self.decoder(*[x.to(torch.bfloat16) for x in inputs]), torch.float32)
+
+    def forward_factorized(self, latent, query_points):
+        return _cast_outputs(self.decoder.forward_factorized(latent.to(torch.bfloat16), query_points.to(torch.bfloat16)),
+                             torch.float32)
+
+
+def quantize_decoder(model: nn.Module, quantization: str):
+    """
+    将model.decoder原地替换为量化后的版本，编码器不变
+    int8为对全连接层的动态量化，只能在CPU上运行，量化后的全连接层没有浮点权重，因此关闭分解解码
+    Args:
+        model: 带有decoder属性的IBSNet
+        quantization: "int8"或"bf16"
+    Returns:
+        model
+    """
+    if quantization not in QUANTIZATION_TYPES:
+        raise ValueError("unsupported quantization: {}, expected one of {}".format(quantization, QUANTIZATION_TYPES))
+
+    decoder = remove_weight_norms(model.decoder)
+    if quantization == "int8":
+        model.decoder = torch.ao.quantization.quantize_dynamic(decoder.cpu(), {nn.Linear}, dtype=torch.qint8)
+        if getattr(model, "factorized_decoder", False):
+            model.factorized_decoder = False
+    else:
+        model.decoder = BF16Decoder(decoder)
+    return model
+
+
+def get_quantized_checkpoint(model: nn.Module, quantization: str, epoch):
+    """量化模型的checkpoint，与训练保存的checkpoint格式相同，额外记录量化类型"""
+    return {
+        "epoch": epoch,
+        "quantization": quantization,
+        "model": model.state_dict()
+    }
@@ -1,126 +1,140 @@
 """
 随机数工具
+所有采样均以numpy批量完成，不对单个点做python循环；rng可传入np.random.Generator以复现结果，
+为None时每次调用新建一个由系统熵初始化的Generator，保证进程池中各进程的随机序列互不相同
 """
-import random
-
 import numpy as np
-import math
 
 
-def randNormalFloat(l: float, h: float, num: int):
+def get_rng(rng=None):
+    """rng可以是None、整数种子或np.random.Generator"""
+    if isinstance(rng, np.random.Generator):
+        return rng
+    return np.random.default_rng(rng)
+
+
+def randNormalFloat(l: float, h: float, num: int, rng=None):
     """生成num个给定范围内的浮点数，符合正态分布"""
     if l > h:
         return None
     else:
-        return np.random.normal((h + l) / 2, (h - l) / 6, num)
+        return get_rng(rng).normal((h + l) / 2, (h - l) / 6, num)
 
 
-def randUniFormFloat(l: float, h: float, num: int):
+def randUniFormFloat(l: float, h: float, num: int, rng=None):
     """生成num个给定范围内的浮点数，符合均匀分布"""
     if l > h:
         return None
     else:
-        return np.array([np.random.random() * (h - l) + l for i in range(num)])
-
-
-def randPointsUniform(num: int, radius: float):
-    u = np.random.uniform(size=(num, 1))
-    v = np.random.uniform(size=(num, 1))
-    theta = u * 2.0 * math.pi
-    phi = np.arccos(2.0 * v - 1.0)
-    r = np.cbrt(np.random.uniform(size=(num, 1))) * radius
-    sinTheta = np.sin(theta)
-    cosTheta = np.cos(theta)
-    sinPhi = np.sin(phi)
-    cosPhi = np.cos(phi)
-    x = r * sinPhi * cosTheta
-    y = r * sinPhi * sinTheta
-    z = r * cosPhi
-    return np.concatenate([x, y, z], axis=1)
-
-
-def random_offset(point, d: float):
-    """将point向随机方向偏移最大为d的随机距离"""
-    point = np.array(point)
-    # 生成随机方向向量
-    direction = np.random.randn(3)
-    direction /= np.linalg.norm(direction)  # 归一化为单位向量
+        return get_rng(rng).uniform(l, h, num)
+
+
+def sample_in_sphere(num: int, center=(0, 0, 0), radius=0.5, rng=None):
+    """
+    在球心为center，半径为radius的球内均匀采集num个点
+    Returns:
+        np.ndarray, (num, 3), float32
+    """
+    rng = get_rng(rng)
+    num = int(num)
+    # 各向同性的高斯向量归一化后为球面上的均匀方向，半径按体积均匀取r = R * u^(1/3)
+    direction = rng.standard_normal((num, 3))
+    direction /= np.maximum(np.linalg.norm(direction, axis=1, keepdims=True), 1e-12)
+    r = radius * np.cbrt(rng.random((num, 1)))
+    points = np.asarray(center, dtype=np.float64).reshape(1, 3) + r * direction
+    return points.astype(np.float32)
 
-    # 生成随机长度
-    length = np.random.uniform(0, d)
 
-    # 计算偏移点的坐标
-    offset = point + direction * length
+def sample_in_aabb(min_bound, max_bound, num: int, rng=None):
+    """
+    在[min_bound, max_bound]内均匀采集num个点
+    Returns:
+        np.ndarray, (num, 3), float32
+    """
+    rng = get_rng(rng)
+    min_bound = np.asarray(min_bound, dtype=np.float64).reshape(1, 3)
+    max_bound = np.asarray(max_bound, dtype=np.float64).reshape(1, 3)
+    points = min_bound + rng.random((int(num), 3)) * (max_bound - min_bound)
+    return points.astype(np.float32)
 
-    return offset
 
+def sample_in_aabb_sphere(min_bound, max_bound, num: int, center=(0, 0, 0), radius=0.5, rng=None):
+    """
+    在aabb与球的交集内均匀采集num个点，按批拒绝采样，根据已观测到的接受率估计每批的数量
+    Returns:
+        np.ndarray, (num, 3), float32
+    """
+    rng = get_rng(rng)
+    num = int(num)
+    center = np.asarray(center, dtype=np.float64).reshape(1, 3)
+    min_bound = np.asarray(min_bound, dtype=np.float64).reshape(1, 3)
+    max_bound = np.asarray(max_bound, dtype=np.float64).reshape(1, 3)
+    # 球心到aabb的最近距离大于半径时交集为空
+    if np.linalg.norm(np.clip(center, min_bound, max_bound) - center) > radius:
+        raise ValueError("the aabb does not intersect with the sphere")
+
+    points = np.empty((num, 3), dtype=np.float32)
+    filled = 0
+    drawn = 0
+    accepted = 0
+    while filled < num:
+        accept_rate = max(accepted / drawn, 0.01) if drawn > 0 else 0.5
+        batch_num = max(int((num - filled) / accept_rate * 1.1), 1024)
+        candidates = sample_in_aabb(min_bound, max_bound, batch_num, rng)
+        candidates = candidates[np.linalg.norm(candidates - center, axis=1) <= radius]
+        drawn += batch_num
+        accepted += candidates.shape[0]
+
+        take = min(candidates.shape[0], num - filled)
+        points[filled: filled + take] = candidates[:take]
+        filled += take
+    return points
 
-def get_random_points_in_aabb(aabb, points_num):
-    """在aabb范围内以均匀的方式采集points_num个点"""
-    # 获取包围框边界点
-    min_bound = aabb.get_min_bound()
-    max_bound = aabb.get_max_bound()
 
-    random_points = []
-    for i in range(3):
-        random_points.append(
-            randUniFormFloat(min_bound[i], max_bound[i], int(points_num)).reshape((-1, 1)))
-    random_points = np.concatenate([random_points[0], random_points[1], random_points[2]], axis=1)
+def sample_from_seeds(seeds, rate: int, radius: float, rng=None):
+    """
+    以每个种子点为球心，在半径为radius的球内均匀采集rate个点，结果按种子点顺序排列
+    Returns:
+        np.ndarray, (len(seeds) * rate, 3), float32
+    """
+    seeds = np.asarray(seeds, dtype=np.float64).reshape(-1, 3)
+    offsets = sample_in_sphere(seeds.shape[0] * int(rate), radius=radius, rng=rng)
+    return (np.repeat(seeds, int(rate), axis=0) + offsets).astype(np.float32)
+
+
+def randPointsUniform(num: int, radius: float, rng=None):
+    return sample_in_sphere(num, radius=radius, rng=rng)
+
+
+def random_offset(point, d: float, rng=None):
+    """将point向随机方向偏移最大为d的随机距离"""
+    rng = get_rng(rng)
+    direction = rng.standard_normal(3)
+    direction /= np.linalg.norm(direction)
+    return np.asarray(point) + direction * rng.uniform(0, d)
 
-    return random_points
+
+def get_random_points_in_aabb(aabb, points_num, rng=None):
+    """在aabb范围内以均匀的方式采集points_num个点"""
+    return sample_in_aabb(aabb.get_min_bound(), aabb.get_max_bound(), points_num, rng)
 
 
-def get_random_points_in_sphere(num_points, center=[0, 0, 0], radius=0.5):
+def get_random_points_in_sphere(num_points, center=(0, 0, 0), radius=0.5, rng=None):
     """
     在球心为center，半径为radius的球内均匀采集num_points个点
     :param center: 球心
     :param radius: 半径
     :param num_points: 点数
-    :return: list(np.ndarray)
+    :return: np.ndarray, (num_points, 3), float32
     """
-    points = []
-    for _ in range(num_points):
-        u = np.random.uniform(0, 1)
-        v = np.random.uniform(0, 1)
-        w = np.random.uniform(0, 1)
-
-        r = radius * (u ** (1 / 3))
-        theta = 2 * np.pi * v
-        phi = np.arccos(2 * w - 1)
-
-        x = center[0] + r * np.sin(phi) * np.cos(theta)
-        y = center[1] + r * np.sin(phi) * np.sin(theta)
-        z = center[2] + r * np.cos(phi)
-
-        points.append([x, y, z])
-
-    return points
+    return sample_in_sphere(num_points, center, radius, rng)
 
 
-def get_random_points_from_seeds(seeds, rate, radius):
+def get_random_points_from_seeds(seeds, rate, radius, rng=None):
     """从种子点出发，在球形范围内随机散点，方向向量和距离均采用随机值"""
-    random_points = []
-    for seed in seeds:
-        cur_random_points = get_random_points_in_sphere(rate, seed, radius)
-        random_points += cur_random_points
-    return random_points
+    return sample_from_seeds(seeds, rate, radius, rng)
 
 
-def get_random_points_with_limit(aabb, points_num, radius=0.5):
+def get_random_points_with_limit(aabb, points_num, radius=0.5, rng=None):
     """在aabb范围内以均匀的方式采集points_num个点，截断超出半径为radius的球的点"""
-    # 获取包围框边界点
-    min_bound = aabb.get_min_bound()
-    max_bound = aabb.get_max_bound()
-
-    random_points = []
-    while len(random_points) < points_num:
-        cur_random_points = []
-        for i in range(3):
-            cur_random_points.append(
-                randUniFormFloat(min_bound[i], max_bound[i], int(points_num * 0.6)).reshape((-1, 1)))
-        cur_random_points = np.concatenate([cur_random_points[0], cur_random_points[1], cur_random_points[2]], axis=1)
-        cur_random_points = [point for point in cur_random_points if np.linalg.norm(point) <= radius]
-        random_points.extend(cur_random_points)
-    random_points = random.sample(random_points, int(points_num))
-
-    return random_points
+    return sample_in_aabb_sphere(aabb.get_min_bound(), aabb.get_max_bound(), points_num, radius=radius, rng=rng)
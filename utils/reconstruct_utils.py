@@ -7,7 +7,10 @@ import shutil
 
 import open3d as o3d
 
+from utils.device_utils import get_map_location
+from utils.export_utils import load_torchscript_model, load_onnx_model
 from utils.log_utils import LogFactory
+from utils.quantize_utils import quantize_decoder
 
 
 def get_network(specs, model_class, checkpoint, **kwargs):
@@ -16,11 +19,44 @@ def get_network(specs, model_class, checkpoint, **kwargs):
     device = specs.get("Device")
     logger = LogFactory.get_logger(specs.get("LogOptions"))
 
-    network = model_class(**kwargs).to(device)
+    network = model_class(**kwargs)
+    # postprocess/export_quantized_decoder.py导出的checkpoint，先按相同方式量化解码器再加载参数
+    quantization = checkpoint.get("quantization")
+    if quantization is not None:
+        logger.info("use {} quantized decoder".format(quantization))
+        # 动态量化的int8算子只有CPU实现，在GPU上会在第一次解码时才报错，因此提前报错
+        if quantization == "int8" and get_map_location(device) != "cpu":
+            raise ValueError("int8 quantized decoder can only run on cpu, set Device to \"cpu\", "
+                             "current device: {}".format(device))
+        network = quantize_decoder(network, quantization)
+    network = network.to(device)
 
     logger.info("load model parameter from epoch {}".format(checkpoint["epoch"]))
     network.load_state_dict(checkpoint["model"])
 
+    # 重建时不使用dropout，BatchNorm使用训练得到的统计量，StackedEncoders也只在eval模式下生效
+    return network.eval()
+
+
+def get_torchscript_network(specs, model_path):
+    """加载export_model.py导出的TorchScript模型，不需要模型的Python源码"""
+    device = specs.get("Device")
+    logger = LogFactory.get_logger(specs.get("LogOptions"))
+
+    network, metadata = load_torchscript_model(model_path, get_map_location(device))
+    logger.info("load torchscript model {}, metadata: {}".format(model_path, metadata))
+
+    return network.eval()
+
+
+def get_onnx_network(specs, model_path):
+    """加载export_model.py导出的ONNX模型目录，由onnxruntime在CPU上运行"""
+    logger = LogFactory.get_logger(specs.get("LogOptions"))
+    num_threads = specs.get("ModelOptions", {}).get("OnnxThreads")
+
+    network, metadata = load_onnx_model(model_path, num_threads)
+    logger.info("load onnx model {}, metadata: {}".format(model_path, metadata))
+
     return network
 
 
@@ -3,12 +3,83 @@
 """
 import json
 import os
+import time
 import torch
 
 import torch.utils.data as data_utils
 from torch.utils.tensorboard import SummaryWriter
 
+from utils.checkpoint_utils import CheckpointWriter, atomic_save, resolve_checkpoint_epoch
+from utils.device_utils import get_map_location
 from utils.log_utils import LogFactory
+from dataset.udf_cache import SceneUDFCache
+
+PRECISION_TYPES = ("fp32", "bf16", "fp16")
+
+
+def get_udf_cache(specs: dict):
+    """根据TrainOptions中的UDFCacheOptions构造各个worker共享的场景级udf缓存，未开启时返回None"""
+    logger = LogFactory.get_logger(specs.get("LogOptions"))
+    cache_options = specs.get("TrainOptions").get("UDFCacheOptions")
+    if cache_options is None or not cache_options.get("Enable"):
+        return None
+
+    # 每次训练在CacheDir下使用独立的子目录，同时运行的多个训练（如不同ObjIdx的IMNet）互不清空对方的缓存
+    cache_dir = os.path.join(cache_options.get("CacheDir"), "{}_{}".format(specs.get("TAG"), os.getpid()))
+    max_bytes = cache_options.get("MaxBytes")
+    logger.info("use udf cache, cache dir: {}, max bytes: {}".format(cache_dir, max_bytes))
+    return SceneUDFCache(cache_dir, max_bytes)
+
+
+def packed_collate(batch):
+    """
+    在default_collate的基础上将batch中所有浮点tensor（点云、udf数据）拼接为一个一维tensor，
+    训练时只需一次拷贝即可转到device上，由to_device在device上拆分
+    Returns:
+        {"packed": 拼接的浮点tensor, "others": 其余tensor, "shapes": 各项的形状, "is_float": 各项是否为浮点tensor}
+    """
+    data = data_utils.default_collate(batch)
+    is_float = [x.is_floating_point() for x in data]
+    return {
+        "packed": torch.cat([x.reshape(-1) for x, x_is_float in zip(data, is_float) if x_is_float]),
+        "others": [x for x, x_is_float in zip(data, is_float) if not x_is_float],
+        "shapes": [x.shape for x in data],
+        "is_float": is_float
+    }
+
+
+def to_device(data, device):
+    """
+    将dataloader的一个batch转到device上，从锁页内存拷贝时不阻塞
+    Args:
+        data: default_collate或packed_collate的结果
+    Returns:
+        tuple，与default_collate的结果相同
+    """
+    non_blocking = torch.device(get_map_location(device)).type == "cuda"
+    if not isinstance(data, dict):
+        return tuple(x.to(device, non_blocking=non_blocking) for x in data)
+
+    packed = data["packed"].to(device, non_blocking=non_blocking)
+    float_shapes = [shape for shape, x_is_float in zip(data["shapes"], data["is_float"]) if x_is_float]
+    floats = iter(x.view(shape) for x, shape in
+                  zip(torch.split(packed, [shape.numel() for shape in float_shapes]), float_shapes))
+    others = iter(x.to(device, non_blocking=non_blocking) for x in data["others"])
+    return tuple(next(floats) if x_is_float else next(others) for x_is_float in data["is_float"])
+
+
+def get_dataloader_kwargs(specs: dict):
+    """TrainOptions中的PinMemory只在CUDA上生效，PackedBatch为true时使用packed_collate"""
+    logger = LogFactory.get_logger(specs.get("LogOptions"))
+    train_options = specs.get("TrainOptions")
+    kwargs = dict()
+    if train_options.get("PinMemory", False) and torch.device(get_map_location(specs.get("Device"))).type == "cuda":
+        logger.info("use pinned memory")
+        kwargs["pin_memory"] = True
+    if train_options.get("PackedBatch", False):
+        logger.info("use packed batch")
+        kwargs["collate_fn"] = packed_collate
+    return kwargs
 
 
 def get_dataloader(dataset_class, specs: dict):
@@ -19,6 +90,8 @@ def get_dataloader(dataset_class, specs: dict):
     trian_options = specs.get("TrainOptions")
     batch_size = trian_options.get("BatchSize")
     num_data_loader_threads = trian_options.get("DataLoaderThreads")
+    queries_per_item = trian_options.get("QueriesPerItem")
+    use_fps_index = trian_options.get("UseFPSIndex", False)
 
     with open(train_split_file, "r") as f:
         train_split = json.load(f)
@@ -26,18 +99,29 @@ def get_dataloader(dataset_class, specs: dict):
         test_split = json.load(f)
 
     # get dataset
-    train_dataset = dataset_class(data_source, train_split)
-    test_dataset = dataset_class(data_source, test_split)
+    dataset_kwargs = dict()
+    udf_cache = get_udf_cache(specs)
+    if udf_cache is not None:
+        dataset_kwargs["udf_cache"] = udf_cache
+    if use_fps_index:
+        # 使用preprocess/get_fps_index.py预先计算的fps索引，编码器跳过在线采样
+        logger.info("use precomputed fps index")
+        dataset_kwargs["load_fps_index"] = True
+    # 训练时每个样本每个epoch随机取QueriesPerItem个查询点，测试时使用全部查询点
+    train_dataset = dataset_class(data_source, train_split, queries_per_item=queries_per_item, **dataset_kwargs)
+    test_dataset = dataset_class(data_source, test_split, **dataset_kwargs)
     logger.info("length of train_dataset: {}".format(train_dataset.__len__()))
     logger.info("length of test_dataset: {}".format(test_dataset.__len__()))
 
     # get dataloader
+    dataloader_kwargs = get_dataloader_kwargs(specs)
     train_dataloader = data_utils.DataLoader(
         train_dataset,
         batch_size=batch_size,
         shuffle=True,
         num_workers=num_data_loader_threads,
         drop_last=False,
+        **dataloader_kwargs
     )
     test_dataloader = data_utils.DataLoader(
         test_dataset,
@@ -45,6 +129,7 @@ def get_dataloader(dataset_class, specs: dict):
         shuffle=True,
         num_workers=num_data_loader_threads,
         drop_last=False,
+        **dataloader_kwargs
     )
     logger.info("length of train_dataloader: {}".format(train_dataloader.__len__()))
     logger.info("length of test_dataloader: {}".format(test_dataloader.__len__()))
@@ -52,6 +137,23 @@ def get_dataloader(dataset_class, specs: dict):
     return train_dataloader, test_dataloader
 
 
+def get_fps_index(data, device):
+    """从dataloader的一个batch中取出预先计算的fps索引，dataset未加载fps索引时返回(None, None)"""
+    if len(data) <= 4:
+        return None, None
+    fps_idx1, fps_idx2 = data[4:6]
+    return fps_idx1.to(device), fps_idx2.to(device)
+
+
+def get_para_save_path(specs):
+    return os.path.join(specs.get("ParaSaveDir"), specs.get("TAG"))
+
+
+def get_continue_from_epoch(specs):
+    """ContinueFromEpoch可以是epoch序号，也可以是"latest"或"best"，由保存目录下的checkpoint索引确定序号"""
+    return resolve_checkpoint_epoch(get_para_save_path(specs), specs.get("TrainOptions").get("ContinueFromEpoch"))
+
+
 def get_checkpoint(specs):
     device = specs.get("Device")
     pre_train = specs.get("TrainOptions").get("PreTrain")
@@ -62,12 +164,11 @@ def get_checkpoint(specs):
     checkpoint = None
     if continue_train:
         logger.info("continue train mode")
-        continue_from_epoch = specs.get("TrainOptions").get("ContinueFromEpoch")
-        para_save_dir = specs.get("ParaSaveDir")
-        para_save_path = os.path.join(para_save_dir, specs.get("TAG"))
+        continue_from_epoch = get_continue_from_epoch(specs)
+        para_save_path = get_para_save_path(specs)
         checkpoint_path = os.path.join(para_save_path, "epoch_{}.pth".format(continue_from_epoch))
         logger.info("load checkpoint from {}".format(checkpoint_path))
-        checkpoint = torch.load(checkpoint_path, map_location="cuda:{}".format(device))
+        checkpoint = torch.load(checkpoint_path, map_location=get_map_location(device))
     return checkpoint
 
 
@@ -106,7 +207,6 @@ def get_lr_scheduler_info(specs: dict):
     lr_options = train_options.get("LearningRateOptions")
     lr_scheduler_type = lr_options.get("LRScheduler")
     continue_train = train_options.get("ContinueTrain")
-    last_epoch = train_options.get("ContinueFromEpoch")
 
     lr_scheduler_class = None
     kwargs = {}
@@ -121,7 +221,7 @@ def get_lr_scheduler_info(specs: dict):
         raise Exception("lr scheduler type not support")
     
     if continue_train:
-        kwargs["last_epoch"] = last_epoch
+        kwargs["last_epoch"] = get_continue_from_epoch(specs)
 
     return lr_scheduler_class, kwargs
 
@@ -149,21 +249,47 @@ def get_tensorboard_writer(specs):
     return SummaryWriter(writer_path)
 
 
-def save_model(specs, model, lr_schedule, optimizer, epoch):
-    para_save_dir = specs.get("ParaSaveDir")
-    para_save_path = os.path.join(para_save_dir, specs.get("TAG"))
-    if not os.path.isdir(para_save_path):
-        os.makedirs(para_save_path)
-    
+def get_checkpoint_state(model, lr_schedule, optimizer, epoch, grad_scaler=None):
+    """混合精度训练时参数仍为float32，checkpoint与精度无关；fp16训练时额外记录GradScaler的状态"""
     checkpoint = {
         "epoch": epoch,
         "model": model.state_dict(),
         "lr_schedule": lr_schedule.state_dict(),
         "optimizer": optimizer.state_dict()
     }
+    if grad_scaler is not None and grad_scaler.is_enabled():
+        checkpoint["grad_scaler"] = grad_scaler.state_dict()
+    return checkpoint
+
+
+def save_model(specs, model, lr_schedule, optimizer, epoch):
+    para_save_path = get_para_save_path(specs)
+    if not os.path.isdir(para_save_path):
+        os.makedirs(para_save_path)
+
+    checkpoint = get_checkpoint_state(model, lr_schedule, optimizer, epoch)
     checkpoint_filename = os.path.join(para_save_path, "epoch_{}.pth".format(epoch))
 
-    torch.save(checkpoint, checkpoint_filename)
+    atomic_save(checkpoint, checkpoint_filename)
+
+
+def get_checkpoint_writer(specs):
+    """
+    根据TrainOptions中的CheckpointOptions构造CheckpointWriter，未配置时与原来相同：同步写入并保留全部checkpoint
+    CheckpointOptions: {"Async": 是否后台写入, "KeepLast": 保留最近的checkpoint数, "KeepBest": 是否保留测试损失最小的checkpoint,
+                        "EveryNEpochs": 额外保留序号为其整数倍的checkpoint}
+    """
+    logger = LogFactory.get_logger(specs.get("LogOptions"))
+    checkpoint_options = specs.get("TrainOptions").get("CheckpointOptions") or dict()
+    keep_last = checkpoint_options.get("KeepLast")
+    keep_best = checkpoint_options.get("KeepBest", True)
+    every_n_epochs = checkpoint_options.get("EveryNEpochs")
+    async_write = checkpoint_options.get("Async", False)
+    logger.info("checkpoint options, async: {}, keep last: {}, keep best: {}, every n epochs: {}"
+                .format(async_write, keep_last, keep_best, every_n_epochs))
+    return CheckpointWriter(get_para_save_path(specs), keep_last=keep_last, keep_best=keep_best,
+                            every_n_epochs=every_n_epochs, async_write=async_write,
+                            resume=bool(specs.get("TrainOptions").get("ContinueTrain")))
 
 
 def record_loss_info(specs: dict, tag: str, avrg_loss, epoch: int, tensorboard_writer: SummaryWriter):
@@ -171,3 +297,315 @@ def record_loss_info(specs: dict, tag: str, avrg_loss, epoch: int, tensorboard_w
     tensorboard_writer.add_scalar("{}".format(tag), avrg_loss, epoch)
     logger.info('{}: {}'.format(tag, avrg_loss))
 
+
+def reset_udf_cache_stats(dataset):
+    """每个训练epoch开始时清零udf缓存的计数，测试集共享同一个缓存，其访问不计入下一个epoch的命中率"""
+    udf_cache = getattr(dataset, "udf_cache", None)
+    if udf_cache is not None:
+        udf_cache.reset_stats()
+
+
+def record_udf_cache_info(specs: dict, dataset, epoch: int, tensorboard_writer: SummaryWriter):
+    """记录当前训练epoch内udf缓存的命中率"""
+    udf_cache = getattr(dataset, "udf_cache", None)
+    if udf_cache is None:
+        return
+    logger = LogFactory.get_logger(specs.get("LogOptions"))
+    stats = udf_cache.get_stats()
+    tensorboard_writer.add_scalar("udf_cache_hit_rate", stats["hit_rate"], epoch)
+    logger.info("udf cache hits: {}, misses: {}, hit rate: {}, used bytes: {}"
+                .format(stats["hits"], stats["misses"], stats["hit_rate"], stats["used_bytes"]))
+
+
+def get_udf_losses(udf_preds, udf_gts):
+    """
+    各个物体的udf的L1与L2损失的平均
+    Args:
+        udf_preds: tensor或tensor的tuple，网络的输出
+        udf_gts: tensor的tuple，与udf_preds一一对应
+    Returns:
+        {"loss_l1": tensor, "loss_l2": tensor}
+    """
+    if not isinstance(udf_preds, tuple):
+        udf_preds = (udf_preds,)
+    l1_loss = sum(torch.nn.functional.l1_loss(pred, gt) for pred, gt in zip(udf_preds, udf_gts)) / len(udf_gts)
+    l2_loss = sum(torch.nn.functional.mse_loss(pred, gt) for pred, gt in zip(udf_preds, udf_gts)) / len(udf_gts)
+    return {"loss_l1": l1_loss, "loss_l2": l2_loss}
+
+
+def to_float32(outputs):
+    if isinstance(outputs, tuple):
+        return tuple(output.float() for output in outputs)
+    return outputs.float()
+
+
+def save_model_hook(trainer, epoch: int):
+    """默认的epoch结束hook，每个epoch交给CheckpointWriter保存一次checkpoint，由其按保留策略删除旧的checkpoint"""
+    test_loss = trainer.test_losses["loss_l1"] if trainer.test_losses is not None else None
+    trainer.checkpoint_writer.save(
+        get_checkpoint_state(trainer.network, trainer.lr_scheduler, trainer.optimizer, epoch, trainer.grad_scaler),
+        epoch, test_loss)
+
+
+class Trainer:
+    """
+    三个训练脚本共用的训练循环，脚本只需提供网络与batch的转换
+    hooks:
+        transfer_batch(data, device) -> (inputs, udf_gts)：将dataloader的一个batch转到device上，
+            inputs为网络的输入，udf_gts为各个物体的udf真值
+        forward(network, inputs) -> udf_preds：默认为network(*inputs)
+        encode(network, inputs) -> (latent, query_points)：只运行编码器，按查询点分块训练时必须提供，
+            解码使用network.decode(latent, query_points, chunk_size)
+        compute_loss(udf_preds, udf_gts) -> {损失名: tensor}：默认为get_udf_losses，反向传播TrainOptions.LossName对应的损失
+        step_end_hooks: [hook(trainer, epoch, step, losses)]，每次前向后调用，losses为detach后仍在device上的损失
+        epoch_end_hooks: [hook(trainer, epoch)]，每个epoch训练与测试结束后调用，默认保存checkpoint，
+            trainer.test_losses为本epoch的测试损失，未测试时为None
+    TrainOptions中的开关：
+        Precision: "fp32"、"bf16"（bfloat16 autocast，CPU上同样可用）或"fp16"（float16 autocast并用GradScaler缩放梯度），
+            参数与优化器状态始终为float32
+        AccumulationSteps: 梯度累积的batch数
+        TestInterval: 每隔多少个epoch测试一次，最后一个epoch总是测试
+        LogInterval: 每隔多少个step输出一次当前epoch的平均损失，为null时只在epoch结束时输出
+        QueryChunkSize: 每个形状每块的查询点数，为null时不分块；分块时每个batch只编码一次，解码器按块前向与反向，
+            梯度累积到latent上后再对编码器反向一次，解码器的激活只保留一块
+        ProfileOptions: {"Enable", "Wait", "Warmup", "Active", "TraceDir"}，对训练的第一个epoch使用torch.profiler
+        CheckpointOptions: 见get_checkpoint_writer
+    """
+
+    def __init__(self, specs: dict, network, optimizer, lr_scheduler, tensorboard_writer, transfer_batch,
+                 forward=None, compute_loss=None, step_end_hooks=None, epoch_end_hooks=None, checkpoint=None,
+                 encode=None):
+        train_options = specs.get("TrainOptions")
+        self.specs = specs
+        self.logger = LogFactory.get_logger(specs.get("LogOptions"))
+        self.device = specs.get("Device")
+        self.network = network
+        self.optimizer = optimizer
+        self.lr_scheduler = lr_scheduler
+        self.tensorboard_writer = tensorboard_writer
+
+        self.transfer_batch = transfer_batch
+        self.forward = forward if forward is not None else lambda network, inputs: network(*inputs)
+        self.compute_loss = compute_loss if compute_loss is not None else get_udf_losses
+        self.encode = encode
+        self.step_end_hooks = list(step_end_hooks) if step_end_hooks is not None else []
+        self.epoch_end_hooks = list(epoch_end_hooks) if epoch_end_hooks is not None else [save_model_hook]
+
+        self.loss_name = train_options.get("LossName", "loss_l2")
+        self.accumulation_steps = train_options.get("AccumulationSteps", 1)
+        self.test_interval = train_options.get("TestInterval", 1)
+        self.log_interval = train_options.get("LogInterval")
+        self.query_chunk_size = train_options.get("QueryChunkSize")
+        if self.query_chunk_size is not None:
+            if self.encode is None:
+                raise ValueError("QueryChunkSize requires an encode hook")
+            self.logger.info("decode queries in chunks of {}".format(self.query_chunk_size))
+        self.profile_options = train_options.get("ProfileOptions", {})
+
+        self.device_type = torch.device(get_map_location(self.device)).type
+        self.precision = train_options.get("Precision", "fp32")
+        if self.precision not in PRECISION_TYPES:
+            raise ValueError("unsupported precision: {}, expected one of {}".format(self.precision, PRECISION_TYPES))
+        self.logger.info("train with precision: {}".format(self.precision))
+        self.amp_dtype = torch.float16 if self.precision == "fp16" else torch.bfloat16
+        # bfloat16的指数范围与float32相同，不需要缩放梯度
+        self.grad_scaler = torch.amp.GradScaler(self.device_type, enabled=self.precision == "fp16")
+        if checkpoint is not None and "grad_scaler" in checkpoint and self.grad_scaler.is_enabled():
+            self.grad_scaler.load_state_dict(checkpoint["grad_scaler"])
+            self.logger.info("load grad_scaler parameter from epoch {}".format(checkpoint["epoch"]))
+
+        self.checkpoint_writer = get_checkpoint_writer(specs)
+        self.test_losses = None
+        self.best_loss = 1e8
+        self.best_epoch = -1
+
+    def autocast(self):
+        return torch.autocast(self.device_type, dtype=self.amp_dtype, enabled=self.precision != "fp32")
+
+    def get_profiler(self):
+        if not self.profile_options.get("Enable", False):
+            return None
+        trace_dir = os.path.join(self.profile_options.get("TraceDir", "profile_logs"), self.specs.get("TAG"))
+        self.logger.info("profile the first epoch, trace dir: {}".format(trace_dir))
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.device_type == "cuda":
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        schedule = torch.profiler.schedule(wait=self.profile_options.get("Wait", 1),
+                                           warmup=self.profile_options.get("Warmup", 1),
+                                           active=self.profile_options.get("Active", 3), repeat=1)
+        return torch.profiler.profile(activities=activities, schedule=schedule,
+                                      on_trace_ready=torch.profiler.tensorboard_trace_handler(trace_dir))
+
+    @staticmethod
+    def accumulate_losses(total_losses: dict, losses: dict):
+        """在device上累加损失，不调用item()，避免每个step都同步一次"""
+        for name, loss in losses.items():
+            total_losses[name] = total_losses.get(name, 0) + loss.detach()
+
+    def record_losses(self, prefix: str, total_losses: dict, steps: int, epoch: int):
+        """每个epoch只在这里将累加的损失读回host"""
+        losses = {name: (total_loss / max(steps, 1)).item() for name, total_loss in total_losses.items()}
+        for name, loss in losses.items():
+            record_loss_info(self.specs, "{}_{}".format(prefix, name), loss, epoch, self.tensorboard_writer)
+        return losses
+
+    def optimizer_step(self):
+        self.grad_scaler.step(self.optimizer)
+        self.grad_scaler.update()
+        self.optimizer.zero_grad()
+
+    def backward(self, inputs, udf_gts):
+        """
+        Returns:
+            losses: detach后的损失
+        """
+        with self.autocast():
+            udf_preds = self.forward(self.network, inputs)
+        # 损失在float32下计算
+        losses = self.compute_loss(to_float32(udf_preds), udf_gts)
+        # 累积梯度时各个batch的损失取平均
+        self.grad_scaler.scale(losses[self.loss_name] / self.accumulation_steps).backward()
+        return {name: loss.detach() for name, loss in losses.items()}
+
+    def backward_query_chunked(self, inputs, udf_gts):
+        """
+        编码一次，解码器按QueryChunkSize分块前向与反向，latent的梯度在各块间累积，最后对编码器反向一次
+        compute_loss为各查询点损失的平均时，各块的损失按块内查询点数加权求和与不分块的损失相同，梯度也相同
+        Returns:
+            losses: detach后的损失
+        """
+        with self.autocast():
+            latent, query_points = self.encode(self.network, inputs)
+        # 解码器的反向只传到这个叶子节点，编码器的计算图保留到最后
+        latent_leaf = latent.detach().requires_grad_()
+        batch_size = latent.shape[0]
+        query_points_num = query_points.shape[0] // batch_size
+        query_points = query_points.view(batch_size, query_points_num, -1)
+        udf_gts = [udf_gt.view(batch_size, query_points_num) for udf_gt in udf_gts]
+
+        losses = dict()
+        for begin in range(0, query_points_num, self.query_chunk_size):
+            end = min(begin + self.query_chunk_size, query_points_num)
+            weight = (end - begin) / query_points_num
+            chunk = query_points[:, begin: end].reshape(-1, query_points.shape[-1])
+            with self.autocast():
+                udf_preds = self.network.decode(latent_leaf, chunk)
+            chunk_losses = self.compute_loss(to_float32(udf_preds),
+                                             [udf_gt[:, begin: end].reshape(-1) for udf_gt in udf_gts])
+            self.grad_scaler.scale(chunk_losses[self.loss_name] * weight / self.accumulation_steps).backward()
+            self.accumulate_losses(losses, {name: loss * weight for name, loss in chunk_losses.items()})
+        # latent_leaf.grad已经包含GradScaler的缩放
+        latent.backward(latent_leaf.grad)
+        return losses
+
+    def train_epoch(self, train_dataloader, epoch: int, profiler=None):
+        self.network.train()
+        self.logger.info("")
+        self.logger.info('epoch: {}, learning rate: {}'.format(epoch, self.optimizer.param_groups[0]["lr"]))
+
+        total_losses = dict()
+        self.optimizer.zero_grad()
+        reset_udf_cache_stats(train_dataloader.dataset)
+        step = -1
+        time_begin = time.time()
+        for step, data in enumerate(train_dataloader):
+            inputs, udf_gts = self.transfer_batch(data, self.device)
+            if self.query_chunk_size is None:
+                losses = self.backward(inputs, udf_gts)
+            else:
+                losses = self.backward_query_chunked(inputs, udf_gts)
+            if (step + 1) % self.accumulation_steps == 0:
+                self.optimizer_step()
+
+            self.accumulate_losses(total_losses, losses)
+            if self.log_interval is not None and (step + 1) % self.log_interval == 0:
+                self.logger.info("step: {}, {}".format(step + 1, ", ".join(
+                    "{}: {}".format(name, (total_loss / (step + 1)).item()) for name, total_loss in total_losses.items())))
+            for hook in self.step_end_hooks:
+                hook(self, epoch, step, losses)
+            if profiler is not None:
+                profiler.step()
+        # 最后不足AccumulationSteps个batch的梯度
+        if (step + 1) % self.accumulation_steps != 0:
+            self.optimizer_step()
+
+        self.lr_scheduler.step()
+
+        losses = self.record_losses("train", total_losses, step + 1, epoch)
+        self.logger.info("average step time: {}".format((time.time() - time_begin) / max(step + 1, 1)))
+        record_udf_cache_info(self.specs, train_dataloader.dataset, epoch, self.tensorboard_writer)
+        return losses
+
+    def test_epoch(self, test_dataloader, epoch: int):
+        self.network.eval()
+
+        total_losses = dict()
+        step = -1
+        with torch.no_grad():
+            for step, data in enumerate(test_dataloader):
+                inputs, udf_gts = self.transfer_batch(data, self.device)
+                with self.autocast():
+                    if self.query_chunk_size is None:
+                        udf_preds = self.forward(self.network, inputs)
+                    else:
+                        latent, query_points = self.encode(self.network, inputs)
+                        udf_preds = self.network.decode(latent, query_points, self.query_chunk_size)
+                self.accumulate_losses(total_losses, self.compute_loss(to_float32(udf_preds), udf_gts))
+
+        losses = self.record_losses("test", total_losses, step + 1, epoch)
+        if losses["loss_l1"] < self.best_loss:
+            self.best_epoch = epoch
+            self.best_loss = losses["loss_l1"]
+            self.logger.info('current best epoch: {}, cd: {}'.format(self.best_epoch, self.best_loss))
+        return losses
+
+    def fit(self, train_dataloader, test_dataloader):
+        """从ContinueFromEpoch的下一个epoch（或第0个epoch）训练到NumEpochs"""
+        train_options = self.specs.get("TrainOptions")
+        epoch_num = train_options.get("NumEpochs")
+        epoch_begin = 0
+        if train_options.get("ContinueTrain"):
+            epoch_begin = get_continue_from_epoch(self.specs) + 1
+            self.logger.info("continue train from epoch {}".format(epoch_begin))
+
+        training_error = None
+        try:
+            self.train_epochs(train_dataloader, test_dataloader, epoch_begin, epoch_num)
+        except BaseException as e:
+            training_error = e
+            raise
+        finally:
+            # 删除udf缓存目录，释放tmpfs占用的内存
+            for dataloader in (train_dataloader, test_dataloader):
+                udf_cache = getattr(dataloader.dataset, "udf_cache", None)
+                if udf_cache is not None:
+                    udf_cache.close()
+            # 等待后台线程写完最后的checkpoint，训练已因异常中止时写入的错误只记录日志，不覆盖原本的异常
+            try:
+                self.checkpoint_writer.close()
+            except RuntimeError:
+                if training_error is None:
+                    raise
+                self.logger.exception("failed to write checkpoint")
+
+    def train_epochs(self, train_dataloader, test_dataloader, epoch_begin: int, epoch_num: int):
+        for epoch in range(epoch_begin, epoch_num + 1):
+            time_begin_train = time.time()
+            profiler = self.get_profiler() if epoch == epoch_begin else None
+            if profiler is not None:
+                with profiler:
+                    self.train_epoch(train_dataloader, epoch, profiler)
+            else:
+                self.train_epoch(train_dataloader, epoch)
+            time_end_train = time.time()
+            self.logger.info("use {} to train".format(time_end_train - time_begin_train))
+
+            self.test_losses = None
+            if (epoch - epoch_begin + 1) % self.test_interval == 0 or epoch == epoch_num:
+                time_begin_test = time.time()
+                self.test_losses = self.test_epoch(test_dataloader, epoch)
+                time_end_test = time.time()
+                self.logger.info("use {} to test".format(time_end_test - time_begin_test))
+
+            for hook in self.epoch_end_hooks:
+                hook(self, epoch)
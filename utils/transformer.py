@@ -24,8 +24,10 @@ class PN2_Encoder(nn.Module):
         l0_points = point_cloud
 
         l1_xyz, l1_points, idx1 = self.sa_module_1(l0_xyz, l0_points)  # (B, 3, 512), (B, 128, 512)
-        l1_points = self.transformer_1(l1_points, l1_xyz)
-        l2_xyz, l2_points, idx2 = self.sa_module_2(l1_xyz, l1_points)  # (B, 3, 128), (B, 256, 512)
+        # transformer_1中l1_xyz的knn索引同时供sa_module_2分组使用
+        idx_knn1 = self.transformer_1.get_knn_index(l1_xyz)
+        l1_points = self.transformer_1(l1_points, l1_xyz, idx_knn1)
+        l2_xyz, l2_points, idx2 = self.sa_module_2(l1_xyz, l1_points, xyz_knn_idx=idx_knn1)  # (B, 3, 128), (B, 256, 512)
         l2_points = self.transformer_2(l2_points, l2_xyz)
         l3_xyz, l3_points = self.sa_module_3(l2_xyz, l2_points)  # (B, 3, 1), (B, out_dim, 1)
 